@@ -37,6 +37,13 @@ app.conf.beat_schedule = {
             'expires': 60 * 60 * 24,
         },
     },
+    'contest-replay-builder': {
+        'task': 'judge.tasks.contest.build_ended_contest_replays',
+        'schedule': crontab(**settings.VNOJ_CONTEST_REPLAY_BUILDER_CRONTAB_KWARGS),
+        'options': {
+            'expires': 60 * 5,
+        },
+    },
     'organization-monthly-reset': {
         'task': 'judge.tasks.organization.organization_monthly_reset',
         'schedule': crontab(minute=0, hour=0, day_of_month=1),
@@ -113,6 +113,19 @@ VNOJ_PROBLEM_TIMELIMIT_LIMIT = 5
 # Maximum contest duration (day) that a user can set for a contest
 # without the `long_contest_duration` permission
 VNOJ_CONTEST_DURATION_LIMIT = 14
+# If True, each site process keeps the full ranking of the contests it shows in memory, reloading only the
+# participations that changed, and the ranking page polls for just those changes
+VNOJ_LIVE_SCOREBOARD = True
+# Seconds after which a live ranking is reloaded in full anyway, to pick up changes to user profiles
+VNOJ_LIVE_SCOREBOARD_MAX_AGE = 600
+# Maximum number of changes a live ranking catches up on one by one, rather than reloading in full
+VNOJ_LIVE_SCOREBOARD_MAX_DELTA = 1000
+# Seconds for which an expired scoreboard cache entry is still served while one request rebuilds it
+VNOJ_SCOREBOARD_CACHE_STALE_TIME = 60
+# Seconds after which a scoreboard rebuild that has not finished is assumed to have failed
+VNOJ_SCOREBOARD_CACHE_LOCK_TIME = 30
+# If True, expired scoreboard cache entries are rebuilt by a Celery worker rather than by the request that finds them
+VNOJ_SCOREBOARD_CACHE_CELERY_REFRESH = False
 # Maximum number of test cases that a user can create for a problem
 # without the `create_mass_testcases` permission
 VNOJ_TESTCASE_HARD_LIMIT = 100
@@ -304,8 +317,11 @@ DMOJ_CONTEST_DATA_DOWNLOAD_RATELIMIT = datetime.timedelta(days=1)
 
 # directory to store replay JSON files;
 CONTEST_REPLAY_MEDIA_DIR = 'contest_replay'
-# Internal path to serve replay JSON files with X-Accel-Redirect
+# Internal path to serve replay JSON files with X-Accel-Redirect;
+# enable gzip_static (and brotli_static) there to serve the compressed copies written next to them
 DMOJ_CONTEST_REPLAY_INTERNAL = None
+# How often to write the replay data of contests that just ended
+VNOJ_CONTEST_REPLAY_BUILDER_CRONTAB_KWARGS = {'minute': '*/5'}
 
 DMOJ_COMMENT_VOTE_HIDE_THRESHOLD = -5
 DMOJ_COMMENT_REPLY_TIMEFRAME = datetime.timedelta(days=365)
@@ -784,6 +800,58 @@ BRIDGED_JUDGE_ADDRESS = [('localhost', 9999)]
 BRIDGED_JUDGE_PROXIES = None
 BRIDGED_DJANGO_ADDRESS = [('localhost', 9998)]
 BRIDGED_DJANGO_CONNECT = None
+# If True, each process keeps its connections to the bridge open, instead of connecting for every request.
+BRIDGED_DJANGO_KEEPALIVE = False
+# Limits on how many submissions, and how many bytes of source, go into a single batch request to the bridge.
+BRIDGED_DJANGO_BATCH_SIZE = 500
+BRIDGED_DJANGO_BATCH_SOURCE_SIZE = 4 * 1024 * 1024
+# Codec for requests to the bridge, which replies in kind: 'json', or 'msgpack' if msgpack is installed.
+BRIDGED_DJANGO_CODEC = 'json'
+# Codecs the bridge agrees to when a judge offers them in its handshake. Judges that offer none use JSON.
+BRIDGED_JUDGE_CODECS = ['msgpack', 'json']
+# zlib compression level for bridge packets, from 0 to 9; -1 is zlib's default.
+BRIDGED_ZLIB_LEVEL = -1
+# Preset zlib dictionary offered to judges that support one: bytes, or True for judge.bridge.codec.PACKET_DICTIONARY.
+BRIDGED_ZLIB_DICTIONARY = None
+
+# Number of test case results the bridge may hold in memory before writing them to the database.
+# Buffered results are also written at the end of every batch and submission, and once the oldest
+# has waited BRIDGED_TEST_CASE_BUFFER_TIME seconds. 0 writes every test case packet immediately.
+BRIDGED_TEST_CASE_BUFFER_SIZE = 0
+BRIDGED_TEST_CASE_BUFFER_TIME = 1
+
+# If True, the bridge queues the submissions that were still waiting or being graded when it last stopped.
+# Otherwise, they are marked as internal errors and have to be rejudged.
+BRIDGED_RECOVER_QUEUE = True
+
+# Number of recently graded problems the bridge remembers per judge, as their test data is likely still cached there.
+BRIDGED_LOCALITY_CACHE_SIZE = 32
+# If True, a submission goes to a free judge that recently graded its problem, rather than to the least loaded one,
+# unless that judge reports more than BRIDGED_LOCALITY_LOAD_TOLERANCE higher load.
+BRIDGED_LOCALITY_DISPATCH = False
+BRIDGED_LOCALITY_LOAD_TOLERANCE = 0.5
+# With BRIDGED_LOCALITY_DISPATCH, a free judge taking from the queue prefers a submission to a problem it recently
+# graded over the oldest one it can grade, if it was queued at most this many seconds later
+BRIDGED_LOCALITY_QUEUE_TOLERANCE = 10
+
+# If set, queued rejudges count as arriving BRIDGED_QUEUE_AGING_TIME seconds later per priority below normal, and then
+# queue with normal submissions, so that a busy site does not starve them forever. None keeps priorities strict.
+BRIDGED_QUEUE_AGING_TIME = None
+# Fraction of recent dispatches guaranteed to rejudges while any are queued, e.g. 0.1. 0 guarantees nothing.
+BRIDGED_REJUDGE_MIN_SHARE = 0
+# Seconds a contest submission may wait before it goes first regardless of the two settings above.
+BRIDGED_CONTEST_LATENCY_TARGET = None
+
+# URL of a Redis-compatible store, e.g. 'redis://localhost:6379/2', through which several bridge processes share one
+# queue and one registry of judges. They then all listen on the addresses above, so that judges and the site can
+# connect to any of them, and pass requests on to each other through ephemeral ports on BRIDGED_SHARED_PEER_HOST.
+BRIDGED_SHARED_STORE = None
+BRIDGED_SHARED_PREFIX = 'bridge'
+BRIDGED_SHARED_PEER_HOST = 'localhost'
+
+# Addresses to serve the bridge's metrics on, in the Prometheus text format at /metrics, e.g. [('localhost', 9995)].
+# There is no authentication, so keep them local. The same numbers are available to the site through the bridge.
+BRIDGED_METRICS_ADDRESS = None
 
 # Event Server configuration
 EVENT_DAEMON_USE = False
@@ -791,6 +859,11 @@ EVENT_DAEMON_POST = 'ws://localhost:9997/'
 EVENT_DAEMON_GET = 'ws://localhost:9996/'
 EVENT_DAEMON_POLL = '/channels/'
 EVENT_DAEMON_KEY = None
+# If True, events are posted from a background thread, in batches, instead of waiting for the event daemon.
+# Pending refreshes of the same submission or contest are merged when the event daemon falls behind.
+EVENT_DAEMON_POST_ASYNC = False
+EVENT_DAEMON_POST_QUEUE_SIZE = 10000
+EVENT_DAEMON_POST_BATCH_SIZE = 100
 EVENT_DAEMON_AMQP_EXCHANGE = 'dmoj-events'
 EVENT_DAEMON_SUBMISSION_KEY = '6Sdmkx^%pk@GsifDfXcwX*Y7LRF%RGT8vmFpSxFBT$fwS7trc8raWfN#CSfQuKApx&$B#Gh2L7p%W!Ww'
 EVENT_DAEMON_CONTEST_KEY = '&w7hB-.9WnY2Jj^Qm+|?o6a<!}_2Wiw+?(_Yccqq{uR;:kWQP+3R<r(ICc|4^dDeEuJE{*D;Gg@K(4K>'
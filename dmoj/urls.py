@@ -254,6 +254,7 @@ urlpatterns = [
         path('/announce', contests.ContestAnnounce.as_view(), name='contest_announce'),
         path('/clone', contests.ContestClone.as_view(), name='contest_clone'),
         path('/ranking/', contests.ContestRanking.as_view(), name='contest_ranking'),
+        path('/ranking/virtual/', contests.ContestVirtualRank.as_view(), name='contest_virtual_rank'),
         path('/replay/<int:version>/', contests.ContestReplayData.as_view(), name='contest_replay_data'),
         path('/public_ranking/', contests.ContestPublicRanking.as_view(), name='contest_public_ranking'),
         path('/official_ranking/', contests.ContestOfficialRanking.as_view(), name='contest_official_ranking'),
@@ -375,6 +376,7 @@ urlpatterns = [
         path('single_submission', submission.single_submission, name='submission_single_query'),
         path('submission_testcases', submission.SubmissionTestCaseQuery.as_view(), name='submission_testcases_query'),
         path('status-table', status.status_table, name='status_table'),
+        path('status-bridge', status.status_bridge, name='status_bridge'),
 
         path('template', problem.LanguageTemplateAjax.as_view(), name='language_template_ajax'),
 
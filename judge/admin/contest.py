@@ -1,7 +1,7 @@
 from adminsortable2.admin import SortableAdminBase, SortableInlineAdminMixin
 from django.contrib import admin
 from django.core.exceptions import PermissionDenied
-from django.db import connection, transaction
+from django.db import transaction
 from django.db.models import F, Q, TextField
 from django.forms import ModelForm, ModelMultipleChoiceField
 from django.http import Http404, HttpResponseRedirect
@@ -15,8 +15,8 @@ from django.views.decorators.http import require_POST
 from reversion.admin import VersionAdmin
 
 from judge.admin.utils import AdminFastPaginationMixin
-from judge.models import Contest, ContestAnnouncement, ContestProblem, ContestSubmission, Profile, Rating, Submission
-from judge.ratings import rate_contest
+from judge.models import Contest, ContestAnnouncement, ContestProblem, ContestSubmission, Profile, Submission
+from judge.utils.celery import redirect_to_task_status
 from judge.utils.views import NoBatchDeleteMixin
 from judge.widgets import AdminAceWidget, AdminHeavySelect2MultipleWidget, AdminHeavySelect2Widget, \
     AdminMartorWidget, AdminSelect2MultipleWidget
@@ -292,6 +292,8 @@ class ContestAdmin(AdminFastPaginationMixin, NoBatchDeleteMixin, SortableAdminBa
         if not contest.ended:
             raise Http404()
         Contest.objects.filter(pk=contest.pk).update(replay_version=F('replay_version') + 1)
+        from judge.tasks import build_contest_replay
+        transaction.on_commit(build_contest_replay.s(contest.key).delay)
         return HttpResponseRedirect(request.headers.get('referer', reverse('admin:judge_contest_changelist')))
 
     def set_locked_after(self, contest, locked_after):
@@ -355,13 +357,10 @@ class ContestAdmin(AdminFastPaginationMixin, NoBatchDeleteMixin, SortableAdminBa
     def rate_all_view(self, request):
         if not request.user.has_perm('judge.contest_rating'):
             raise PermissionDenied()
-        with transaction.atomic():
-            with connection.cursor() as cursor:
-                cursor.execute('TRUNCATE TABLE `%s`' % Rating._meta.db_table)
-            Profile.objects.update(rating=None)
-            for contest in Contest.objects.filter(is_rated=True, end_time__lte=timezone.now()).order_by('end_time'):
-                rate_contest(contest)
-        return HttpResponseRedirect(reverse('admin:judge_contest_changelist'))
+        from judge.tasks import rate_all_contests
+        status = rate_all_contests.delay()
+        return redirect_to_task_status(status, message=_('Rating all contests...'),
+                                       redirect=reverse('admin:judge_contest_changelist'))
 
     @method_decorator(require_POST)
     def rate_view(self, request, id):
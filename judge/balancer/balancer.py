@@ -1,13 +1,14 @@
 import hmac
 import logging
 import threading
-from collections import deque
 from functools import partial
+from random import random
 from threading import RLock
 
 from django.conf import settings
 
 from judge.balancer.bridge_handler import BridgeHandler
+from judge.balancer.fair_queue import FairQueue
 from judge.balancer.judge_handler import JudgeHandler
 from judge.bridge.server import Server
 
@@ -20,10 +21,11 @@ class JudgeBalancer:
         self.executors = {}
         self.config = config
         self.judges = set()
-        self.queue = deque()
+        self.queue = FairQueue()
         self.lock = RLock()
         self.judge_to_bridge = {}
         self.bridge_to_judge = {}
+        self._configure_sites(config['bridges'])
 
         self.judge_server = Server(
             settings.BALANCER_JUDGE_ADDRESS,
@@ -35,6 +37,21 @@ class JudgeBalancer:
             bridge_id = len(self.bridges)
             self.bridges.append(BridgeHandler(balancer=self, bridge_id=bridge_id, **bridge))
 
+    def _configure_sites(self, bridges):
+        # Connections to the same bridge share one fair queue, with the weight and judge cap of its first entry.
+        self.bridge_sites = []
+        self.site_caps = {}
+        for bridge in bridges:
+            site = (bridge['host'], bridge['port'])
+            self.bridge_sites.append(site)
+            if site not in self.queue.weights:
+                self.queue.configure(site, bridge.get('weight', 1))
+                self.site_caps[site] = bridge.get('max_judges')
+
+    def _site_has_capacity(self, site):
+        cap = self.site_caps.get(site)
+        return cap is None or sum(self.bridge_sites[bridge_id] == site for bridge_id in self.bridge_to_judge) < cap
+
     def run(self):
         threading.Thread(target=self.judge_server.serve_forever).start()
         for bridge in self.bridges:
@@ -57,10 +74,16 @@ class JudgeBalancer:
 
     def _try_judge(self):
         with self.lock:
-            available = [judge for judge in self.judges if not judge.working]
-            while available and self.queue:
+            # Judges report load per core, so the least loaded judge is the one with the most spare capacity, and one
+            # with more cores takes on more work before it looks as busy as a small one.
+            available = sorted((judge for judge in self.judges if not judge.working),
+                               key=lambda judge: (judge.load, -judge.cpu_count, random()), reverse=True)
+            while available:
+                item = self.queue.pop(self._site_has_capacity)
+                if item is None:
+                    break
                 judge = available.pop()
-                bridge_id, packet = self.queue.popleft()
+                bridge_id, packet = item[1]
                 self.judge_to_bridge[judge.name] = bridge_id
                 self.bridge_to_judge[bridge_id] = judge
 
@@ -117,7 +140,7 @@ class JudgeBalancer:
 
     def queue_submission(self, bridge_id: int, packet: dict):
         with self.lock:
-            self.queue.append((bridge_id, packet))
+            self.queue.push(self.bridge_sites[bridge_id], (bridge_id, packet))
         self._try_judge()
 
     def abort_submission(self, bridge_id):
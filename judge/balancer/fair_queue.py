@@ -0,0 +1,46 @@
+from collections import deque
+
+
+class FairQueue:
+    """
+    Weighted fair queueing of submissions across bridges.
+
+    Every bridge has its own FIFO queue and a virtual start time, which advances by 1 / weight for each of its
+    submissions that is dispatched. The next submission always comes from the backlogged bridge with the earliest
+    virtual start time, so that over time bridges are served in proportion to their weights, no matter how much any
+    one of them has queued. A bridge that was idle restarts at the current virtual time, rather than with credit for
+    the time it had nothing to judge.
+    """
+
+    def __init__(self):
+        self.queues = {}
+        self.weights = {}
+        self.start = {}
+        self.virtual_time = 0
+
+    def __len__(self):
+        return sum(map(len, self.queues.values()))
+
+    def configure(self, key, weight=1):
+        if weight <= 0:
+            raise ValueError('weight must be positive: %r' % (weight,))
+        self.weights[key] = weight
+
+    def push(self, key, item):
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+        if not queue:
+            self.start[key] = max(self.start.get(key, 0), self.virtual_time)
+        queue.append(item)
+
+    def pop(self, can_take=lambda key: True):
+        """Returns (key, item) from the eligible bridge that is owed the most service, or None."""
+        candidates = [key for key, queue in self.queues.items() if queue and can_take(key)]
+        if not candidates:
+            return None
+
+        key = min(candidates, key=lambda key: self.start[key])
+        self.virtual_time = self.start[key]
+        self.start[key] += 1 / self.weights.get(key, 1)
+        return key, self.queues[key].popleft()
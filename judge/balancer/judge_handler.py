@@ -28,13 +28,15 @@ class JudgeHandler(ZlibPacketHandler):
             'internal-error': self.forward_packet_and_free_self,
             'submission-terminated': self.forward_packet_and_free_self,
             'submission-acknowledged': self.on_submission_acknowledged,
-            'ping-response': self.ignore_packet,
+            'ping-response': self.on_ping_response,
             'supported-problems': self.ignore_packet,
             'handshake': self.on_handshake,
         }
         self.current_submission_id = None
         self._no_response_job = None
         self.name = None
+        self.load = 1e100
+        self.cpu_count = 1
         self._stop_ping = threading.Event()
 
     def on_connect(self):
@@ -115,6 +117,10 @@ class JudgeHandler(ZlibPacketHandler):
     def ping(self):
         self.send({'name': 'ping', 'when': time.time()})
 
+    def on_ping_response(self, packet):
+        self.load = packet.get('load', self.load)
+        self.cpu_count = packet.get('cpu-count', self.cpu_count)
+
     def on_packet(self, data):
         try:
             try:
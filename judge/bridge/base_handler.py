@@ -14,6 +14,8 @@ size_pack = struct.Struct('!I')
 assert size_pack.size == 4
 
 MAX_ALLOWED_PACKET_SIZE = 8 * 1024 * 1024
+# Packets are received through a buffer of this size, and decompressed as they arrive.
+READ_BUFFER_SIZE = 64 * 1024
 
 
 def proxy_list(human_readable):
@@ -51,6 +53,7 @@ class RequestHandlerMeta(type):
 
 class ZlibPacketHandler(metaclass=RequestHandlerMeta):
     proxies = []
+    zlib_level = zlib.Z_DEFAULT_COMPRESSION
 
     def __init__(self, request, client_address, server):
         self.request = request
@@ -59,6 +62,9 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
         self.server_address = server.server_address
         self._initial_tag = None
         self._got_packet = False
+        self._read_buffer = memoryview(bytearray(READ_BUFFER_SIZE))
+        # Preset dictionary for both directions, once the peer has agreed to use one.
+        self.zlib_dictionary = None
 
     @property
     def timeout(self):
@@ -74,19 +80,26 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
                        'Disconnecting client due to too-large message size (%d bytes): %s', size, self.client_address)
             raise Disconnect()
 
-        buffer = []
+        # The compressed packet is never held in full: it is received into the same buffer chunk by chunk, and every
+        # chunk is decompressed straight out of it.
+        decompressor = self._decompressor()
+        output = bytearray()
         remainder = size
 
         if initial:
-            buffer.append(initial)
+            output += decompressor.decompress(initial)
             remainder -= len(initial)
             assert remainder >= 0
 
+        buffer = self._read_buffer
         while remainder:
-            data = self.request.recv(remainder)
-            remainder -= len(data)
-            buffer.append(data)
-        self._on_packet(b''.join(buffer))
+            read = self.request.recv_into(buffer, min(remainder, len(buffer)))
+            if not read:
+                raise Disconnect()
+            output += decompressor.decompress(buffer[:read])
+            remainder -= read
+
+        self._on_decompressed_packet(self._finish_decompression(decompressor, output))
 
     def parse_proxy_protocol(self, line):
         words = line.split()
@@ -124,10 +137,24 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
             buffer += data
         return buffer
 
+    def _decompressor(self):
+        if self.zlib_dictionary:
+            return zlib.decompressobj(zdict=self.zlib_dictionary)
+        return zlib.decompressobj()
+
+    def _finish_decompression(self, decompressor, output):
+        output += decompressor.flush()
+        if not decompressor.eof:
+            raise zlib.error('incomplete or truncated stream')
+        return output
+
     def _on_packet(self, data):
-        decompressed = zlib.decompress(data).decode('utf-8')
+        decompressor = self._decompressor()
+        self._on_decompressed_packet(self._finish_decompression(decompressor, bytearray(decompressor.decompress(data))))
+
+    def _on_decompressed_packet(self, data):
         self._got_packet = True
-        self.on_packet(decompressed)
+        self.on_packet(data)
 
     def on_packet(self, data):
         raise NotImplementedError()
@@ -194,7 +221,13 @@ class ZlibPacketHandler(metaclass=RequestHandlerMeta):
             self.on_cleanup()
 
     def send(self, data):
-        compressed = zlib.compress(data.encode('utf-8'))
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.zlib_dictionary:
+            compressor = zlib.compressobj(self.zlib_level, zdict=self.zlib_dictionary)
+            compressed = compressor.compress(data) + compressor.flush()
+        else:
+            compressed = zlib.compress(data, self.zlib_level)
         self.request.sendall(size_pack.pack(len(compressed)) + compressed)
 
     def close(self):
@@ -0,0 +1,76 @@
+import json
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONCodec:
+    name = 'json'
+
+    @staticmethod
+    def dumps(packet):
+        return json.dumps(packet, separators=(',', ':')).encode('utf-8')
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    name = 'msgpack'
+
+    @staticmethod
+    def dumps(packet):
+        return msgpack.packb(packet)
+
+    @staticmethod
+    def loads(data):
+        # Judges may report program output that is not valid UTF-8.
+        return msgpack.unpackb(data, raw=False, unicode_errors='replace')
+
+
+JSON = JSONCodec()
+CODECS = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def negotiate(offered):
+    """Returns the first of the codecs a peer `offered` that is both available and enabled, or JSON."""
+    for name in offered or ():
+        if name in CODECS and name in settings.BRIDGED_JUDGE_CODECS:
+            return CODECS[name]
+    return JSON
+
+
+def detect(data):
+    """
+    Returns the codec a packet was encoded with. Packets in msgpack are maps, which start with a map header; anything
+    else, such as the JSON null some requests are answered with, is JSON.
+    """
+    if data[:1] and (0x80 <= data[0] <= 0x8f or data[0] in (0xde, 0xdf)) and MsgpackCodec.name in CODECS:
+        return CODECS[MsgpackCodec.name]
+    return JSON
+
+
+# Strings that appear in nearly every packet between the bridge and the judges. Matches near the end of the dictionary
+# are the cheapest to encode, so the most common strings go last.
+PACKET_DICTIONARY = b''.join(s.encode('utf-8') for s in (
+    'handshake', 'supported-problems', 'executors', 'ping-response', 'load', 'cpu-count',
+    'grading-begin', 'grading-end', 'compile-error', 'compile-message', 'internal-error', 'log',
+    'submission-terminated', 'submission-acknowledged', 'batch-begin', 'batch-end', 'pretested',
+    'extended-feedback', 'feedback', 'voluntary-context-switches', 'involuntary-context-switches',
+    '"output":"', '"total-points":', '"points":', '"memory":', '"time":', '"status":', '"position":',
+    '{"name":"test-case-status","submission-id":', '"cases":[{',
+))
+
+
+def get_dictionary():
+    dictionary = settings.BRIDGED_ZLIB_DICTIONARY
+    if dictionary is True:
+        return PACKET_DICTIONARY
+    return dictionary or None
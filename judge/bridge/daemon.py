@@ -1,6 +1,7 @@
 import logging
 import signal
 import threading
+import time
 from functools import partial
 
 from django.conf import settings
@@ -8,21 +9,121 @@ from django.conf import settings
 from judge.bridge.django_handler import DjangoHandler
 from judge.bridge.judge_handler import JudgeHandler
 from judge.bridge.judge_list import JudgeList
+from judge.bridge.metrics import MetricsHandler
 from judge.bridge.server import Server
-from judge.models import Judge, Submission
+from judge.judge_priority import BATCH_REJUDGE_PRIORITY, CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY
+from judge.models import Contest, ContestParticipation, Judge, Submission, SubmissionTestCase
 
 logger = logging.getLogger('judge.bridge')
 
 
-def reset_judges():
-    Judge.objects.update(online=False, ping=None, load=None)
+def reset_judges(names=None, exclude=()):
+    """Marks the judges offline, only those of the given names if any, except those connected to a running bridge."""
+    judges = Judge.objects.exclude(name__in=exclude)
+    if names is not None:
+        judges = judges.filter(name__in=names)
+    judges.update(online=False, ping=None, load=None)
 
 
-def judge_daemon(run_monitor=False, problem_storage_globs=None):
-    reset_judges()
-    Submission.objects.filter(status__in=Submission.IN_PROGRESS_GRADING_STATUS) \
-        .update(status='IE', result='IE', error=None)
-    judges = JudgeList()
+def recover_queue(judges, chunk_size=1000, ids=None, exclude=()):
+    """
+    Queues every submission that was still waiting for or being graded by the previous bridge, so that they do not
+    stay stuck after a restart. Submissions are read in id order, `chunk_size` rows at a time, with one query for each
+    page, as the database driver may buffer the whole result of one query. Given `ids`, only those submissions are
+    recovered, and those in `exclude`, which a running bridge is grading, are left alone.
+
+    The original request packet is not stored anywhere, so the priority is reconstructed as judge_submission would
+    have picked it. A rejudge cannot be told apart from a batch rejudge, so all rejudges go to the back.
+    """
+    submissions = Submission.objects.exclude(id__in=exclude)
+    if ids is not None:
+        submissions = submissions.filter(id__in=ids)
+
+    # Whatever a judge had graded of these is gone with the connection, so they start over.
+    started = submissions.filter(status__in=('P', 'G'))
+    SubmissionTestCase.objects.filter(submission__in=started.values('id')).delete()
+    started.update(status='QU', current_testcase=0)
+
+    queryset = submissions.filter(status='QU').order_by('id') \
+        .values_list('id', 'problem__code', 'language__key', 'source__source', 'rejudged_date',
+                     'contest__participation__contest_id', 'contest__participation__virtual')
+    banned_judges = {}
+    recovered = 0
+
+    last_id = 0
+    while True:
+        rows = list(queryset.filter(id__gt=last_id)[:chunk_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        contests = {contest for *_, contest, virtual in rows
+                    if contest is not None and contest not in banned_judges and
+                    virtual in (ContestParticipation.LIVE, ContestParticipation.SPECTATE)}
+        if contests:
+            banned_judges.update((contest, []) for contest in contests)
+            for contest, judge in Contest.banned_judges.through.objects.filter(contest_id__in=contests) \
+                    .values_list('contest_id', 'judge__name'):
+                banned_judges[contest].append(judge)
+
+        submissions = []
+        for id, problem, language, source, rejudged_date, contest, virtual in rows:
+            if rejudged_date is not None:
+                priority = BATCH_REJUDGE_PRIORITY
+            elif contest is not None:
+                priority = CONTEST_SUBMISSION_PRIORITY
+            else:
+                priority = DEFAULT_PRIORITY
+
+            banned = []
+            if virtual in (ContestParticipation.LIVE, ContestParticipation.SPECTATE):
+                banned = banned_judges[contest]
+            submissions.append((id, problem, language, source or '', None, priority, banned))
+
+        judges.recover(submissions)
+        recovered += len(submissions)
+
+    return recovered
+
+
+def recover(judges, busy_judges=(), busy_submissions=()):
+    """
+    Cleans up after a bridge that stopped: marks its judges offline, and queues again what it was grading, or fails
+    it if BRIDGED_RECOVER_QUEUE is off. The judges and submissions of other running bridges are left alone.
+    """
+    reset_judges(exclude=busy_judges)
+    if settings.BRIDGED_RECOVER_QUEUE:
+        start = time.monotonic()
+        count = recover_queue(judges, exclude=busy_submissions)
+        logger.info('Recovered %d queued submissions in %.3fs', count, time.monotonic() - start)
+    else:
+        Submission.objects.filter(status__in=Submission.IN_PROGRESS_GRADING_STATUS).exclude(id__in=busy_submissions) \
+            .update(status='IE', result='IE', error=None)
+
+
+def judge_daemon(run_monitor=False, problem_storage_globs=None, instance=None):
+    servers = []
+    shared = bool(settings.BRIDGED_SHARED_STORE)
+    if shared:
+        from judge.bridge.shared import SharedJudgeList, SharedStore
+        judges = SharedJudgeList(SharedStore.from_settings(instance))
+        # Other instances pass on requests for the judges connected to this one here.
+        peer_server = Server([(settings.BRIDGED_SHARED_PEER_HOST, 0)], partial(DjangoHandler, judges=judges))
+        servers.append(peer_server)
+        judges.start(peer_server.servers[0].server_address)
+        logger.info('Joined the shared bridge as %s', judges.store.instance)
+    else:
+        judges = JudgeList()
+
+    if not shared:
+        recover(judges)
+    elif judges.store.claim_recovery():
+        # One instance at a time cleans up after those that are gone, leaving alone what the running ones are doing.
+        # Those that stop later are cleaned up after by the instances still running, as their heartbeats expire.
+        try:
+            recover(judges, judges.store.judges(), judges.store.live_grading())
+        finally:
+            judges.store.release_recovery()
 
     monitor = None
     if run_monitor:
@@ -32,13 +133,17 @@ def judge_daemon(run_monitor=False, problem_storage_globs=None):
     judge_server = Server(
         settings.BRIDGED_JUDGE_ADDRESS,
         partial(JudgeHandler, judges=judges, ignore_problems_packet=run_monitor),
+        reuse_port=shared,
     )
-    django_server = Server(settings.BRIDGED_DJANGO_ADDRESS, partial(DjangoHandler, judges=judges))
+    django_server = Server(settings.BRIDGED_DJANGO_ADDRESS, partial(DjangoHandler, judges=judges), reuse_port=shared)
+    servers += [django_server, judge_server]
+    if settings.BRIDGED_METRICS_ADDRESS:
+        servers.append(Server(settings.BRIDGED_METRICS_ADDRESS, partial(MetricsHandler, judges=judges)))
 
     if monitor is not None:
         monitor.start()
-    threading.Thread(target=django_server.serve_forever).start()
-    threading.Thread(target=judge_server.serve_forever).start()
+    for server in servers:
+        threading.Thread(target=server.serve_forever).start()
 
     stop = threading.Event()
 
@@ -55,5 +160,7 @@ def judge_daemon(run_monitor=False, problem_storage_globs=None):
     finally:
         if monitor is not None:
             monitor.stop()
-        django_server.shutdown()
-        judge_server.shutdown()
+        for server in servers:
+            server.shutdown()
+        if shared:
+            judges.stop()
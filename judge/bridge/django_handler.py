@@ -1,10 +1,13 @@
-import json
 import logging
 import struct
 
 from django import db
+from django.conf import settings
 
+from judge import event_poster as event
+from judge.bridge import codec
 from judge.bridge.base_handler import Disconnect, ZlibPacketHandler
+from judge.judgeapi import judge_request
 
 logger = logging.getLogger('judge.bridge')
 size_pack = struct.Struct('!I')
@@ -16,24 +19,32 @@ class DjangoHandler(ZlibPacketHandler):
 
         self.handlers = {
             'submission-request': self.on_submission,
+            'submission-batch-request': self.on_submission_batch,
             'terminate-submission': self.on_termination,
             'disconnect-judge': self.on_disconnect_request,
             'disable-judge': self.on_disable_judge,
+            'locality-stats': self.on_locality_stats,
+            'status': self.on_status,
         }
         self.judges = judges
+        self.codec = codec.JSON
+        self.zlib_level = settings.BRIDGED_ZLIB_LEVEL
 
     def send(self, data):
-        super().send(json.dumps(data, separators=(',', ':')))
+        super().send(self.codec.dumps(data))
 
     def on_packet(self, packet):
-        packet = json.loads(packet)
+        # Replies go out in whichever codec the request came in.
+        self.codec = codec.detect(packet)
+        packet = self.codec.loads(packet)
         try:
             result = self.handlers.get(packet.get('name', None), self.on_malformed)(packet)
         except Exception:
             logger.exception('Error in packet handling (Django-facing)')
             result = {'name': 'bad-request'}
         self.send(result)
-        raise Disconnect()
+        if not packet.get('keep-alive', False):
+            raise Disconnect()
 
     def on_submission(self, data):
         id = data['submission-id']
@@ -48,18 +59,57 @@ class DjangoHandler(ZlibPacketHandler):
         self.judges.judge(id, problem, language, source, judge_id, priority, banned_judges)
         return {'name': 'submission-received', 'submission-id': id}
 
+    def on_submission_batch(self, data):
+        submissions = []
+        for submission in data['submissions']:
+            if not self.judges.check_priority(submission['priority']):
+                logger.error('Bad priority for submission %s: %s', submission['submission-id'], submission['priority'])
+                continue
+            submissions.append((
+                submission['submission-id'], submission['problem-id'], submission['language'], submission['source'],
+                submission['judge-id'], submission['priority'], submission['banned-judges'],
+            ))
+        self.judges.judge_batch(submissions)
+        return {'name': 'submission-batch-received', 'submission-ids': [submission[0] for submission in submissions]}
+
+    def _peer(self, data, address):
+        # With several bridge instances, requests about a judge go to the instance that judge is connected to.
+        # Requests passed on are always handled where they arrive, so that they cannot go around in circles.
+        if data.get('forwarded') or address is None:
+            return None
+        packet = dict(data, forwarded=True)
+        packet.pop('keep-alive', None)
+        return judge_request(packet, address=address) or {'name': 'forwarded'}
+
     def on_termination(self, data):
+        peer = self._peer(data, self.judges.peer_for_submission(data['submission-id']))
+        if peer is not None:
+            return peer
         return {'name': 'submission-received', 'judge-aborted': self.judges.abort(data['submission-id'])}
 
     def on_disconnect_request(self, data):
+        peer = self._peer(data, self.judges.peer_for_judge(data['judge-id']))
+        if peer is not None:
+            return peer
         judge_id = data['judge-id']
         force = data['force']
         self.judges.disconnect(judge_id, force=force)
+        return {'name': 'judge-disconnected', 'judge-id': judge_id}
 
     def on_disable_judge(self, data):
+        peer = self._peer(data, self.judges.peer_for_judge(data['judge-id']))
+        if peer is not None:
+            return peer
         judge_id = data['judge-id']
         is_disabled = data['is-disabled']
         self.judges.update_disable_judge(judge_id, is_disabled)
+        return {'name': 'judge-disabled', 'judge-id': judge_id, 'is-disabled': is_disabled}
+
+    def on_locality_stats(self, data):
+        return {'name': 'locality-stats', 'judges': self.judges.locality_stats()}
+
+    def on_status(self, data):
+        return dict(self.judges.status(), name='status', events=event.stats())
 
     def on_malformed(self, packet):
         logger.error('Malformed packet: %s', packet)
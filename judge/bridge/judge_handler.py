@@ -1,3 +1,4 @@
+import base64
 import hmac
 import json
 import logging
@@ -11,6 +12,7 @@ from django.conf import settings
 from django.utils import timezone
 
 from judge import event_poster as event
+from judge.bridge import codec
 from judge.bridge.base_handler import ZlibPacketHandler, proxy_list
 from judge.caching import finished_submission
 from judge.models import Judge, Language, LanguageLimit, Problem, Profile, \
@@ -37,6 +39,49 @@ class SubmissionUnavailable(Exception):
     """Raised when a submission cannot be prepared for dispatch, in which case no judge is at fault."""
 
 
+class GradingResult(object):
+    """Running aggregate of a submission's test cases, from which its result is computed once grading ends."""
+
+    status_codes = ['SC', 'AC', 'PAC', 'WA', 'MLE', 'TLE', 'IR', 'RTE', 'OLE']
+
+    def __init__(self, submission_id):
+        self.submission_id = submission_id
+        self.time = 0.0
+        self.total_time = 0.0
+        self.memory = 0
+        self.points = 0.0
+        self.total = 0
+        self.status = 0
+        self.batches = {}  # batch number: [points, total]
+
+    def add(self, case):
+        self.time = max(self.time, case.time)
+        self.total_time += case.time
+        self.memory = max(self.memory, case.memory)
+        if not case.batch:
+            self.points += case.points
+            self.total += case.total
+        else:
+            if case.batch in self.batches:
+                self.batches[case.batch][0] = min(self.batches[case.batch][0], case.points)
+                self.batches[case.batch][1] = max(self.batches[case.batch][1], case.total)
+            else:
+                self.batches[case.batch] = [case.points, case.total]
+        self.status = max(self.status, self.status_codes.index(case.status))
+
+    @property
+    def result(self):
+        return self.status_codes[self.status]
+
+    def case_points(self):
+        points = self.points
+        total = self.total
+        for batch_points, batch_total in self.batches.values():
+            points += batch_points
+            total += batch_total
+        return round(points, 3), round(total, 3)
+
+
 class JudgeHandler(ZlibPacketHandler):
     proxies = proxy_list(settings.BRIDGED_JUDGE_PROXIES or [])
 
@@ -44,6 +89,8 @@ class JudgeHandler(ZlibPacketHandler):
         super().__init__(request, client_address, server)
 
         self.judges = judges
+        self.codec = codec.JSON
+        self.zlib_level = settings.BRIDGED_ZLIB_LEVEL
         self.handlers = {
             'grading-begin': self.on_grading_begin,
             'grading-end': self.on_grading_end,
@@ -85,6 +132,31 @@ class JudgeHandler(ZlibPacketHandler):
         self._submission_cache_id = None
         self._submission_cache = {}
 
+        # Utilization is the fraction of the time since connecting that was spent grading.
+        self.connected_at = time.monotonic()
+        self.busy_time = 0.0
+        self._busy_since = None
+        # Time spent in database queries by the packet being handled, see handle.
+        self._query_time = 0.0
+
+        # Test case rows received but not yet written to the database, see _flush_test_cases.
+        self._test_case_buffer = []
+        self._test_case_buffer_id = None
+        self._test_case_buffer_since = None
+        self._test_case_position = None
+        self._grading_result = None
+
+    def handle(self):
+        with db.connection.execute_wrapper(self._time_query):
+            super().handle()
+
+    def _time_query(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self._query_time += time.perf_counter() - start
+
     def on_connect(self):
         self.timeout = 15
         logger.info('Judge connected from: %s', self.client_address)
@@ -94,6 +166,10 @@ class JudgeHandler(ZlibPacketHandler):
         self._stop_ping.set()
         if self._working:
             logger.error('Judge %s disconnected while handling submission %s', self.name, self._working)
+        try:
+            self._flush_test_cases()
+        except Exception:
+            logger.exception('Failed to save buffered test cases of %s on disconnect', self._test_case_buffer_id)
         self.judges.remove(self)
         if self.name is not None:
             self._disconnected()
@@ -159,7 +235,7 @@ class JudgeHandler(ZlibPacketHandler):
                 db.connection.close()
 
     def send(self, data):
-        super().send(json.dumps(data, separators=(',', ':')))
+        super().send(self.codec.dumps(data))
 
     def on_handshake(self, packet):
         if 'id' not in packet or 'key' not in packet:
@@ -176,12 +252,28 @@ class JudgeHandler(ZlibPacketHandler):
         self.executors = packet['executors']
         self.name = packet['id']
 
-        self.send({'name': 'handshake-success'})
-        logger.info('Judge authenticated: %s (%s)', self.client_address, packet['id'])
+        self._negotiate(packet)
+        logger.info('Judge authenticated: %s (%s), using %s', self.client_address, packet['id'], self.codec.name)
         self.judges.register(self)
         threading.Thread(target=self._ping_thread).start()
         self._connected()
 
+    def _negotiate(self, packet):
+        # Judges that know about codecs or preset dictionaries say so in their handshake. The response still goes out
+        # in JSON, and whatever is agreed on here applies to every packet after it, in both directions.
+        response = {'name': 'handshake-success'}
+        if 'codecs' in packet:
+            response['codec'] = codec.negotiate(packet['codecs']).name
+
+        dictionary = codec.get_dictionary()
+        if dictionary and packet.get('zlib-dictionary'):
+            response['zlib-dictionary'] = base64.b64encode(dictionary).decode('ascii')
+
+        self.send(response)
+        self.codec = codec.CODECS[response.get('codec', codec.JSON.name)]
+        if 'zlib-dictionary' in response:
+            self.zlib_dictionary = dictionary
+
     def can_judge(self, problem, executor, judge_id=None):
         return problem in self.problems and executor in self.executors and  \
             ((not judge_id and not self.is_disabled) or self.name == judge_id)
@@ -262,6 +354,7 @@ class JudgeHandler(ZlibPacketHandler):
                 'file-size-limit': data.file_size_limit,
             },
         })
+        self._busy_since = time.monotonic()
 
     def _kill_if_no_response(self):
         logger.error('Judge failed to acknowledge submission: %s: %s', self.name, self._working)
@@ -276,7 +369,7 @@ class JudgeHandler(ZlibPacketHandler):
 
         id = packet['submission-id']
         if Submission.objects.filter(id=id).update(status='P', judged_on=self.judge):
-            event.post('sub_%s' % Submission.get_id_secret(id), {'type': 'processing'})
+            self._post_event('sub_%s' % Submission.get_id_secret(id), {'type': 'processing'})
             self._post_update_submission(id, 'processing')
             json_log.info(self._make_json_log(packet, action='processing'))
         else:
@@ -310,21 +403,32 @@ class JudgeHandler(ZlibPacketHandler):
         self.send({'name': 'ping', 'when': time.time()})
 
     def on_packet(self, data):
+        name = 'malformed'
+        self._query_time = 0.0
+        start = time.perf_counter()
         try:
             try:
-                data = json.loads(data)
+                data = self.codec.loads(data)
                 if 'name' not in data:
                     raise ValueError
             except ValueError:
                 self.on_malformed(data)
             else:
+                if data['name'] in self.handlers:
+                    name = data['name']
                 handler = self.handlers.get(data['name'], self.on_malformed)
                 handler(data)
+                if self._test_case_buffer and self._test_case_buffer_expired():
+                    self._flush_test_cases(post_progress=True)
         except Exception:
             logger.exception('Error in packet handling (Judge-side): %s', self.name)
             self._packet_exception()
+            self.judges.metrics.increment('packet_errors', packet=name)
             # You can't crash here because you aren't so sure about the judges
             # not being malicious or simply malformed. THIS IS A SERVER!
+        finally:
+            self.judges.metrics.observe('packet', time.perf_counter() - start, packet=name)
+            self.judges.metrics.observe('packet_db', self._query_time, packet=name)
 
     def _packet_exception(self):
         json_log.exception(self._make_json_log(sub=self._working, info='packet processing exception'))
@@ -394,7 +498,8 @@ class JudgeHandler(ZlibPacketHandler):
                 status='G', is_pretested=packet['pretested'], current_testcase=1,
                 batch=False, judged_date=timezone.now()):
             SubmissionTestCase.objects.filter(submission_id=packet['submission-id']).delete()
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'grading-begin'})
+            self._grading_result = GradingResult(packet['submission-id'])
+            self._post_event('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'grading-begin'})
             self._post_update_submission(packet['submission-id'], 'grading-begin')
             json_log.info(self._make_json_log(packet, action='grading-begin'))
         else:
@@ -403,6 +508,7 @@ class JudgeHandler(ZlibPacketHandler):
 
     def on_grading_end(self, packet):
         logger.info('%s: Grading has ended on: %s', self.name, packet['submission-id'])
+        self._flush_test_cases()
         self._free_self(packet)
         self.batch_id = None
 
@@ -413,38 +519,18 @@ class JudgeHandler(ZlibPacketHandler):
             json_log.error(self._make_json_log(packet, action='grading-end', info='unknown submission'))
             return
 
-        time = 0.0
-        total_time = 0.0
-        memory = 0
-        points = 0.0
-        total = 0
-        status = 0
-        status_codes = ['SC', 'AC', 'PAC', 'WA', 'MLE', 'TLE', 'IR', 'RTE', 'OLE']
-        batches = {}  # batch number: (points, total)
-
-        for case in SubmissionTestCase.objects.filter(submission=submission):
-            time = max(time, case.time)
-            total_time += case.time
-            memory = max(memory, case.memory)
-            if not case.batch:
-                points += case.points
-                total += case.total
-            else:
-                if case.batch in batches:
-                    batches[case.batch][0] = min(batches[case.batch][0], case.points)
-                    batches[case.batch][1] = max(batches[case.batch][1], case.total)
-                else:
-                    batches[case.batch] = [case.points, case.total]
-            i = status_codes.index(case.status)
-            if i > status:
-                status = i
-
-        for i in batches:
-            points += batches[i][0]
-            total += batches[i][1]
-
-        points = round(points, 3)
-        total = round(total, 3)
+        result = self._grading_result
+        self._grading_result = None
+        if result is None or result.submission_id != submission.id:
+            # We did not see the whole submission being graded, e.g. the bridge restarted in the middle of it.
+            result = GradingResult(submission.id)
+            for case in SubmissionTestCase.objects.filter(submission=submission):
+                result.add(case)
+
+        time = result.time
+        total_time = result.total_time
+        memory = result.memory
+        points, total = result.case_points()
         submission.case_points = points
         submission.case_total = total
 
@@ -457,7 +543,7 @@ class JudgeHandler(ZlibPacketHandler):
         submission.time = time
         submission.memory = memory
         submission.points = sub_points
-        submission.result = status_codes[status]
+        submission.result = result.result
         submission.save()
 
         json_log.info(self._make_json_log(
@@ -478,10 +564,10 @@ class JudgeHandler(ZlibPacketHandler):
 
         finished_submission(submission)
 
-        event.post('sub_%s' % submission.id_secret, {'type': 'grading-end'})
+        self._post_event('sub_%s' % submission.id_secret, {'type': 'grading-end'})
         if hasattr(submission, 'contest'):
             participation = submission.contest.participation
-            event.post('contest_%d' % participation.contest_id, {'type': 'update'})
+            self._post_event('contest_%d' % participation.contest_id, {'type': 'update'})
         self._post_update_submission(submission.id, 'grading-end', done=True)
 
     def on_compile_error(self, packet):
@@ -489,7 +575,7 @@ class JudgeHandler(ZlibPacketHandler):
         self._free_self(packet)
 
         if Submission.objects.filter(id=packet['submission-id']).update(status='CE', result='CE', error=packet['log']):
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'compile-error'})
+            self._post_event('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'compile-error'})
             self._post_update_submission(packet['submission-id'], 'compile-error', done=True)
             json_log.info(self._make_json_log(packet, action='compile-error', log=packet['log'],
                                               finish=True, result='CE'))
@@ -502,7 +588,7 @@ class JudgeHandler(ZlibPacketHandler):
         logger.info('%s: Submission generated compiler messages: %s', self.name, packet['submission-id'])
 
         if Submission.objects.filter(id=packet['submission-id']).update(error=packet['log']):
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'compile-message'})
+            self._post_event('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'compile-message'})
             json_log.info(self._make_json_log(packet, action='compile-message', log=packet['log']))
         else:
             logger.warning('Unknown submission: %s', packet['submission-id'])
@@ -514,11 +600,12 @@ class JudgeHandler(ZlibPacketHandler):
             raise ValueError('\n\n' + packet['message'])
         except ValueError:
             logger.exception('Judge %s failed while handling submission %s', self.name, packet['submission-id'])
+        self._flush_test_cases()
         self._free_self(packet)
 
         id = packet['submission-id']
         if Submission.objects.filter(id=id).update(status='IE', result='IE', error=packet['message']):
-            event.post('sub_%s' % Submission.get_id_secret(id), {'type': 'internal-error'})
+            self._post_event('sub_%s' % Submission.get_id_secret(id), {'type': 'internal-error'})
             self._post_update_submission(id, 'internal-error', done=True)
             json_log.info(self._make_json_log(packet, action='internal-error', message=packet['message'],
                                               finish=True, result='IE'))
@@ -529,10 +616,11 @@ class JudgeHandler(ZlibPacketHandler):
 
     def on_submission_terminated(self, packet):
         logger.info('%s: Submission aborted: %s', self.name, packet['submission-id'])
+        self._flush_test_cases()
         self._free_self(packet)
 
         if Submission.objects.filter(id=packet['submission-id']).update(status='AB', result='AB', points=0):
-            event.post('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'aborted'})
+            self._post_event('sub_%s' % Submission.get_id_secret(packet['submission-id']), {'type': 'aborted'})
             self._post_update_submission(packet['submission-id'], 'aborted', done=True)
             json_log.info(self._make_json_log(packet, action='aborted', finish=True, result='AB'))
         else:
@@ -553,6 +641,7 @@ class JudgeHandler(ZlibPacketHandler):
     def on_batch_end(self, packet):
         self.in_batch = False
         logger.info('%s: Batch ended on: %s', self.name, packet['submission-id'])
+        self._flush_test_cases(post_progress=True)
         json_log.info(self._make_json_log(packet, action='batch-end', batch=self.batch_id))
 
     def on_test_case(self, packet, max_feedback=SubmissionTestCase._meta.get_field('feedback').max_length):
@@ -562,12 +651,13 @@ class JudgeHandler(ZlibPacketHandler):
         updates = packet['cases']
         max_position = max(map(itemgetter('position'), updates))
 
-        if not Submission.objects.filter(id=id).update(current_testcase=max_position + 1):
-            logger.warning('Unknown submission: %s', id)
-            json_log.error(self._make_json_log(packet, action='test-case', info='unknown submission'))
-            return
+        if self._test_case_buffer_id != id:
+            self._flush_test_cases()
+            self._test_case_buffer_id = id
+        if not self._test_case_buffer:
+            self._test_case_buffer_since = time.monotonic()
+        self._test_case_position = max_position + 1
 
-        bulk_test_case_updates = []
         for result in updates:
             test_case = SubmissionTestCase(submission_id=id, case=result['position'])
             status = result['status']
@@ -598,7 +688,9 @@ class JudgeHandler(ZlibPacketHandler):
             test_case.feedback = (result.get('feedback') or '')[:max_feedback]
             test_case.extended_feedback = result.get('extended-feedback') or ''
             test_case.output = result['output']
-            bulk_test_case_updates.append(test_case)
+            self._test_case_buffer.append(test_case)
+            if self._grading_result is not None and self._grading_result.submission_id == id:
+                self._grading_result.add(test_case)
 
             json_log.info(self._make_json_log(
                 packet, action='test-case', case=test_case.case, batch=test_case.batch,
@@ -610,8 +702,37 @@ class JudgeHandler(ZlibPacketHandler):
                 runtime_version=result.get('runtime-version', ''),
             ))
 
-        SubmissionTestCase.objects.bulk_create(bulk_test_case_updates)
+        if len(self._test_case_buffer) >= settings.BRIDGED_TEST_CASE_BUFFER_SIZE or \
+                self._test_case_buffer_expired():
+            self._flush_test_cases(post_progress=True)
+
+    def _test_case_buffer_expired(self):
+        return time.monotonic() - self._test_case_buffer_since >= settings.BRIDGED_TEST_CASE_BUFFER_TIME
+
+    def _flush_test_cases(self, post_progress=False):
+        """
+        Writes buffered test case rows, along with the submission's current test case.
+
+        Unless BRIDGED_TEST_CASE_BUFFER_SIZE is set, every test case packet is written as soon as it arrives.
+        Otherwise, rows are written once enough of them pile up or the oldest has waited long enough, and whenever
+        a batch or the submission ends, so that nothing is lost when grading stops for any reason.
+        """
+        if not self._test_case_buffer:
+            return
+
+        id = self._test_case_buffer_id
+        if not Submission.objects.filter(id=id).update(current_testcase=self._test_case_position):
+            logger.warning('Unknown submission: %s', id)
+            json_log.error(self._make_json_log(sub=id, action='test-case', info='unknown submission'))
+            self._test_case_buffer = []
+            return
+
+        SubmissionTestCase.objects.bulk_create(self._test_case_buffer)
+        self._test_case_buffer = []
+        if post_progress:
+            self._post_test_case_progress(id)
 
+    def _post_test_case_progress(self, id):
         data = self._get_submission_cache(id)
         if data['problem__testcase_result_visibility_mode'] != ProblemTestcaseResultAccess.ALL_TEST_CASE:
             return
@@ -631,7 +752,7 @@ class JudgeHandler(ZlibPacketHandler):
             self.update_counter[id] = (1, time.monotonic())
 
         if do_post:
-            event.post('sub_%s' % Submission.get_id_secret(id), {'type': 'test-case'})
+            self._post_event('sub_%s' % Submission.get_id_secret(id), {'type': 'test-case'})
             self._post_update_submission(id, state='test-case')
 
     def on_malformed(self, packet):
@@ -648,8 +769,37 @@ class JudgeHandler(ZlibPacketHandler):
         self._update_ping()
 
     def _free_self(self, packet):
+        if self._busy_since is not None:
+            busy = time.monotonic() - self._busy_since
+            self.busy_time += busy
+            self._busy_since = None
+            self.judges.metrics.increment('judge_busy_seconds', busy, judge=self.name)
         self.judges.on_judge_free(self, packet['submission-id'])
 
+    def get_status(self, now):
+        busy = self.busy_time
+        if self._busy_since is not None:
+            busy += now - self._busy_since
+        connected = now - self.connected_at
+        return {
+            'name': self.name,
+            'tier': self.tier,
+            'submission': self.get_current_submission(),
+            'disabled': self.is_disabled,
+            'load': self.load if self.load < 1e100 else None,
+            'latency': self.latency,
+            'busy': busy,
+            'connected': connected,
+            'utilization': busy / connected if connected > 0 else 0.0,
+        }
+
+    def _post_event(self, channel, message):
+        start = time.perf_counter()
+        try:
+            return event.post(channel, message)
+        finally:
+            self.judges.metrics.observe('event_post', time.perf_counter() - start)
+
     def _ping_thread(self):
         try:
             while True:
@@ -686,7 +836,7 @@ class JudgeHandler(ZlibPacketHandler):
     def _post_update_submission(self, id, state, done=False):
         data = self._get_submission_cache(id)
         if data['problem__is_public']:
-            event.post('submissions', {
+            self._post_event('submissions', {
                 'type': 'done-submission' if done else 'update-submission',
                 'state': state, 'id': id,
                 'contest': data['contest_object_id'],
@@ -1,80 +1,81 @@
 import logging
-from collections import namedtuple
-from random import random
+import time
+from functools import partial
+from operator import attrgetter
 from threading import RLock
 
 from django.conf import settings
 
 from judge.bridge.judge_handler import SubmissionUnavailable
+from judge.bridge.locality import JudgeLocality
+from judge.bridge.metrics import BridgeMetrics
+from judge.bridge.submission_queue import SubmissionQueue
 from judge.judge_priority import REJUDGE_PRIORITY
 from judge.tasks import on_long_queue
 
-try:
-    from llist import dllist
-except ImportError:
-    from pyllist import dllist
-
 logger = logging.getLogger('judge.bridge')
 
-PriorityMarker = namedtuple('PriorityMarker', 'priority')
-
 
 class JudgeList(object):
     priorities = 4
 
-    def __init__(self):
-        self.queue = dllist()
-        self.priority = [self.queue.append(PriorityMarker(i)) for i in range(self.priorities)]
+    def __init__(self, queue=None):
+        self.queue = SubmissionQueue(self.priorities) if queue is None else queue
         self.judges = set()
-        self.node_map = {}
+        self.node_map = getattr(self.queue, 'node_map', None)
         self.submission_map = {}
         self.lock = RLock()
         self.min_tier = None
         self.problems = set()
         self.problem_ids = set()
+        self.locality = JudgeLocality()
+        self.metrics = BridgeMetrics()
 
     def _handle_free_judge(self, judge):
         with self.lock:
             if judge.tier > self.min_tier:
                 return
 
-            node = self.queue.first
-            priority = 0
-            while node:
-                if isinstance(node.value, PriorityMarker):
-                    priority = node.value.priority + 1
-                elif priority >= REJUDGE_PRIORITY and self.should_reserve_judge():
+            # Test data of the problems the judge graded recently is likely still cached there.
+            prefer = partial(self.locality.is_warm, judge) if settings.BRIDGED_LOCALITY_DISPATCH else None
+            while True:
+                submission = self.queue.next_for(judge, self.should_reserve_judge, prefer)
+                if submission is None:
                     return
-                else:
-                    id, problem, language, source, judge_id, banned_judges = node.value
-                    if judge.name not in banned_judges and judge.can_judge(problem, language, judge_id):
-                        try:
-                            judge.submit(id, problem, language, source)
-                        except SubmissionUnavailable:
-                            logger.error('Dropping queued submission %d, it is no longer available', id)
-                            self.queue.remove(node)
-                            del self.node_map[id]
-                            # The judge is fine, so let it pick up the next queued submission.
-                            return self._handle_free_judge(judge)
-                        except Exception:
-                            logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
-                            self.judges.remove(judge)
-                            return
-                        self.submission_map[id] = judge
-                        logger.info('Dispatched queued submission %d: %s', id, judge.name)
-                        self.queue.remove(node)
-                        del self.node_map[id]
-                        break
-                node = node.next
+
+                id, problem, language, source = submission[:4]
+                try:
+                    self._submit(judge, id, problem, language, source, submission.priority, submission.queued)
+                except SubmissionUnavailable:
+                    logger.error('Dropping queued submission %d, it is no longer available', id)
+                    self.queue.remove(id)
+                    # The judge is fine, so let it pick up the next queued submission.
+                    continue
+                except Exception:
+                    logger.exception('Failed to dispatch %d (%s, %s) to %s', id, problem, language, judge.name)
+                    self.queue.release(submission)
+                    self.judges.remove(judge)
+                    return
+                self.submission_map[id] = judge
+                self.locality.record(judge, problem)
+                logger.info('Dispatched queued submission %d: %s', id, judge.name)
+                self.queue.remove(id)
+                return
+
+    def _submit(self, judge, id, problem, language, source, priority, queued=None):
+        now = self.queue.now()
+        start = time.monotonic()
+        judge.submit(id, problem, language, source)
+        # Submissions that went straight to a free judge count as having waited for nothing.
+        self.metrics.observe('queue_wait', now - queued if queued is not None else 0.0, priority=priority)
+        self.metrics.observe('dispatch', time.monotonic() - start)
+        self.metrics.increment('dispatched', priority=priority)
+        self.queue.record_dispatch(priority)
 
     def _update_min_tier(self):
         with self.lock:
             old = self.min_tier
-            try:
-                self.min_tier = min(judge.tier for judge in self.judges
-                                    if judge.tier is not None and not judge.is_disabled)
-            except ValueError:
-                self.min_tier = None
+            self.min_tier = self._find_min_tier()
 
             if old != self.min_tier:
                 logger.info('Minimum tier changed from %s to %s', old, self.min_tier)
@@ -91,6 +92,10 @@ class JudgeList(object):
                     if not judge.working:
                         self._handle_free_judge(judge)
 
+    def _find_min_tier(self):
+        return min((judge.tier for judge in self.judges if judge.tier is not None and not judge.is_disabled),
+                   default=None)
+
     def current_tier_judges(self):
         return [judge for judge in self.judges if judge.tier == self.min_tier and not judge.is_disabled]
 
@@ -184,21 +189,58 @@ class JudgeList(object):
                 self.submission_map[submission].abort()
                 return True
             except KeyError:
-                try:
-                    node = self.node_map[submission]
-                except KeyError:
-                    pass
-                else:
-                    self.queue.remove(node)
-                    del self.node_map[submission]
+                self.queue.remove(submission)
                 return False
 
+    def locality_stats(self):
+        with self.lock:
+            return self.locality.stats()
+
+    def status(self):
+        with self.lock:
+            now = self.queue.now()
+            sizes = self.queue.sizes
+            queue = []
+            for priority in range(self.priorities):
+                oldest = self.queue.oldest(priority)
+                queue.append({
+                    'priority': priority,
+                    'size': sizes[priority],
+                    'oldest': now - oldest.queued if oldest is not None else None,
+                })
+            return {
+                'queue': queue,
+                'judges': [judge.get_status(now) for judge in sorted(self.judges, key=attrgetter('name'))],
+                'metrics': self.metrics.summary(),
+            }
+
+    def prometheus(self):
+        status = self.status()
+        gauges = []
+        for queue in status['queue']:
+            gauges.append(('queue_size', {'priority': queue['priority']}, queue['size']))
+            if queue['oldest'] is not None:
+                gauges.append(('queue_oldest_seconds', {'priority': queue['priority']}, queue['oldest']))
+        gauges.append(('judges', {}, len(status['judges'])))
+        for judge in status['judges']:
+            gauges.append(('judge_working', {'judge': judge['name']}, judge['submission'] is not None))
+            gauges.append(('judge_utilization', {'judge': judge['name']}, judge['utilization']))
+        return self.metrics.prometheus(gauges)
+
+    def peer_for_submission(self, submission):
+        """The address of the bridge instance grading `submission`, if that is not this one."""
+        return None
+
+    def peer_for_judge(self, judge_id):
+        """The address of the bridge instance `judge_id` is connected to, if that is not this one."""
+        return None
+
     def check_priority(self, priority):
         return 0 <= priority < self.priorities
 
     def judge(self, id, problem, language, source, judge_id, priority, banned_judges=[]):
         with self.lock:
-            if id in self.submission_map or id in self.node_map:
+            if id in self.submission_map or id in self.queue:
                 # Already judging, don't queue again. This can happen during batch rejudges, rejudges should be
                 # idempotent.
                 return
@@ -218,11 +260,11 @@ class JudgeList(object):
                 available = []
 
             if available:
-                # Schedule the submission on the judge reporting least load.
-                judge = min(available, key=lambda judge: (judge.load, random()))
+                # Schedule the submission on the judge reporting least load, or one that has the test data cached.
+                judge = self.locality.choose(available, problem)
                 logger.info('Dispatched submission %d to: %s', id, judge.name)
                 try:
-                    judge.submit(id, problem, language, source)
+                    self._submit(judge, id, problem, language, source, priority)
                 except SubmissionUnavailable:
                     logger.error('Dropping submission %d, it is no longer available', id)
                     return
@@ -231,11 +273,23 @@ class JudgeList(object):
                     self.judges.discard(judge)
                     return self.judge(id, problem, language, source, judge_id, priority, banned_judges)
                 self.submission_map[id] = judge
+                self.locality.record(judge, problem)
             else:
-                self.node_map[id] = self.queue.insert(
-                    (id, problem, language, source, judge_id, banned_judges),
-                    self.priority[priority],
-                )
+                self.queue.push(id, problem, language, source, judge_id, priority, banned_judges)
+                self.metrics.increment('queued', priority=priority)
                 logger.info('Queued submission: %d', id)
-                if self.queue.size == settings.VNOJ_LONG_QUEUE_ALERT_THRESHOLD + self.priorities:
+                if len(self.queue) == settings.VNOJ_LONG_QUEUE_ALERT_THRESHOLD:
                     on_long_queue.delay()
+
+    def judge_batch(self, submissions):
+        # Take the lock once for the whole batch, rather than once per submission.
+        with self.lock:
+            for id, problem, language, source, judge_id, priority, banned_judges in submissions:
+                self.judge(id, problem, language, source, judge_id, priority, banned_judges)
+
+    def recover(self, submissions):
+        # Used to rebuild the queue after a bridge stopped. Only queues, as free judges are offered the queue anyway.
+        with self.lock:
+            for id, problem, language, source, judge_id, priority, banned_judges in submissions:
+                if id not in self.submission_map and id not in self.queue:
+                    self.queue.push(id, problem, language, source, judge_id, priority, banned_judges)
@@ -0,0 +1,55 @@
+from collections import Counter, OrderedDict, defaultdict
+from random import random
+
+from django.conf import settings
+
+
+class JudgeLocality(object):
+    """
+    Remembers which problems each judge graded recently, since their test data is likely still in that judge's cache.
+
+    Judges are tracked by name rather than by connection, as a judge that reconnects keeps its cache. A dispatch to a
+    judge that recently graded the same problem counts as a hit; the counts are kept whether or not the preference for
+    warm judges is turned on, so that the hit rate can be compared with and without it.
+    """
+
+    def __init__(self):
+        self.recent = defaultdict(OrderedDict)
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def is_warm(self, judge, problem):
+        return problem in self.recent.get(judge.name, ())
+
+    def record(self, judge, problem):
+        recent = self.recent[judge.name]
+        if problem in recent:
+            self.hits[judge.name] += 1
+            recent.move_to_end(problem)
+        else:
+            self.misses[judge.name] += 1
+            recent[problem] = None
+            while len(recent) > settings.BRIDGED_LOCALITY_CACHE_SIZE:
+                recent.popitem(last=False)
+
+    def choose(self, judges, problem):
+        """
+        Picks the judge reporting least load. With BRIDGED_LOCALITY_DISPATCH, a judge that recently graded `problem`
+        is picked instead, as long as its load is within BRIDGED_LOCALITY_LOAD_TOLERANCE of the least loaded judge.
+        """
+        best = min(judges, key=lambda judge: (judge.load, random()))
+        if not settings.BRIDGED_LOCALITY_DISPATCH or self.is_warm(best, problem):
+            return best
+
+        warm = [judge for judge in judges if self.is_warm(judge, problem)]
+        if warm:
+            candidate = min(warm, key=lambda judge: (judge.load, random()))
+            if candidate.load <= best.load + settings.BRIDGED_LOCALITY_LOAD_TOLERANCE:
+                return candidate
+        return best
+
+    def stats(self):
+        return {
+            name: {'hits': self.hits[name], 'misses': self.misses[name], 'problems': len(recent)}
+            for name, recent in self.recent.items()
+        }
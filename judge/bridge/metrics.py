@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler
+
+logger = logging.getLogger('judge.bridge')
+
+# Upper bounds of the histogram buckets, in seconds: from a cached query up to a submission that sat out a contest rush.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+class Histogram(object):
+    __slots__ = ('counts', 'count', 'sum', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimates the `q` quantile as the upper bound of the bucket it falls in, which is all a histogram knows."""
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class BridgeMetrics(object):
+    """
+    Counters and latency histograms kept by the bridge, keyed by name and labels.
+
+    Everything here is cheap enough to record on every packet: a lock, a dictionary lookup and a bisect. Histograms
+    have fixed buckets, so that they can be exported as Prometheus histograms and aggregated across bridges.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(float)
+        self.histograms = defaultdict(Histogram)
+
+    def increment(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += amount
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            self.histograms[name, tuple(sorted(labels.items()))].observe(value)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'uptime': time.time() - self.started,
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'histograms': [dict(histogram.summary(), name=name, labels=dict(labels))
+                               for (name, labels), histogram in sorted(self.histograms.items())],
+            }
+
+    def prometheus(self, gauges=()):
+        """Renders every metric, plus `gauges` given as (name, labels, value), in the Prometheus text format."""
+        def line(name, labels, value):
+            if labels:
+                name += '{%s}' % ','.join('%s="%s"' % (key, str(label).replace('\\', '\\\\').replace('"', '\\"'))
+                                          for key, label in labels)
+            return '%s %s' % (name, repr(float(value)))
+
+        lines = []
+        with self.lock:
+            lines.append(line('bridge_uptime_seconds', (), time.time() - self.started))
+            for name, labels, value in gauges:
+                lines.append(line('bridge_' + name, tuple(sorted(labels.items())), value))
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(line('bridge_%s_total' % name, labels, value))
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                name = 'bridge_%s_seconds' % name
+                seen = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    seen += count
+                    lines.append(line(name + '_bucket', labels + (('le', bound),), seen))
+                lines.append(line(name + '_sum', labels, histogram.sum))
+                lines.append(line(name + '_count', labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the bridge's metrics to Prometheus at /metrics. Only meant to be reachable from the local network."""
+
+    def __init__(self, request, client_address, server, judges):
+        self.judges = judges
+        super().__init__(request, client_address, server)
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.judges.prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug('Metrics request from %s: %s', self.client_address[0], format % args)
@@ -6,9 +6,15 @@ class ThreadingTCPListener(ThreadingMixIn, TCPServer):
     allow_reuse_address = True
 
 
+class SharedTCPListener(ThreadingTCPListener):
+    # Lets several bridge processes listen on the same address, with the kernel spreading connections between them.
+    allow_reuse_port = True
+
+
 class Server:
-    def __init__(self, addresses, handler):
-        self.servers = [ThreadingTCPListener(address, handler) for address in addresses]
+    def __init__(self, addresses, handler, reuse_port=False):
+        listener = SharedTCPListener if reuse_port else ThreadingTCPListener
+        self.servers = [listener(address, handler) for address in addresses]
         self._shutdown = threading.Event()
 
     def serve_forever(self):
@@ -0,0 +1,477 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+from judge import judgeapi
+from judge.bridge.judge_handler import SubmissionUnavailable
+from judge.bridge.judge_list import JudgeList
+from judge.bridge.submission_queue import QueuedSubmission, SubmissionQueue
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger('judge.bridge')
+
+
+class SharedStore(object):
+    """
+    The keys in a Redis-compatible store through which several bridge instances share one queue and one registry of
+    judges. Every instance has a name, and registers the address that the others can pass requests on to it at.
+    """
+
+    # An instance that has not sent a heartbeat for this many seconds is considered gone.
+    instance_timeout = 30
+    # Seconds after which an instance that claimed to clean up after stopped instances is assumed to have failed.
+    recovery_timeout = 300
+
+    def __init__(self, client, instance, prefix='bridge'):
+        self.client = client
+        self.instance = instance
+        self.prefix = prefix
+
+    @classmethod
+    def from_settings(cls, instance=None):
+        if redis is None:
+            raise ImportError('the redis package is required for BRIDGED_SHARED_STORE')
+        client = redis.Redis.from_url(settings.BRIDGED_SHARED_STORE, decode_responses=True)
+        return cls(client, instance or '%s:%d' % (socket.gethostname(), os.getpid()), settings.BRIDGED_SHARED_PREFIX)
+
+    def key(self, *parts):
+        return ':'.join(map(str, (self.prefix,) + parts))
+
+    def publish(self, event):
+        self.client.publish(self.key('events'), event)
+
+    def subscribe(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.key('events'))
+        return pubsub
+
+    def heartbeat(self, address):
+        self.client.hset(self.key('instances'), self.instance,
+                         json.dumps({'address': list(address), 'seen': time.time()}))
+
+    def instances(self):
+        """Returns the addresses of the live instances, by name."""
+        now = time.time()
+        instances = {}
+        for name, data in self.client.hgetall(self.key('instances')).items():
+            data = json.loads(data)
+            if now - data['seen'] < self.instance_timeout:
+                instances[name] = tuple(data['address'])
+        return instances
+
+    def _delete_if(self, key, value, field=None):
+        """Deletes a key, or a field of a hash, if it still has the given value. Returns whether it did."""
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    if (pipe.get(key) if field is None else pipe.hget(key, field)) != value:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    if field is None:
+                        pipe.delete(key)
+                    else:
+                        pipe.hdel(key, field)
+                    return bool(pipe.execute()[0])
+                except redis.WatchError:
+                    continue
+
+    def claim_recovery(self):
+        """Returns whether this instance may clean up after stopped instances, which no other may do meanwhile."""
+        return bool(self.client.set(self.key('recovery'), self.instance, nx=True, ex=self.recovery_timeout))
+
+    def release_recovery(self):
+        self._delete_if(self.key('recovery'), self.instance)
+
+    def claim_orphans(self):
+        """
+        Takes over what instances that stopped without forgetting it left registered, so that only one instance
+        cleans up after each of them. Returns the names of their judges, and the ids of the submissions they were
+        grading.
+        """
+        instances = set(self.instances()) | {self.instance}
+        judges = [name for name, data in self.client.hgetall(self.key('judges')).items()
+                  if json.loads(data)['instance'] not in instances and
+                  self._delete_if(self.key('judges'), data, name)]
+        grading = [int(id) for id, instance in self.client.hgetall(self.key('grading')).items()
+                   if instance not in instances and self._delete_if(self.key('grading'), instance, id)]
+        return judges, grading
+
+    def peer_address(self, instance):
+        if instance is None or instance == self.instance:
+            return None
+        return self.instances().get(instance)
+
+    def forget(self):
+        """Removes whatever this instance registered, including what a previous process by the same name left."""
+        judges = [name for name, data in self.client.hgetall(self.key('judges')).items()
+                  if json.loads(data)['instance'] == self.instance]
+        if judges:
+            self.client.hdel(self.key('judges'), *judges)
+        grading = [id for id, instance in self.client.hgetall(self.key('grading')).items() if instance == self.instance]
+        if grading:
+            self.client.hdel(self.key('grading'), *grading)
+        self.client.hdel(self.key('instances'), self.instance)
+        self.publish('judges')
+
+    def register_judge(self, name, tier, is_disabled):
+        self.client.hset(self.key('judges'), name,
+                         json.dumps({'instance': self.instance, 'tier': tier, 'disabled': is_disabled}))
+        self.publish('judges')
+
+    def unregister_judge(self, name):
+        if self.judge_owner(name) == self.instance:
+            self.client.hdel(self.key('judges'), name)
+            self.publish('judges')
+
+    def judge_owner(self, name):
+        data = self.client.hget(self.key('judges'), name)
+        return json.loads(data)['instance'] if data is not None else None
+
+    def judges(self):
+        """Returns the registered judges of live instances, by name."""
+        instances = self.instances()
+        judges = {}
+        for name, data in self.client.hgetall(self.key('judges')).items():
+            data = json.loads(data)
+            if data['instance'] in instances:
+                judges[name] = data
+        return judges
+
+    def claim_grading(self, submission):
+        """Records that this instance grades a submission, unless another already does. Returns whether it did."""
+        return bool(self.client.hsetnx(self.key('grading'), submission, self.instance))
+
+    def clear_grading(self, submission, instance=None):
+        """Forgets who is grading a submission, only if it is `instance` if given."""
+        if instance is None:
+            self.client.hdel(self.key('grading'), submission)
+        else:
+            self._delete_if(self.key('grading'), instance, submission)
+
+    def grading_owner(self, submission):
+        return self.client.hget(self.key('grading'), submission)
+
+    def live_grading(self):
+        """Returns the ids of the submissions being graded through live instances."""
+        instances = self.instances()
+        return [int(id) for id, instance in self.client.hgetall(self.key('grading')).items() if instance in instances]
+
+
+class SharedSubmissionQueue(SubmissionQueue):
+    """
+    A SubmissionQueue kept in a SharedStore, and dispatched from by every instance.
+
+    The layout is that of SubmissionQueue: per priority, a list for every bucket, and a sorted set of the buckets by
+    the sequence number of their oldest submission. A judge looks through the buckets the same way, and then takes
+    the submission it picked off the head of its bucket in a transaction, which fails if another instance got there
+    first. Removing a submission only forgets that it is queued; the entry itself is skipped and dropped by whoever
+    comes across it next.
+    """
+
+    # Times to look for another submission after other instances took the ones picked, before giving up until the
+    # next poll.
+    claim_attempts = 10
+
+    def __init__(self, priorities, store):
+        self.priorities = priorities
+        self.store = store
+        self.client = store.client
+        self._recent_rejudges = deque(maxlen=self.share_window)
+
+    @staticmethod
+    def now():
+        # Submissions are queued and dispatched by different processes, which only share the wall clock.
+        return time.time()
+
+    def __len__(self):
+        return self.client.hlen(self.store.key('queued'))
+
+    def __contains__(self, id):
+        return bool(self.client.hexists(self.store.key('queued'), id))
+
+    @property
+    def sizes(self):
+        return [int(size or 0) for size in self.client.hmget(self.store.key('sizes'), list(range(self.priorities)))]
+
+    @staticmethod
+    def _bucket_key(submission):
+        return json.dumps([submission.problem, submission.language, submission.judge_id,
+                           sorted(submission.banned_judges)])
+
+    def _heads(self, priority):
+        return self.store.key('heads', priority)
+
+    def _bucket(self, priority, key):
+        return self.store.key('bucket', priority, key)
+
+    @staticmethod
+    def _loads(data):
+        submission = QueuedSubmission(*json.loads(data))
+        return submission._replace(banned_judges=tuple(submission.banned_judges))
+
+    def push(self, id, problem, language, source, judge_id, priority, banned_judges=()):
+        submission = QueuedSubmission(id, problem, language, source, judge_id, tuple(banned_judges or ()),
+                                      priority, self.client.incr(self.store.key('sequence')), self.now())
+        key = self._bucket_key(submission)
+        if not self.client.hsetnx(self.store.key('queued'), id, priority):
+            return None
+
+        pipe = self.client.pipeline()
+        pipe.rpush(self._bucket(priority, key), json.dumps(submission))
+        pipe.zadd(self._heads(priority), {key: submission.sequence}, nx=True)
+        pipe.hincrby(self.store.key('sizes'), priority, 1)
+        pipe.execute()
+        self.store.publish('queued')
+        return submission
+
+    def remove(self, id):
+        priority = self.client.hget(self.store.key('queued'), id)
+        if priority is None or not self.client.hdel(self.store.key('queued'), id):
+            return False
+        self.client.hincrby(self.store.key('sizes'), priority, -1)
+        return True
+
+    def release(self, submission):
+        # Back to the head of its bucket, where it was taken from.
+        key = self._bucket_key(submission)
+        if not self.client.hsetnx(self.store.key('queued'), submission.id, submission.priority):
+            return
+
+        pipe = self.client.pipeline()
+        pipe.lpush(self._bucket(submission.priority, key), json.dumps(submission))
+        pipe.zadd(self._heads(submission.priority), {key: submission.sequence})
+        pipe.hincrby(self.store.key('sizes'), submission.priority, 1)
+        pipe.execute()
+        self.store.publish('queued')
+
+    def _pop(self, submission):
+        """Takes `submission` off the head of its bucket, if it is still there. Returns whether it was still queued."""
+        key = self._bucket_key(submission)
+        heads = self._heads(submission.priority)
+        bucket = self._bucket(submission.priority, key)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(bucket)
+                    entries = pipe.lrange(bucket, 0, 1)
+                    if not entries or self._loads(entries[0]) != submission:
+                        pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.lpop(bucket)
+                    if len(entries) > 1:
+                        pipe.zadd(heads, {key: self._loads(entries[1]).sequence})
+                    else:
+                        pipe.zrem(heads, key)
+                    pipe.hdel(self.store.key('queued'), submission.id)
+                    queued = pipe.execute()[-1]
+                    break
+                except redis.WatchError:
+                    continue
+
+        if queued:
+            self.client.hincrby(self.store.key('sizes'), submission.priority, -1)
+        return bool(queued)
+
+    def _head(self, priority, key):
+        while True:
+            data = self.client.lindex(self._bucket(priority, key), 0)
+            if data is None:
+                return None
+            submission = self._loads(data)
+            if submission.id in self:
+                return submission
+            # Removed while queued, so drop it for good.
+            self._pop(submission)
+
+    def oldest(self, priority):
+        while True:
+            keys = self.client.zrange(self._heads(priority), 0, 0)
+            if not keys:
+                return None
+            # Dropping what was removed from a bucket may empty it, and take it off the heads.
+            submission = self._head(priority, keys[0])
+            if submission is not None:
+                return submission
+
+    def _first_for(self, judge, priority, prefer=None):
+        heads = self._heads(priority)
+        start = 0
+        first = None
+        while True:
+            keys = self.client.zrange(heads, start, start + 99)
+            if not keys:
+                return first
+            for key in keys:
+                problem, language, judge_id, banned_judges = json.loads(key)
+                if judge.name not in banned_judges and judge.can_judge(problem, language, judge_id):
+                    submission = self._head(priority, key)
+                    if submission is None:
+                        continue
+                    if first is None:
+                        first = submission
+                    elif submission.queued - first.queued > settings.BRIDGED_LOCALITY_QUEUE_TOLERANCE:
+                        return first
+                    if prefer is None or prefer(problem):
+                        return submission
+            start += len(keys)
+
+    def next_for(self, judge, should_reserve_judge, prefer=None):
+        for _ in range(self.claim_attempts):
+            submission = super().next_for(judge, should_reserve_judge, prefer)
+            if submission is None or self._pop(submission):
+                return submission
+        return None
+
+
+class SharedJudgeList(JudgeList):
+    """
+    The JudgeList of one of several bridge instances that share a queue and a registry of judges in a SharedStore.
+
+    Each instance dispatches to the judges connected to it, either right away or from the shared queue. Instances
+    tell each other about newly queued submissions and changes to the registry, and also check the queue every
+    `poll_interval` seconds in case a message was missed. Tiers apply across all instances.
+    """
+
+    poll_interval = 1
+    heartbeat_interval = 5
+
+    def __init__(self, store):
+        super().__init__(queue=SharedSubmissionQueue(self.priorities, store))
+        self.store = store
+        self.address = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, address):
+        """Joins the other instances, which can pass requests on to this one at `address`."""
+        self.address = address
+        self.store.forget()
+        self.store.heartbeat(address)
+        self._thread = threading.Thread(target=self._listen, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.store.forget()
+
+    def reclaim(self):
+        """Marks offline the judges of instances that stopped, and queues again what they were grading."""
+        from judge.bridge.daemon import recover_queue, reset_judges
+
+        judges, grading = self.store.claim_orphans()
+        if judges:
+            logger.warning('Judges of stopped bridge instances left: %s', ', '.join(judges))
+            reset_judges(names=judges)
+        if grading:
+            logger.warning('Queuing again %d submissions that stopped bridge instances were grading', len(grading))
+            recover_queue(self, ids=grading)
+
+    def _listen(self):
+        pubsub = self.store.subscribe()
+        last_heartbeat = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                try:
+                    message = pubsub.get_message(timeout=self.poll_interval)
+                    if time.monotonic() - last_heartbeat >= self.heartbeat_interval:
+                        self.store.heartbeat(self.address)
+                        last_heartbeat = time.monotonic()
+                        self.reclaim()
+                    if message is not None and message['data'] == 'judges':
+                        self._update_min_tier()
+                    self.dispatch_free()
+                except Exception:
+                    logger.exception('Error while listening to other bridge instances')
+                    self._stop.wait(self.poll_interval)
+        finally:
+            pubsub.close()
+
+    def dispatch_free(self):
+        """Offers queued submissions, possibly queued by other instances, to every free judge of this instance."""
+        with self.lock:
+            for judge in self.current_tier_judges():
+                if not judge.working:
+                    self._handle_free_judge(judge)
+
+    def _find_min_tier(self):
+        tiers = [judge['tier'] for judge in self.store.judges().values()
+                 if judge['tier'] is not None and not judge['disabled']]
+        local = super()._find_min_tier()
+        if local is not None:
+            tiers.append(local)
+        return min(tiers, default=None)
+
+    def _forward(self, address, packet):
+        return judgeapi.judge_request(dict(packet, forwarded=True), address=address)
+
+    def register(self, judge):
+        # A judge may only be connected once, to any instance.
+        address = self.store.peer_address(self.store.judge_owner(judge.name))
+        if address is not None:
+            try:
+                self._forward(address, {'name': 'disconnect-judge', 'judge-id': judge.name, 'force': True})
+            except Exception:
+                logger.exception('Failed to disconnect %s from the bridge at %s', judge.name, address)
+        self.store.register_judge(judge.name, judge.tier, judge.is_disabled)
+        super().register(judge)
+
+    def remove(self, judge):
+        with self.lock:
+            submission = judge.get_current_submission()
+            super().remove(judge)
+            if submission is not None:
+                self.store.clear_grading(submission)
+            # Judges of the same name replace each other, so the one leaving may not be the one registered.
+            if judge.name is not None and not any(other.name == judge.name for other in self.judges):
+                self.store.unregister_judge(judge.name)
+
+    def update_disable_judge(self, judge_id, is_disabled):
+        with self.lock:
+            for judge in self.judges:
+                if judge.name == judge_id:
+                    self.store.register_judge(judge.name, judge.tier, is_disabled)
+            super().update_disable_judge(judge_id, is_disabled)
+
+    def judge(self, id, problem, language, source, judge_id, priority, banned_judges=[]):
+        owner = self.store.grading_owner(id)
+        if owner is not None:
+            # Already being graded through another instance, unless that one stopped.
+            if owner in self.store.instances():
+                return
+            self.store.clear_grading(id, owner)
+        super().judge(id, problem, language, source, judge_id, priority, banned_judges)
+
+    def _submit(self, judge, id, problem, language, source, priority, queued=None):
+        # Claimed before it is sent, so that no instance queues it again meanwhile, nor sends it along with this one.
+        if not self.store.claim_grading(id):
+            raise SubmissionUnavailable('submission %s is already being graded through another instance' % id)
+        try:
+            super()._submit(judge, id, problem, language, source, priority, queued)
+        except Exception:
+            self.store.clear_grading(id)
+            raise
+
+    def on_judge_free(self, judge, submission):
+        super().on_judge_free(judge, submission)
+        self.store.clear_grading(submission)
+
+    def peer_for_submission(self, submission):
+        return self.store.peer_address(self.store.grading_owner(submission))
+
+    def peer_for_judge(self, judge_id):
+        return self.store.peer_address(self.store.judge_owner(judge_id))
@@ -0,0 +1,195 @@
+import time
+from bisect import bisect_left, insort
+from collections import deque, namedtuple
+from itertools import count
+
+from django.conf import settings
+
+from judge.judge_priority import CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY, REJUDGE_PRIORITY
+
+try:
+    from llist import dllist
+except ImportError:
+    from pyllist import dllist
+
+QueuedSubmission = namedtuple(
+    'QueuedSubmission', 'id problem language source judge_id banned_judges priority sequence queued',
+)
+
+
+class SubmissionQueue(object):
+    """
+    Submissions waiting for a judge.
+
+    Within each priority, submissions are bucketed by everything a judge is checked against before it may grade
+    them: the problem, the language, the judge the submission is pinned to, and the judges banned from it. Every
+    submission in a bucket is eligible for exactly the same judges, so only the oldest submission of each bucket is
+    ever a dispatch candidate.
+
+    The heads of the buckets are kept sorted by arrival, and a free judge walks them oldest-first until it finds a
+    bucket it can grade. Dispatching therefore costs the number of older buckets the judge cannot grade, rather than
+    the length of the queue.
+
+    Priorities are strict unless the queue is told otherwise, see next_for.
+    """
+
+    # Number of recent dispatches that BRIDGED_REJUDGE_MIN_SHARE is measured over.
+    share_window = 100
+
+    def __init__(self, priorities):
+        self.priorities = priorities
+        self.buckets = [{} for _ in range(priorities)]
+        self.heads = [[] for _ in range(priorities)]
+        self.sizes = [0] * priorities
+        self.node_map = {}
+        self._sequence = count()
+        self._recent_rejudges = deque(maxlen=self.share_window)
+
+    def __len__(self):
+        return len(self.node_map)
+
+    @staticmethod
+    def now():
+        """The clock that queue times are measured with."""
+        return time.monotonic()
+
+    def __contains__(self, id):
+        return id in self.node_map
+
+    @staticmethod
+    def _bucket_key(submission):
+        return submission.problem, submission.language, submission.judge_id, frozenset(submission.banned_judges)
+
+    def push(self, id, problem, language, source, judge_id, priority, banned_judges=()):
+        submission = QueuedSubmission(id, problem, language, source, judge_id, tuple(banned_judges or ()),
+                                      priority, next(self._sequence), self.now())
+        key = self._bucket_key(submission)
+        bucket = self.buckets[priority].get(key)
+        if bucket is None:
+            bucket = self.buckets[priority][key] = dllist()
+            # Sequence numbers only grow, so a new bucket always goes last.
+            self.heads[priority].append((submission.sequence, key))
+        self.node_map[id] = (key, bucket.append(submission))
+        self.sizes[priority] += 1
+        return submission
+
+    def remove(self, id):
+        try:
+            key, node = self.node_map.pop(id)
+        except KeyError:
+            return None
+
+        submission = node.value
+        priority = submission.priority
+        buckets = self.buckets[priority]
+        bucket = buckets[key]
+        was_head = bucket.first is node
+        bucket.remove(node)
+        self.sizes[priority] -= 1
+
+        if was_head:
+            heads = self.heads[priority]
+            del heads[bisect_left(heads, (submission.sequence,))]
+            if bucket.size:
+                insort(heads, (bucket.first.value.sequence, key))
+            else:
+                del buckets[key]
+        return submission
+
+    def oldest(self, priority):
+        """Returns the submission that has been waiting longest at `priority`, or None."""
+        heads = self.heads[priority]
+        if not heads:
+            return None
+        return self.buckets[priority][heads[0][1]].first.value
+
+    def release(self, submission):
+        """Called with a submission from next_for that could not be dispatched. It was never taken off the queue."""
+
+    def record_dispatch(self, priority):
+        self._recent_rejudges.append(priority >= REJUDGE_PRIORITY)
+
+    def rejudge_share(self):
+        """Returns the fraction of recent dispatches that were rejudges, or None if nothing was dispatched yet."""
+        if not self._recent_rejudges:
+            return None
+        return sum(self._recent_rejudges) / len(self._recent_rejudges)
+
+    @staticmethod
+    def aged_arrival(submission):
+        """
+        With BRIDGED_QUEUE_AGING_TIME, a submission below normal priority counts as having arrived that many seconds
+        later for every priority it is below normal, and then competes with normal submissions in order of arrival.
+        A rejudge therefore goes ahead of a normal submission that has waited BRIDGED_QUEUE_AGING_TIME less than it,
+        so that it is delayed, but never starved.
+        """
+        return submission.queued + \
+            max(0, submission.priority - DEFAULT_PRIORITY) * settings.BRIDGED_QUEUE_AGING_TIME
+
+    def _first_for(self, judge, priority, prefer=None):
+        first = None
+        for _, (problem, language, judge_id, banned_judges) in self.heads[priority]:
+            if judge.name not in banned_judges and judge.can_judge(problem, language, judge_id):
+                submission = self.buckets[priority][problem, language, judge_id, banned_judges].first.value
+                if first is None:
+                    first = submission
+                elif submission.queued - first.queued > settings.BRIDGED_LOCALITY_QUEUE_TOLERANCE:
+                    return first
+                if prefer is None or prefer(problem):
+                    return submission
+        return first
+
+    def next_for(self, judge, should_reserve_judge, prefer=None):
+        """
+        Returns the oldest submission of the most urgent priority that `judge` is allowed to grade, or None. Given
+        `prefer`, which is called with a problem, a submission to a problem it accepts goes ahead of those at the same
+        priority queued at most BRIDGED_LOCALITY_QUEUE_TOLERANCE seconds before it.
+
+        `should_reserve_judge` is consulted before handing out anything at rejudge priority or lower, so that a judge
+        is kept free for more important work.
+
+        Two settings keep rejudges from starving behind a steady stream of submissions. With BRIDGED_QUEUE_AGING_TIME,
+        everything but contest submissions is ordered by aged_arrival, and a rejudge that has aged past its arrival no
+        longer waits for a reserved judge. With BRIDGED_REJUDGE_MIN_SHARE, a rejudge goes first, reserved judge or
+        not, whenever rejudges got less than that share of the recent dispatches. Neither applies while a contest
+        submission has waited BRIDGED_CONTEST_LATENCY_TARGET seconds or more.
+        """
+        now = self.now()
+        aging = settings.BRIDGED_QUEUE_AGING_TIME
+        min_share = settings.BRIDGED_REJUDGE_MIN_SHARE
+        share = self.rejudge_share()
+        share_due = bool(min_share) and share is not None and share < min_share
+        overtaking = share_due or bool(aging)
+
+        candidates = []
+        sizes = self.sizes
+        for priority in range(self.priorities):
+            if not sizes[priority]:
+                continue
+            submission = self._first_for(judge, priority, prefer)
+            if submission is not None:
+                candidates.append(submission)
+                # Otherwise, nothing can overtake the most urgent submission this judge can grade.
+                if not overtaking:
+                    break
+        if not candidates:
+            return None
+
+        first = candidates[0]
+        target = settings.BRIDGED_CONTEST_LATENCY_TARGET
+        if first.priority == CONTEST_SUBMISSION_PRIORITY and target is not None and now - first.queued >= target:
+            return first
+
+        if share_due:
+            for submission in candidates:
+                if submission.priority >= REJUDGE_PRIORITY:
+                    return submission
+
+        best = first
+        reserve = best.priority >= REJUDGE_PRIORITY
+        if aging and first.priority != CONTEST_SUBMISSION_PRIORITY:
+            best = min(candidates, key=lambda submission: (self.aged_arrival(submission), submission.sequence))
+            reserve = best.priority >= REJUDGE_PRIORITY and now < self.aged_arrival(best)
+        if reserve and should_reserve_judge():
+            return None
+        return best
@@ -1,10 +1,10 @@
+from collections import defaultdict
+
 from django.core.exceptions import ValidationError
-from django.db import connection
 from django.utils.translation import gettext as _, gettext_lazy, ngettext
 
 from judge.contest_format.default import DefaultContestFormat
 from judge.contest_format.registry import register_contest_format
-from judge.timezone import from_database_time
 
 
 @register_contest_format('atcoder')
@@ -37,56 +37,43 @@ class AtCoderContestFormat(DefaultContestFormat):
         self.config.update(config or {})
         self.contest = contest
 
-    def update_participation(self, participation):
+    def get_bulk_format_data(self, participations, problem_id=None):
+        starts = {participation.id: participation.start for participation in participations}
+        tries = self.get_tries(participations, problem_id) if self.config['penalty'] else None
+        format_data = defaultdict(dict)
+
+        for participation_id, prob, score, time in self.get_best_submissions(participations, problem_id):
+            dt = (time - starts[participation_id]).total_seconds()
+
+            # Compute penalty
+            if self.config['penalty']:
+                subs = tries[participation_id, prob]
+                if score:
+                    prev = sum(date <= time for date in subs) - 1
+                else:
+                    # We should always display the penalty, even if the user has a score of 0
+                    prev = len(subs)
+            else:
+                prev = 0
+
+            format_data[participation_id][str(prob)] = {'time': dt, 'points': score, 'penalty': prev}
+        return format_data
+
+    def set_participation_results(self, participation, format_data):
         cumtime = 0
         penalty = 0
         points = 0
-        format_data = {}
-
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT MAX(cs.points) as `score`, (
-                    SELECT MIN(csub.date)
-                        FROM judge_contestsubmission ccs LEFT OUTER JOIN
-                             judge_submission csub ON (csub.id = ccs.submission_id)
-                        WHERE ccs.problem_id = cp.id AND ccs.participation_id = %s AND ccs.points = MAX(cs.points)
-                ) AS `time`, cp.id AS `prob`
-                FROM judge_contestproblem cp INNER JOIN
-                     judge_contestsubmission cs ON (cs.problem_id = cp.id AND cs.participation_id = %s) LEFT OUTER JOIN
-                     judge_submission sub ON (sub.id = cs.submission_id)
-                GROUP BY cp.id
-            """, (participation.id, participation.id))
-
-            for score, time, prob in cursor.fetchall():
-                time = from_database_time(time)
-                dt = (time - participation.start).total_seconds()
-
-                # Compute penalty
-                if self.config['penalty']:
-                    # An IE can have a submission result of `None`
-                    subs = participation.submissions.exclude(submission__result__isnull=True) \
-                                                    .exclude(submission__result__in=['IE', 'CE']) \
-                                                    .filter(problem_id=prob)
-                    if score:
-                        prev = subs.filter(submission__date__lte=time).count() - 1
-                        penalty += prev * self.config['penalty'] * 60
-                    else:
-                        # We should always display the penalty, even if the user has a score of 0
-                        prev = subs.count()
-                else:
-                    prev = 0
-
-                if score:
-                    cumtime = max(cumtime, dt)
 
-                format_data[str(prob)] = {'time': dt, 'points': score, 'penalty': prev}
-                points += score
+        for data in format_data.values():
+            if data['points']:
+                cumtime = max(cumtime, data['time'])
+                penalty += data['penalty'] * self.config['penalty'] * 60
+            points += data['points']
 
         participation.cumtime = max(cumtime + penalty, 0)
         participation.score = round(points, self.contest.points_precision)
         participation.tiebreaker = 0
         participation.format_data = format_data
-        participation.save()
 
     def get_short_form_display(self):
         yield _('The maximum score submission for each problem will be used.')
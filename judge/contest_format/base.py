@@ -47,6 +47,31 @@ class BaseContestFormat(metaclass=ABCMeta):
         """
         raise NotImplementedError()
 
+    def update_participations(self, participations):
+        """
+        Updates the score, cumtime, and format_data fields of many ContestParticipation objects of this contest, like
+        update_participation does, but without saving them. The caller saves them in bulk. Formats that can compute
+        them with a few queries for all participations at once, rather than a few for each, should override this.
+
+        :param participations: A list of ContestParticipation objects.
+        :return: None
+        """
+        for participation in participations:
+            self.update_participation(participation)
+
+    def apply_submission(self, participation, problem_id, submission=None):
+        """
+        Updates a ContestParticipation object after a submission to one problem was graded. Formats that can update
+        only that problem's format_data entry, rather than recompute everything, should override this. Whatever
+        changed outside that problem, such as a rescore or disqualification, goes through update_participation.
+
+        :param participation: A ContestParticipation object, whose format_data is up to date.
+        :param problem_id: The id of the ContestProblem that was submitted to.
+        :param submission: The Submission that was graded, if known.
+        :return: None
+        """
+        self.update_participation(participation)
+
     def get_format_data_for_api(self, entry, problem_points, frozen=False):
         """
         Returns a sanitized copy of a single problem's format_data entry safe to expose via the ranking JSON API.
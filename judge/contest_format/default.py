@@ -1,9 +1,13 @@
+from collections import defaultdict
+
 from django.core.exceptions import ValidationError
+from django.db import connection
 from django.db.models import Max
 from django.utils.translation import gettext as _, gettext_lazy
 
 from judge.contest_format.base import BaseContestFormat
 from judge.contest_format.registry import register_contest_format
+from judge.timezone import from_database_time, to_database_time
 
 
 @register_contest_format('default')
@@ -18,24 +22,114 @@ class DefaultContestFormat(BaseContestFormat):
     def __init__(self, contest, config):
         super(DefaultContestFormat, self).__init__(contest, config)
 
-    def update_participation(self, participation):
+    def get_bulk_format_data(self, participations, problem_id=None):
+        """
+        Returns the format_data entries of the problems each participant submitted to, or only of `problem_id`, by
+        participation id. Entries are in order of problem id.
+        """
+        from judge.models import ContestSubmission
+
+        starts = {participation.id: participation.start for participation in participations}
+        submissions = ContestSubmission.objects.filter(participation_id__in=starts)
+        if problem_id is not None:
+            submissions = submissions.filter(problem_id=problem_id)
+
+        format_data = defaultdict(dict)
+        for result in submissions.values('participation_id', 'problem_id') \
+                                 .annotate(time=Max('submission__date'), points=Max('points')) \
+                                 .order_by('participation_id', 'problem_id'):
+            participation_id = result['participation_id']
+            dt = (result['time'] - starts[participation_id]).total_seconds()
+            format_data[participation_id][str(result['problem_id'])] = {'time': dt, 'points': result['points']}
+        return format_data
+
+    def get_best_submissions(self, participations, problem_id=None, before=None):
+        """
+        Returns the maximum points of each participant on each problem they submitted to, or only on `problem_id`,
+        with the time they first got them, as (participation id, problem id, points, time) in order of participation
+        and problem id. With `before`, only submissions made before then count.
+        """
+        ids = [participation.id for participation in participations]
+        if not ids:
+            return []
+        if before is not None:
+            before = to_database_time(before)
+
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT cs.participation_id AS `part`, cp.id AS `prob`, MAX(cs.points) as `points`, (
+                    SELECT MIN(csub.date)
+                        FROM judge_contestsubmission ccs LEFT OUTER JOIN
+                             judge_submission csub ON (csub.id = ccs.submission_id)
+                        WHERE ccs.problem_id = cp.id AND ccs.participation_id = cs.participation_id AND
+                              ccs.points = MAX(cs.points) AND (%s IS NULL OR csub.date < %s)
+                ) AS `time`
+                FROM judge_contestproblem cp INNER JOIN
+                     judge_contestsubmission cs ON (cs.problem_id = cp.id AND cs.participation_id IN ({ids}))
+                     LEFT OUTER JOIN judge_submission sub ON (sub.id = cs.submission_id)
+                WHERE (%s IS NULL OR sub.date < %s) AND (%s IS NULL OR cp.id = %s)
+                GROUP BY cs.participation_id, cp.id
+                ORDER BY cs.participation_id, cp.id
+            """.format(ids=', '.join(['%s'] * len(ids))),
+                (before, before, *ids, before, before, problem_id, problem_id))
+            return [(participation_id, problem_id, points, from_database_time(time))
+                    for participation_id, problem_id, points, time in cursor.fetchall()]
+
+    def get_tries(self, participations, problem_id=None):
+        """
+        Returns the dates of the submissions that count as tries, which excludes internal and compilation errors, by
+        participation and problem id.
+        """
+        from judge.models import ContestSubmission
+
+        # An IE can have a submission result of `None`
+        submissions = ContestSubmission.objects.filter(participation_id__in=[p.id for p in participations]) \
+                                               .exclude(submission__result__isnull=True) \
+                                               .exclude(submission__result__in=['IE', 'CE'])
+        if problem_id is not None:
+            submissions = submissions.filter(problem_id=problem_id)
+
+        tries = defaultdict(list)
+        for participation_id, problem_id, date in submissions.values_list('participation_id', 'problem_id',
+                                                                          'submission__date'):
+            tries[participation_id, problem_id].append(date)
+        return tries
+
+    def get_format_data(self, participation, problem_id=None):
+        return self.get_bulk_format_data([participation], problem_id)[participation.id]
+
+    def set_participation_results(self, participation, format_data):
+        """
+        Sets a ContestParticipation object's format_data, and the score, cumtime and tiebreaker that follow from it.
+        """
         cumtime = 0
         points = 0
-        format_data = {}
-
-        for result in participation.submissions.values('problem_id').annotate(
-                time=Max('submission__date'), points=Max('points'),
-        ):
-            dt = (result['time'] - participation.start).total_seconds()
-            if result['points']:
-                cumtime += dt
-            format_data[str(result['problem_id'])] = {'time': dt, 'points': result['points']}
-            points += result['points']
+        for data in format_data.values():
+            if data['points']:
+                cumtime += data['time']
+            points += data['points']
 
         participation.cumtime = max(cumtime, 0)
         participation.score = round(points, self.contest.points_precision)
         participation.tiebreaker = 0
         participation.format_data = format_data
+
+    def update_participations(self, participations):
+        format_data = self.get_bulk_format_data(participations)
+        for participation in participations:
+            self.set_participation_results(participation, format_data[participation.id])
+
+    def update_participation(self, participation):
+        self.update_participations([participation])
+        participation.save()
+
+    def apply_submission(self, participation, problem_id, submission=None):
+        format_data = dict(participation.format_data or {})
+        format_data.pop(str(problem_id), None)
+        format_data.update(self.get_format_data(participation, problem_id))
+        # Totals are summed up in order of problem id, as by update_participation.
+        format_data = dict(sorted(format_data.items(), key=lambda item: int(item[0])))
+        self.set_participation_results(participation, format_data)
         participation.save()
 
     def get_problem_breakdown(self, participation, contest_problems):
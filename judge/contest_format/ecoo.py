@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from django.core.exceptions import ValidationError
 from django.db.models import Count, Max, OuterRef, Subquery
 from django.utils.translation import gettext as _, gettext_lazy, ngettext
@@ -39,33 +41,40 @@ class ECOOContestFormat(DefaultContestFormat):
         self.config.update(config or {})
         self.contest = contest
 
-    def update_participation(self, participation):
-        cumtime = 0
-        score = 0
-        format_data = {}
+    def get_bulk_format_data(self, participations, problem_id=None):
+        from judge.models import ContestSubmission
+
+        by_id = {participation.id: participation for participation in participations}
+        format_data = defaultdict(dict)
 
-        submissions = participation.submissions.exclude(submission__result__in=('IE', 'CE'))
+        submissions = ContestSubmission.objects.filter(participation_id__in=by_id) \
+                                               .exclude(submission__result__in=('IE', 'CE'))
+        if problem_id is not None:
+            submissions = submissions.filter(problem_id=problem_id)
 
         submission_counts = {
-            data['problem_id']: data['count'] for data in submissions.values('problem_id').annotate(count=Count('id'))
+            (data['participation_id'], data['problem_id']): data['count']
+            for data in submissions.values('participation_id', 'problem_id').annotate(count=Count('id'))
         }
         queryset = (
             submissions
-            .values('problem_id')
+            .values('participation_id', 'problem_id')
             .filter(
                 submission__date=Subquery(
                     submissions
-                    .filter(problem_id=OuterRef('problem_id'))
+                    .filter(participation_id=OuterRef('participation_id'), problem_id=OuterRef('problem_id'))
                     .order_by('-submission__date')
                     .values('submission__date')[:1],
                 ),
             )
             .annotate(points=Max('points'))
-            .values_list('problem_id', 'problem__points', 'points', 'submission__date')
+            .values_list('participation_id', 'problem_id', 'problem__points', 'points', 'submission__date')
+            .order_by('participation_id', 'problem_id')
         )
 
-        for problem_id, problem_points, points, date in queryset:
-            sub_cnt = submission_counts.get(problem_id, 0)
+        for participation_id, problem_id, problem_points, points, date in queryset:
+            participation = by_id[participation_id]
+            sub_cnt = submission_counts.get((participation_id, problem_id), 0)
 
             dt = (date - participation.start).total_seconds()
 
@@ -78,7 +87,12 @@ class ECOOContestFormat(DefaultContestFormat):
                 if self.config['time_bonus']:
                     bonus += (participation.end_time - date).total_seconds() // 60 // self.config['time_bonus']
 
-            format_data[str(problem_id)] = {'time': dt, 'points': points, 'bonus': bonus}
+            format_data[participation_id][str(problem_id)] = {'time': dt, 'points': points, 'bonus': bonus}
+        return format_data
+
+    def set_participation_results(self, participation, format_data):
+        cumtime = 0
+        score = 0
 
         for data in format_data.values():
             if self.config['cumtime']:
@@ -89,7 +103,6 @@ class ECOOContestFormat(DefaultContestFormat):
         participation.score = round(score, self.contest.points_precision)
         participation.tiebreaker = 0
         participation.format_data = format_data
-        participation.save()
 
     def get_short_form_display(self):
         yield _('The score on your **last** non-CE submission for each problem will be used.')
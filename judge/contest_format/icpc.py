@@ -1,11 +1,10 @@
+from collections import defaultdict
+
 from django.core.exceptions import ValidationError
-from django.db import connection
-from django.db.models import Max
 from django.utils.translation import gettext as _, gettext_lazy, ngettext
 
 from judge.contest_format.default import DefaultContestFormat
 from judge.contest_format.registry import register_contest_format
-from judge.timezone import from_database_time
 
 
 @register_contest_format('icpc')
@@ -38,7 +37,58 @@ class ICPCContestFormat(DefaultContestFormat):
         self.config.update(config or {})
         self.contest = contest
 
-    def update_participation(self, participation):
+    def get_bulk_format_data(self, participations, problem_id=None):
+        by_id = {participation.id: participation for participation in participations}
+        tries = self.get_tries(participations, problem_id) if self.config['penalty'] else None
+        frozen_time = self.contest.frozen_time
+        format_data = defaultdict(dict)
+
+        for participation_id, prob, points, time in self.get_best_submissions(participations, problem_id):
+            participation = by_id[participation_id]
+            dt_second = (time - participation.start).total_seconds()
+            is_frozen_sub = (participation.is_frozen and time >= frozen_time)
+
+            frozen_points = 0
+            frozen_tries = 0
+            # Compute penalty
+            if self.config['penalty']:
+                subs = tries[participation_id, prob]
+                if points:
+                    # Submissions after the first AC does not count toward number of tries
+                    problem_tries = sum(date <= time for date in subs)
+                    if not is_frozen_sub:
+                        frozen_tries = problem_tries
+                    else:
+                        # For frozen sub, we should always display the number of tries
+                        frozen_tries = len(subs)
+                else:
+                    # We should always display the penalty, even if the user has a score of 0
+                    problem_tries = len(subs)
+                    frozen_tries = problem_tries
+                    # the query above returns the first submission with the
+                    # largest points. However, for computing & showing frozen scoreboard,
+                    # if the largest points is 0, we need to get the last submission.
+                    time = max(subs, default=None)
+                    # time can be None if there all of submissions are CE or IE.
+                    is_frozen_sub = (participation.is_frozen and time and time >= frozen_time)
+            else:
+                problem_tries = 0
+                # Don't need to set frozen_tries = 0 because we've initialized it with 0
+
+            if points and not is_frozen_sub:
+                frozen_points = points
+
+            format_data[participation_id][str(prob)] = {
+                'time': dt_second,
+                'points': points,
+                'frozen_points': frozen_points,
+                'tries': problem_tries,
+                'frozen_tries': frozen_tries,
+                'is_frozen': is_frozen_sub,
+            }
+        return format_data
+
+    def set_participation_results(self, participation, format_data):
         cumtime = 0
         last = 0
         penalty = 0
@@ -48,83 +98,25 @@ class ICPCContestFormat(DefaultContestFormat):
         frozen_last = 0
         frozen_penalty = 0
         frozen_score = 0
-        frozen_time = participation.contest.frozen_time
-
-        format_data = {}
-
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT MAX(cs.points) as `points`, (
-                    SELECT MIN(csub.date)
-                        FROM judge_contestsubmission ccs LEFT OUTER JOIN
-                             judge_submission csub ON (csub.id = ccs.submission_id)
-                        WHERE ccs.problem_id = cp.id AND ccs.participation_id = %s AND ccs.points = MAX(cs.points)
-                ) AS `time`, cp.id AS `prob`
-                FROM judge_contestproblem cp INNER JOIN
-                     judge_contestsubmission cs ON (cs.problem_id = cp.id AND cs.participation_id = %s) LEFT OUTER JOIN
-                     judge_submission sub ON (sub.id = cs.submission_id)
-                GROUP BY cp.id
-            """, (participation.id, participation.id))
-
-            for points, time, prob in cursor.fetchall():
-                time = from_database_time(time)
-                dt_second = (time - participation.start).total_seconds()
-                dt = int(dt_second // 60)
-                is_frozen_sub = (participation.is_frozen and time >= frozen_time)
-
-                frozen_points = 0
-                frozen_tries = 0
-                # Compute penalty
-                if self.config['penalty']:
-                    # An IE can have a submission result of `None`
-                    subs = participation.submissions.exclude(submission__result__isnull=True) \
-                                                    .exclude(submission__result__in=['IE', 'CE']) \
-                                                    .filter(problem_id=prob)
-                    if points:
-                        # Submissions after the first AC does not count toward number of tries
-                        tries = subs.filter(submission__date__lte=time).count()
-                        penalty += (tries - 1) * self.config['penalty']
-                        if not is_frozen_sub:
-                            # Because the sub have not frozen yet, we update the frozen_penalty just like
-                            # the normal penalty
-                            frozen_penalty += (tries - 1) * self.config['penalty']
-                            frozen_tries = tries
-                        else:
-                            # For frozen sub, we should always display the number of tries
-                            frozen_tries = subs.count()
-                    else:
-                        # We should always display the penalty, even if the user has a score of 0
-                        tries = subs.count()
-                        frozen_tries = tries
-                        # the raw SQL query above returns the first submission with the
-                        # largest points. However, for computing & showing frozen scoreboard,
-                        # if the largest points is 0, we need to get the last submission.
-                        time = subs.aggregate(time=Max('submission__date'))['time']
-                        # time can be None if there all of submissions are CE or IE.
-                        is_frozen_sub = (participation.is_frozen and time and time >= frozen_time)
-                else:
-                    tries = 0
-                    # Don't need to set frozen_tries = 0 because we've initialized it with 0
 
-                if points:
-                    cumtime += dt
-                    last = max(last, dt)
-                    score += points
-
-                    if not is_frozen_sub:
-                        frozen_points = points
-                        frozen_cumtime += dt
-                        frozen_last = max(frozen_last, dt)
-                        frozen_score += points
-
-                format_data[str(prob)] = {
-                    'time': dt_second,
-                    'points': points,
-                    'frozen_points': frozen_points,
-                    'tries': tries,
-                    'frozen_tries': frozen_tries,
-                    'is_frozen': is_frozen_sub,
-                }
+        for data in format_data.values():
+            points = data['points']
+            if not points:
+                continue
+            dt = int(data['time'] // 60)
+            tries_penalty = (data['tries'] - 1) * self.config['penalty']
+
+            cumtime += dt
+            last = max(last, dt)
+            penalty += tries_penalty
+            score += points
+
+            if not data['is_frozen']:
+                # Because the sub have not frozen yet, it counts towards the frozen results just like the normal ones
+                frozen_cumtime += dt
+                frozen_last = max(frozen_last, dt)
+                frozen_penalty += tries_penalty
+                frozen_score += points
 
         participation.cumtime = max(cumtime + penalty, 0)
         participation.score = round(score, self.contest.points_precision)
@@ -135,7 +127,6 @@ class ICPCContestFormat(DefaultContestFormat):
         participation.frozen_tiebreaker = frozen_last
 
         participation.format_data = format_data
-        participation.save()
 
     def get_format_data_for_api(self, entry, problem_points, frozen=False):
         if not entry:
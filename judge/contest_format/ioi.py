@@ -1,9 +1,14 @@
-from django.db import connection
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Min
 from django.utils.translation import gettext as _, gettext_lazy
 
 from judge.contest_format.legacy_ioi import LegacyIOIContestFormat
 from judge.contest_format.registry import register_contest_format
-from judge.timezone import from_database_time
+
+# Rows written at once when rebuilding the best results on batches.
+BATCH_RESULT_CHUNK_SIZE = 1000
 
 
 @register_contest_format('ioi16')
@@ -14,83 +19,134 @@ class IOIContestFormat(LegacyIOIContestFormat):
         cumtime: Specify True if time penalties are to be computed. Defaults to False.
     """
 
-    def update_participation(self, participation):
+    def get_batch_points(self, **filters):
+        """
+        Returns the points of the graded submissions matching `filters` on each of their batches, which are the
+        fewest points of any case in the batch, as (participation id, problem id, batch, points, date, submission id).
+        """
+        from judge.models import SubmissionTestCase
+
+        return SubmissionTestCase.objects.filter(submission__status='D', **filters) \
+            .values('submission__contest__participation_id', 'submission__contest__problem_id', 'batch',
+                    'submission__date', 'submission_id') \
+            .annotate(batch_points=Min('points')).order_by() \
+            .values_list('submission__contest__participation_id', 'submission__contest__problem_id', 'batch',
+                         'batch_points', 'submission__date', 'submission_id')
+
+    def update_batch_results(self, participations, problem_id=None):
+        """
+        Rebuilds the best result of each participant on each batch, or only on the batches of `problem_id`, from all
+        their graded submissions.
+        """
+        from judge.models import ContestBatchResult
+
+        ids = [participation.id for participation in participations]
+        filters = {'submission__contest__participation_id__in': ids}
+        results = ContestBatchResult.objects.filter(participation_id__in=ids)
+        if problem_id is not None:
+            filters['submission__contest__problem_id'] = problem_id
+            results = results.filter(problem_id=problem_id)
+
+        best = {}
+        for participation_id, problem_id, batch, points, date, submission_id in self.get_batch_points(**filters):
+            result = best.get((participation_id, problem_id, batch))
+            if result is None or (-points, date, submission_id) < (-result.points, result.date, result.submission_id):
+                best[participation_id, problem_id, batch] = ContestBatchResult(
+                    participation_id=participation_id, problem_id=problem_id, batch=batch, points=points, date=date,
+                    submission_id=submission_id,
+                )
+
+        with transaction.atomic():
+            results.delete()
+            ContestBatchResult.objects.bulk_create(best.values(), batch_size=BATCH_RESULT_CHUNK_SIZE)
+
+    def apply_batch_results(self, participation, problem_id, submission):
+        """Updates the best result of a participant on each batch of a problem with one graded submission."""
+        from judge.models import ContestBatchResult
+
+        results = {result.batch: result
+                   for result in ContestBatchResult.objects.filter(participation=participation, problem_id=problem_id)}
+        # None are kept yet, as in contests that were running when they were added, so build them from every submission.
+        if not results:
+            self.update_batch_results([participation], problem_id)
+            return
+
+        points = {batch: (points, date) for _, _, batch, points, date, _ in
+                  self.get_batch_points(submission_id=submission.id)}
+
+        # A rejudge may have lowered the best result on some batch, which another submission may then hold.
+        if any(result.submission_id == submission.id and (batch not in points or points[batch][0] < result.points)
+               for batch, result in results.items()):
+            self.update_batch_results([participation], problem_id)
+            return
+
+        created = []
+        updated = []
+        for batch, (points, date) in points.items():
+            result = results.get(batch)
+            if result is None:
+                created.append(ContestBatchResult(participation=participation, problem_id=problem_id, batch=batch,
+                                                  points=points, date=date, submission_id=submission.id))
+            elif (-points, date, submission.id) < (-result.points, result.date, result.submission_id):
+                result.points, result.date, result.submission_id = points, date, submission.id
+                updated.append(result)
+        ContestBatchResult.objects.bulk_create(created)
+        ContestBatchResult.objects.bulk_update(updated, ['points', 'date', 'submission'])
+
+    def get_bulk_format_data(self, participations, problem_id=None):
+        from judge.models import ContestBatchResult
+
+        starts = {participation.id: participation.start for participation in participations}
+        format_data = defaultdict(dict)
+        if not starts:
+            return format_data
+
+        results = ContestBatchResult.objects.filter(participation_id__in=starts)
+        if problem_id is not None:
+            results = results.filter(problem_id=problem_id)
+
+        for participation_id, problem_id, time, subtask_points in \
+                results.order_by('participation_id', 'problem_id', 'batch') \
+                       .values_list('participation_id', 'problem_id', 'date', 'points'):
+            problem_id = str(problem_id)
+            if self.config['cumtime']:
+                dt = (time - starts[participation_id]).total_seconds()
+            else:
+                dt = 0
+
+            problem_data = format_data[participation_id]
+            if problem_data.get(problem_id) is None:
+                problem_data[problem_id] = {'points': 0, 'time': 0}
+            problem_data[problem_id]['points'] += subtask_points
+            problem_data[problem_id]['time'] = max(dt, problem_data[problem_id]['time'])
+        return format_data
+
+    def update_participations(self, participations):
+        self.update_batch_results(participations)
+        super().update_participations(participations)
+
+    def apply_submission(self, participation, problem_id, submission=None):
+        if submission is None:
+            self.update_batch_results([participation], problem_id)
+        else:
+            self.apply_batch_results(participation, problem_id, submission)
+        super().apply_submission(participation, problem_id)
+
+    def set_participation_results(self, participation, format_data):
         cumtime = 0
         score = 0
-        format_data = {}
-
-        with connection.cursor() as cursor:
-            cursor.execute("""
-                SELECT q.prob,
-                       MIN(q.date) as `date`,
-                       q.batch_points
-                FROM (
-                         SELECT cp.id          as `prob`,
-                                sub.id         as `subid`,
-                                sub.date       as `date`,
-                                tc.points      as `points`,
-                                tc.batch       as `batch`,
-                                MIN(tc.points) as `batch_points`
-                         FROM judge_contestproblem cp
-                                  INNER JOIN
-                              judge_contestsubmission cs
-                              ON (cs.problem_id = cp.id AND cs.participation_id = %s)
-                                  LEFT OUTER JOIN
-                              judge_submission sub
-                              ON (sub.id = cs.submission_id AND sub.status = 'D')
-                                  INNER JOIN judge_submissiontestcase tc
-                              ON sub.id = tc.submission_id
-                         GROUP BY cp.id, tc.batch, sub.id
-                     ) q
-                         INNER JOIN (
-                    SELECT prob, batch, MAX(r.batch_points) as max_batch_points
-                    FROM (
-                             SELECT cp.id          as `prob`,
-                                    tc.batch       as `batch`,
-                                    MIN(tc.points) as `batch_points`
-                             FROM judge_contestproblem cp
-                                      INNER JOIN
-                                  judge_contestsubmission cs
-                                  ON (cs.problem_id = cp.id AND cs.participation_id = %s)
-                                      LEFT OUTER JOIN
-                                  judge_submission sub
-                                  ON (sub.id = cs.submission_id AND sub.status = 'D')
-                                      INNER JOIN judge_submissiontestcase tc
-                                  ON sub.id = tc.submission_id
-                             GROUP BY cp.id, tc.batch, sub.id
-                         ) r
-                    GROUP BY prob, batch
-                ) p
-                ON p.prob = q.prob AND (p.batch = q.batch OR p.batch is NULL AND q.batch is NULL)
-                WHERE p.max_batch_points = q.batch_points
-                GROUP BY q.prob, q.batch
-            """, (participation.id, participation.id))
-
-            for problem_id, time, subtask_points in cursor.fetchall():
-                problem_id = str(problem_id)
-                time = from_database_time(time)
-                if self.config['cumtime']:
-                    dt = (time - participation.start).total_seconds()
-                else:
-                    dt = 0
-
-                if format_data.get(problem_id) is None:
-                    format_data[problem_id] = {'points': 0, 'time': 0}
-                format_data[problem_id]['points'] += subtask_points
-                format_data[problem_id]['time'] = max(dt, format_data[problem_id]['time'])
-
-            for problem_data in format_data.values():
-                penalty = problem_data['time']
-                points = problem_data['points']
-                if self.config['cumtime'] and points:
-                    cumtime += penalty
-                score += points
+
+        for problem_data in format_data.values():
+            penalty = problem_data['time']
+            points = problem_data['points']
+            if self.config['cumtime'] and points:
+                cumtime += penalty
+            score += points
 
         participation.cumtime = max(cumtime, 0)
         participation.score = round(score, self.contest.points_precision)
         participation.tiebreaker = 0
         participation.format_data = format_data
-        participation.save()
 
     def get_short_form_display(self):
         yield _('The maximum score for each problem batch will be used.')
@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from django.core.exceptions import ValidationError
 from django.db.models import Min, OuterRef, Subquery
 from django.utils.translation import gettext as _, gettext_lazy
@@ -35,37 +37,46 @@ class LegacyIOIContestFormat(DefaultContestFormat):
         self.config.update(config or {})
         self.contest = contest
 
-    def update_participation(self, participation):
+    def get_bulk_format_data(self, participations, problem_id=None):
+        from judge.models import ContestSubmission
+
+        starts = {participation.id: participation.start for participation in participations}
+        submissions = ContestSubmission.objects.filter(participation_id__in=starts)
+        if problem_id is not None:
+            submissions = submissions.filter(problem_id=problem_id)
+
+        queryset = (submissions.values('participation_id', 'problem_id')
+                               .filter(points=Subquery(
+                                   ContestSubmission.objects.filter(participation_id=OuterRef('participation_id'),
+                                                                    problem_id=OuterRef('problem_id'))
+                                                            .order_by('-points').values('points')[:1]))
+                               .annotate(time=Min('submission__date'))
+                               .values_list('participation_id', 'problem_id', 'time', 'points')
+                               .order_by('participation_id', 'problem_id'))
+
+        format_data = defaultdict(dict)
+        for participation_id, problem_id, time, points in queryset:
+            dt = (time - starts[participation_id]).total_seconds() if points else 0
+            format_data[participation_id][str(problem_id)] = {'points': points, 'time': dt}
+        return format_data
+
+    def set_participation_results(self, participation, format_data):
         cumtime = 0
         last_submission_time = 0
         score = 0
-        format_data = {}
-
-        queryset = (participation.submissions.values('problem_id')
-                                             .filter(points=Subquery(
-                                                 participation.submissions.filter(problem_id=OuterRef('problem_id'))
-                                                                          .order_by('-points').values('points')[:1]))
-                                             .annotate(time=Min('submission__date'))
-                                             .values_list('problem_id', 'time', 'points'))
-
-        for problem_id, time, points in queryset:
-            if points:
-                dt = (time - participation.start).total_seconds()
+
+        for data in format_data.values():
+            if data['points']:
                 if self.config['last_score_altering']:
-                    last_submission_time = max(last_submission_time, dt)
+                    last_submission_time = max(last_submission_time, data['time'])
                 if self.config['cumtime']:
-                    cumtime += dt
-            else:
-                dt = 0
-
-            format_data[str(problem_id)] = {'points': points, 'time': dt}
-            score += points
+                    cumtime += data['time']
+            score += data['points']
 
         participation.cumtime = max(cumtime, 0) if self.config['cumtime'] else last_submission_time
         participation.score = round(score, self.contest.points_precision)
         participation.tiebreaker = last_submission_time
         participation.format_data = format_data
-        participation.save()
 
     def get_short_form_display(self):
         yield _('The maximum score submission for each problem will be used.')
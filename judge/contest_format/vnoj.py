@@ -1,42 +1,13 @@
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 
 from django.core.exceptions import ValidationError
-from django.db import connection
 from django.utils.translation import gettext as _, gettext_lazy, ngettext
 
 from judge.contest_format.default import DefaultContestFormat
 from judge.contest_format.registry import register_contest_format
-from judge.timezone import from_database_time, to_database_time
 
 ParticipationInfo = namedtuple('ParticipationInfo', 'cumtime score tiebreaker format_data')
 
-DEFAULT_RANKING_SQL = """
-SELECT MAX(cs.points) as `points`, (
-    SELECT MIN(csub.date)
-        FROM judge_contestsubmission ccs LEFT OUTER JOIN
-                judge_submission csub ON (csub.id = ccs.submission_id)
-        WHERE ccs.problem_id = cp.id AND ccs.participation_id = %s AND ccs.points = MAX(cs.points)
-) AS `time`, cp.id AS `prob`
-FROM judge_contestproblem cp INNER JOIN
-        judge_contestsubmission cs ON (cs.problem_id = cp.id AND cs.participation_id = %s) LEFT OUTER JOIN
-        judge_submission sub ON (sub.id = cs.submission_id)
-GROUP BY cp.id
-"""
-
-FROZEN_RANKING_SQL = """
-SELECT MAX(cs.points) as `points`, (
-    SELECT MIN(csub.date)
-        FROM judge_contestsubmission ccs LEFT OUTER JOIN
-                judge_submission csub ON (csub.id = ccs.submission_id)
-        WHERE ccs.problem_id = cp.id AND ccs.participation_id = %s AND ccs.points = MAX(cs.points) AND csub.date < %s
-) AS `time`, cp.id AS `prob`
-FROM judge_contestproblem cp INNER JOIN
-        judge_contestsubmission cs ON (cs.problem_id = cp.id AND cs.participation_id = %s) LEFT OUTER JOIN
-        judge_submission sub ON (sub.id = cs.submission_id)
-WHERE sub.date < %s
-GROUP BY cp.id
-"""
-
 
 @register_contest_format('vnoj')
 class VNOJContestFormat(DefaultContestFormat):
@@ -70,58 +41,54 @@ class VNOJContestFormat(DefaultContestFormat):
         self.config.update(config or {})
         self.contest = contest
 
-    def calculate_participation_info(self, participation, frozen=False) -> ParticipationInfo:
-        cumtime = 0
-        last = 0
-        penalty = 0
-        score = 0
-        format_data = {}
+    def calculate_format_data(self, participations, frozen=False, problem_id=None):
+        starts = {participation.id: participation.start for participation in participations}
+        frozen_time = self.contest.frozen_time
+        tries = self.get_tries(participations, problem_id)
+        format_data = defaultdict(dict)
 
-        frozen_time = participation.contest.frozen_time
+        best = self.get_best_submissions(participations, problem_id, before=frozen_time if frozen else None)
+        for participation_id, prob, points, time in best:
+            dt = (time - starts[participation_id]).total_seconds()
+            problem_subs = tries[participation_id, prob]
 
-        with connection.cursor() as cursor:
-            if not frozen:
-                cursor.execute(DEFAULT_RANKING_SQL, (participation.id, participation.id))
-            else:
-                db_time = to_database_time(frozen_time)
-                cursor.execute(FROZEN_RANKING_SQL, (participation.id, db_time,
-                                                    participation.id, db_time))
-
-            for points, time, prob in cursor.fetchall():
-                time = from_database_time(time)
-                dt = (time - participation.start).total_seconds()
-                # An IE can have a submission result of `None`
-                problem_subs = participation.submissions.exclude(submission__result__isnull=True) \
-                                            .exclude(submission__result__in=['IE', 'CE']) \
-                                            .filter(problem_id=prob)
-
-                # Compute penalty
-                if self.config['penalty']:
-                    subs = problem_subs
-                    if frozen:
-                        subs = subs.filter(submission__date__lt=frozen_time)
-
-                    if points:
-                        prev = subs.filter(submission__date__lte=time).count() - 1
-                        penalty += prev * self.config['penalty'] * 60
-                    else:
-                        # We should always display the penalty, even if the user has a score of 0
-                        prev = subs.count()
-                else:
-                    prev = 0
+            # Compute penalty
+            if self.config['penalty']:
+                subs = problem_subs
+                if frozen:
+                    subs = [date for date in subs if date < frozen_time]
 
                 if points:
-                    cumtime += dt
-                    last = max(last, dt)
+                    prev = sum(date <= time for date in subs) - 1
+                else:
+                    # We should always display the penalty, even if the user has a score of 0
+                    prev = len(subs)
+            else:
+                prev = 0
 
-                format_data[str(prob)] = {'time': dt, 'points': points, 'penalty': prev}
+            problem_data = {'time': dt, 'points': points, 'penalty': prev}
 
-                if not frozen and participation.contest.frozen_last_minutes != 0:
-                    format_data[str(prob)]['pending'] = problem_subs \
-                        .filter(submission__date__gte=frozen_time) \
-                        .count()
+            if not frozen and self.contest.frozen_last_minutes != 0:
+                problem_data['pending'] = sum(date >= frozen_time for date in problem_subs)
 
-                score += points
+            format_data[participation_id][str(prob)] = problem_data
+
+        return format_data
+
+    def calculate_participation_info(self, format_data, prefix='') -> ParticipationInfo:
+        cumtime = 0
+        last = 0
+        penalty = 0
+        score = 0
+
+        for data in format_data.values():
+            points = data[prefix + 'points']
+            if points:
+                dt = data[prefix + 'time']
+                cumtime += dt
+                last = max(last, dt)
+                penalty += data[prefix + 'penalty'] * self.config['penalty'] * 60
+            score += points
 
         return ParticipationInfo(
             cumtime=max((last if self.config['LSO'] else cumtime) + penalty, 0),
@@ -130,32 +97,34 @@ class VNOJContestFormat(DefaultContestFormat):
             format_data=format_data,
         )
 
-    def update_participation(self, participation):
-        actual_info = self.calculate_participation_info(participation)
-
+    def get_bulk_format_data(self, participations, problem_id=None):
+        format_data = self.calculate_format_data(participations, problem_id=problem_id)
+        if self.contest.frozen_last_minutes != 0:
+            frozen_format_data = self.calculate_format_data(participations, frozen=True, problem_id=problem_id)
+            # merge format_data
+            for participation_id, problems in format_data.items():
+                for prob, data in problems.items():
+                    frozen_data = frozen_format_data[participation_id].get(prob, {})
+                    new_prob_data = {**data}
+                    for key in data.keys():
+                        if key != 'pending':
+                            new_prob_data['frozen_' + key] = frozen_data.get(key, 0)
+                    problems[prob] = new_prob_data
+        return format_data
+
+    def set_participation_results(self, participation, format_data):
+        actual_info = self.calculate_participation_info(format_data)
         participation.cumtime = actual_info.cumtime
         participation.score = actual_info.score
         participation.tiebreaker = actual_info.tiebreaker
-        format_data = actual_info.format_data
 
-        if participation.contest.frozen_last_minutes != 0:
-            frozen_info = self.calculate_participation_info(participation, frozen=True)
+        if self.contest.frozen_last_minutes != 0:
+            frozen_info = self.calculate_participation_info(format_data, prefix='frozen_')
             participation.frozen_cumtime = frozen_info.cumtime
             participation.frozen_score = frozen_info.score
             participation.frozen_tiebreaker = frozen_info.tiebreaker
 
-            # merge format_data
-            for prob, data in format_data.items():
-                frozen_data = frozen_info.format_data.get(prob, {})
-                new_prob_data = {**data}
-                for key in data.keys():
-                    if key != 'pending':
-                        new_prob_data['frozen_' + key] = frozen_data.get(key, 0)
-
-                format_data[prob] = new_prob_data
-
         participation.format_data = format_data
-        participation.save()
 
     def get_format_data_for_api(self, entry, problem_points, frozen=False):
         if not entry:
@@ -1,6 +1,6 @@
 from django.conf import settings
 
-__all__ = ['last', 'post']
+__all__ = ['last', 'post', 'stats']
 
 if not settings.EVENT_DAEMON_USE:
     real = False
@@ -10,9 +10,12 @@ if not settings.EVENT_DAEMON_USE:
 
     def last():
         return 0
+
+    def stats():
+        return {}
 elif hasattr(settings, 'EVENT_DAEMON_AMQP'):
-    from .event_poster_amqp import last, post
+    from .event_poster_amqp import last, post, stats
     real = True
 else:
-    from .event_poster_ws import last, post
+    from .event_poster_ws import last, post, stats
     real = True
@@ -6,7 +6,7 @@ import pika
 from django.conf import settings
 from pika.exceptions import AMQPError
 
-__all__ = ['EventPoster', 'post', 'last']
+__all__ = ['EventPoster', 'post', 'last', 'stats']
 
 
 class EventPoster(object):
@@ -53,3 +53,7 @@ def post(channel, message):
 
 def last():
     return int(time() * 1000000)
+
+
+def stats():
+    return {}
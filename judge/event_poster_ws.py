@@ -1,12 +1,17 @@
 import json
+import logging
+import os
 import socket
 import threading
+import time
+from collections import OrderedDict
 
 from django.conf import settings
 from websocket import WebSocketException, create_connection
 
-__all__ = ['EventPostingError', 'EventPoster', 'post', 'last']
+__all__ = ['EventPostingError', 'EventPoster', 'AsyncEventPoster', 'post', 'last', 'stats']
 _local = threading.local()
+logger = logging.getLogger('judge.event_poster')
 
 
 class EventPostingError(RuntimeError):
@@ -39,6 +44,29 @@ class EventPoster(object):
             self._connect()
             return self.post(channel, message, tries + 1)
 
+    def post_batch(self, messages, tries=0):
+        if getattr(self, '_no_batch', False):
+            return [self.post(channel, message) for channel, message in messages]
+
+        try:
+            self._conn.send(json.dumps({'command': 'post-batch', 'messages': [
+                {'channel': channel, 'message': message} for channel, message in messages
+            ]}))
+            resp = json.loads(self._conn.recv())
+            if resp['status'] == 'error':
+                if resp['code'] == 'bad-command':
+                    # The event daemon predates batches.
+                    self._no_batch = True
+                    return self.post_batch(messages)
+                raise EventPostingError(resp['code'])
+            else:
+                return resp['ids']
+        except WebSocketException:
+            if tries > 10:
+                raise
+            self._connect()
+            return self.post_batch(messages, tries + 1)
+
     def last(self, tries=0):
         try:
             self._conn.send('{"command": "last-msg"}')
@@ -54,6 +82,114 @@ class EventPoster(object):
             return self.last(tries + 1)
 
 
+class AsyncEventPoster(object):
+    """
+    Posts events from a background thread, so that posting never waits on the event daemon.
+
+    Messages are sent in batches of pending messages. While a message is still pending, a newer message on the same
+    channel about the same object supersedes it, for the channels in `coalesce_channels` whose messages only tell
+    clients to refresh their view of something. Thus, when the event daemon falls behind, only the latest state of
+    each submission or contest is sent, and the queue stays bounded by the number of distinct objects.
+    """
+
+    coalesce_channels = ('sub_', 'submissions', 'contest_')
+
+    def __init__(self, max_queue, max_batch):
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.pid = None
+        self.sent = 0
+        self.superseded = 0
+        self.overflowed = 0
+        self.failed = 0
+
+    def start(self):
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='event-poster', daemon=True)
+        self._thread.start()
+
+    def _key(self, channel, message):
+        if channel.startswith(self.coalesce_channels):
+            return channel, isinstance(message, dict) and message.get('id')
+        return object()
+
+    def post(self, channel, message):
+        key = self._key(channel, message)
+        with self._cond:
+            if key in self._pending:
+                self.superseded += 1
+                del self._pending[key]
+            elif len(self._pending) >= self.max_queue:
+                self.overflowed += 1
+                return 0
+            self._pending[key] = (channel, message)
+            self._cond.notify()
+        return 0
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            batch = []
+            while self._pending and len(batch) < self.max_batch:
+                batch.append(self._pending.popitem(last=False)[1])
+            return batch
+
+    def _run(self):
+        poster = None
+        while True:
+            poster = self._post_batch(poster, self._take_batch())
+
+    def _post_batch(self, poster, batch):
+        """Posts a batch of messages, and returns the poster to post the next batch with, or None to connect again."""
+        try:
+            if poster is None:
+                poster = EventPoster()
+            poster.post_batch(batch)
+        except (WebSocketException, socket.error, EventPostingError):
+            logger.warning('Failed to post %d events', len(batch), exc_info=True)
+        except Exception:
+            # Such as a garbled reply, or a message that cannot be encoded. Nothing may stop the thread, as events
+            # would then pile up unsent until the queue overflows.
+            logger.exception('Unexpected error posting %d events', len(batch))
+        else:
+            self.sent += len(batch)
+            return poster
+
+        self.failed += len(batch)
+        # Don't spin on an event daemon that is down.
+        time.sleep(1)
+        return None
+
+    def stats(self):
+        return {
+            'queue': len(self._pending),
+            'sent': self.sent,
+            'superseded': self.superseded,
+            'overflowed': self.overflowed,
+            'failed': self.failed,
+        }
+
+
+_async_poster = None
+_async_poster_lock = threading.Lock()
+
+
+def _get_async_poster():
+    global _async_poster
+    # The posting thread does not survive a fork, so each process needs its own.
+    if _async_poster is None or _async_poster.pid != os.getpid():
+        with _async_poster_lock:
+            if _async_poster is None or _async_poster.pid != os.getpid():
+                poster = AsyncEventPoster(settings.EVENT_DAEMON_POST_QUEUE_SIZE, settings.EVENT_DAEMON_POST_BATCH_SIZE)
+                poster.start()
+                _async_poster = poster
+    return _async_poster
+
+
 def _get_poster():
     if 'poster' not in _local.__dict__:
         _local.poster = EventPoster()
@@ -61,6 +197,9 @@ def _get_poster():
 
 
 def post(channel, message):
+    if settings.EVENT_DAEMON_POST_ASYNC:
+        return _get_async_poster().post(channel, message)
+
     try:
         return _get_poster().post(channel, message)
     except (WebSocketException, socket.error):
@@ -80,3 +219,9 @@ def last():
         except AttributeError:
             pass
     return 0
+
+
+def stats():
+    if _async_poster is None:
+        return {}
+    return _async_poster.stats()
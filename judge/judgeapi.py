@@ -1,13 +1,15 @@
-import json
 import logging
+import os
 import socket
 import struct
+import threading
 import zlib
 
 from django.conf import settings
 from django.utils import timezone
 
 from judge import event_poster as event
+from judge.bridge import codec
 from judge.judge_priority import BATCH_REJUDGE_PRIORITY, CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY, REJUDGE_PRIORITY
 
 logger = logging.getLogger('judge.judgeapi')
@@ -26,34 +28,90 @@ def _post_update_submission(submission, done=False):
                                    })
 
 
-def judge_request(packet, reply=True):
-    sock = socket.create_connection(settings.BRIDGED_DJANGO_CONNECT or
-                                    settings.BRIDGED_DJANGO_ADDRESS[0])
+def _send_packet(sock, packet):
+    output = codec.CODECS[settings.BRIDGED_DJANGO_CODEC].dumps(packet)
+    output = zlib.compress(output, settings.BRIDGED_ZLIB_LEVEL)
+    sock.sendall(size_pack.pack(len(output)) + output)
 
-    output = json.dumps(packet, separators=(',', ':'))
-    output = zlib.compress(output.encode('utf-8'))
-    writer = sock.makefile('wb')
-    writer.write(size_pack.pack(len(output)))
-    writer.write(output)
-    writer.close()
+
+def _read_packet(reader):
+    input = reader.read(size_pack.size)
+    if not input:
+        raise ValueError('Judge did not respond')
+    length = size_pack.unpack(input)[0]
+    input = reader.read(length)
+    if not input:
+        raise ValueError('Judge did not respond')
+    input = zlib.decompress(input)
+    return codec.detect(input).loads(input)
+
+
+class BridgeConnection(object):
+    """A connection to the bridge that stays open, so that any number of requests can be sent over it."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.sock = socket.create_connection(settings.BRIDGED_DJANGO_CONNECT or
+                                             settings.BRIDGED_DJANGO_ADDRESS[0])
+        self.reader = self.sock.makefile('rb', -1)
+
+    def request(self, packet):
+        # The bridge only replies to every request and keeps the connection open if asked to.
+        _send_packet(self.sock, dict(packet, **{'keep-alive': True}))
+        return _read_packet(self.reader)
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+_local = threading.local()
+
+
+def _pooled_request(packet):
+    connection = getattr(_local, 'bridge', None)
+    # A forked process must not share its parent's connection.
+    if connection is not None and connection.pid != os.getpid():
+        connection = None
+
+    fresh = connection is None
+    if fresh:
+        connection = _local.bridge = BridgeConnection()
+
+    try:
+        return connection.request(packet)
+    except (OSError, ValueError):
+        connection.close()
+        _local.bridge = None
+        if fresh:
+            raise
+    # The pooled connection went stale, e.g. the bridge restarted. Requests are idempotent, so just try again.
+    return _pooled_request(packet)
+
+
+def judge_request(packet, reply=True, address=None, timeout=None):
+    # A specific address is only asked for by bridge instances passing requests on to each other, see DjangoHandler.
+    # Requests with a timeout get a connection of their own, as one that timed out cannot be used again.
+    if settings.BRIDGED_DJANGO_KEEPALIVE and address is None and timeout is None:
+        result = _pooled_request(packet)
+        return result if reply else None
+
+    sock = socket.create_connection(address or settings.BRIDGED_DJANGO_CONNECT or
+                                    settings.BRIDGED_DJANGO_ADDRESS[0], timeout=timeout)
+
+    _send_packet(sock, packet)
 
     if reply:
         reader = sock.makefile('rb', -1)
-        input = reader.read(size_pack.size)
-        if not input:
-            raise ValueError('Judge did not respond')
-        length = size_pack.unpack(input)[0]
-        input = reader.read(length)
-        if not input:
-            raise ValueError('Judge did not respond')
-        reader.close()
-        sock.close()
-
-        result = json.loads(zlib.decompress(input).decode('utf-8'))
-        return result
+        try:
+            return _read_packet(reader)
+        finally:
+            reader.close()
+            sock.close()
+    sock.close()
 
 
-def judge_submission(submission, rejudge=False, batch_rejudge=False, judge_id=None):
+def _prepare_submission_request(submission, rejudge, batch_rejudge, judge_id):
     from .models import ContestSubmission, Submission, SubmissionTestCase
 
     updates = {'time': None, 'memory': None, 'points': None, 'result': None, 'case_points': 0, 'case_total': 0,
@@ -77,7 +135,7 @@ def judge_submission(submission, rejudge=False, batch_rejudge=False, judge_id=No
     # It is worth noting that this mechanism does not prevent a new rejudge from being scheduled
     # while already queued, but that does not lead to data corruption.
     if not Submission.objects.filter(id=submission.id).exclude(status__in=('P', 'G')).update(**updates):
-        return False
+        return None
 
     SubmissionTestCase.objects.filter(submission_id=submission.id).delete()
 
@@ -90,17 +148,26 @@ def judge_submission(submission, rejudge=False, batch_rejudge=False, judge_id=No
         if participation.live or participation.spectate:
             banned_judges = list(participation.contest.banned_judges.values_list('name', flat=True))
 
+    return {
+        'submission-id': submission.id,
+        'problem-id': submission.problem.code,
+        'language': submission.language.key,
+        'source': submission.source.source,
+        'judge-id': judge_id,
+        'banned-judges': banned_judges,
+        'priority': BATCH_REJUDGE_PRIORITY if batch_rejudge else (REJUDGE_PRIORITY if rejudge else priority),
+    }
+
+
+def judge_submission(submission, rejudge=False, batch_rejudge=False, judge_id=None):
+    from .models import Submission
+
+    request = _prepare_submission_request(submission, rejudge, batch_rejudge, judge_id)
+    if request is None:
+        return False
+
     try:
-        response = judge_request({
-            'name': 'submission-request',
-            'submission-id': submission.id,
-            'problem-id': submission.problem.code,
-            'language': submission.language.key,
-            'source': submission.source.source,
-            'judge-id': judge_id,
-            'banned-judges': banned_judges,
-            'priority': BATCH_REJUDGE_PRIORITY if batch_rejudge else (REJUDGE_PRIORITY if rejudge else priority),
-        })
+        response = judge_request(dict(request, name='submission-request'))
     except BaseException:
         logger.exception('Failed to send request to judge')
         Submission.objects.filter(id=submission.id).update(status='IE', result='IE')
@@ -113,6 +180,51 @@ def judge_submission(submission, rejudge=False, batch_rejudge=False, judge_id=No
     return success
 
 
+def judge_submissions(submissions, rejudge=False, batch_rejudge=False, judge_id=None):
+    """
+    Like judge_submission, but sends the submissions to the bridge in as few submission-batch-request packets as
+    BRIDGED_DJANGO_BATCH_SIZE and BRIDGED_DJANGO_BATCH_SOURCE_SIZE allow. Returns the number of submissions sent.
+    """
+    from .models import Submission
+
+    sent = 0
+    batch = []
+    batch_size = 0
+
+    def flush():
+        nonlocal sent
+        ids = [request['submission-id'] for request, _ in batch]
+        try:
+            response = judge_request({'name': 'submission-batch-request', 'submissions': [r for r, _ in batch]})
+        except BaseException:
+            logger.exception('Failed to send request to judge')
+            Submission.objects.filter(id__in=ids).update(status='IE', result='IE')
+            return
+
+        received = set(response.get('submission-ids', ())) \
+            if response['name'] == 'submission-batch-received' else set()
+        Submission.objects.filter(id__in=set(ids) - received).update(status='IE', result='IE')
+        for _, submission in batch:
+            _post_update_submission(submission)
+        sent += len(batch)
+
+    for submission in submissions:
+        request = _prepare_submission_request(submission, rejudge, batch_rejudge, judge_id)
+        if request is None:
+            continue
+        if batch and (len(batch) >= settings.BRIDGED_DJANGO_BATCH_SIZE or
+                      batch_size + len(request['source']) > settings.BRIDGED_DJANGO_BATCH_SOURCE_SIZE):
+            flush()
+            batch = []
+            batch_size = 0
+        batch.append((request, submission))
+        batch_size += len(request['source'])
+
+    if batch:
+        flush()
+    return sent
+
+
 def disconnect_judge(judge, force=False):
     judge_request({'name': 'disconnect-judge', 'judge-id': judge.name, 'force': force}, reply=False)
 
@@ -121,6 +233,20 @@ def update_disable_judge(judge):
     judge_request({'name': 'disable-judge', 'judge-id': judge.name, 'is-disabled': judge.is_disabled})
 
 
+def locality_stats():
+    return judge_request({'name': 'locality-stats'})['judges']
+
+
+def bridge_status(timeout=None):
+    """
+    Returns the bridge's queue, its judges and what it has measured since starting, see JudgeList.status. Raises
+    socket.timeout if the bridge does not answer within `timeout` seconds, if given.
+    """
+    response = judge_request({'name': 'status'}, timeout=timeout)
+    del response['name']
+    return response
+
+
 def abort_submission(submission):
     from .models import Submission
     # We only want to try to abort a submission if it's still grading, otherwise this can lead to fully graded
@@ -0,0 +1,35 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from judge.contest_format.ioi import IOIContestFormat
+from judge.models import Contest
+from judge.tasks.contest import RESCORE_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'fill in the best result of each participant on each batch, for contests scored from them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('contests', nargs='*', metavar='CONTEST',
+                            help='keys of the contests to fill in, instead of every contest in an IOI format')
+
+    def handle(self, *args, **options):
+        contests = Contest.objects.order_by('id')
+        if options['contests']:
+            contests = contests.filter(key__in=options['contests'])
+
+        for contest in contests:
+            format = contest.format
+            if not isinstance(format, IOIContestFormat):
+                continue
+
+            iterator = contest.users.all().iterator(chunk_size=RESCORE_CHUNK_SIZE)
+            filled = 0
+            while True:
+                participations = list(islice(iterator, RESCORE_CHUNK_SIZE))
+                if not participations:
+                    break
+                format.update_batch_results(participations)
+                filled += len(participations)
+            self.stdout.write('Filled in %s: %d participations' % (contest.key, filled))
@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+import socket
+import statistics
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from functools import partial
+
+from django import db
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from judge.bridge.django_handler import DjangoHandler
+from judge.bridge.judge_handler import JudgeHandler
+from judge.bridge.judge_list import JudgeList
+from judge.bridge.server import Server
+from judge.judgeapi import judge_submission
+from judge.models import Judge, Language, Problem, ProblemGroup, Profile, Submission, SubmissionSource
+from judge.utils.iterator import chunk
+
+size_pack = struct.Struct('!I')
+
+
+class Harness:
+    """Collects timings and query counts from the bridge and the clients, which all run in their own threads."""
+
+    def __init__(self, submissions):
+        self.lock = threading.Lock()
+        self.submitted = {}
+        self.dispatched = {}
+        self.graded = {}
+        self.queries = {'bridge': 0, 'site': 0}
+        self.expected = submissions
+        self.done = threading.Event()
+
+    def counter(self, kind):
+        def execute(execute, sql, params, many, context):
+            with self.lock:
+                self.queries[kind] += 1
+            return execute(sql, params, many, context)
+        return execute
+
+    def record(self, timings, id):
+        now = time.perf_counter()
+        with self.lock:
+            timings[id] = now
+            if len(self.graded) == self.expected:
+                self.done.set()
+
+
+class BenchmarkJudgeHandler(JudgeHandler):
+    def __init__(self, *args, harness, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.harness = harness
+
+    def handle(self):
+        with db.connection.execute_wrapper(self.harness.counter('bridge')):
+            super().handle()
+
+    def submit(self, id, problem, language, source):
+        self.harness.record(self.harness.dispatched, id)
+        super().submit(id, problem, language, source)
+
+    def on_grading_end(self, packet):
+        super().on_grading_end(packet)
+        self.harness.record(self.harness.graded, packet['submission-id'])
+
+
+class SimulatedJudge(threading.Thread):
+    """Speaks just enough of the judge side of the protocol to accept submissions and report them as accepted."""
+
+    def __init__(self, name, key, address, problems, executors, cases, case_time):
+        super().__init__(daemon=True)
+        self.name = name
+        self.key = key
+        self.address = address
+        self.problems = problems
+        self.executors = executors
+        self.cases = cases
+        self.case_time = case_time
+        self.sock = None
+
+    def send(self, packet):
+        data = zlib.compress(json.dumps(packet).encode('utf-8'))
+        self.sock.sendall(size_pack.pack(len(data)) + data)
+
+    def read(self):
+        header = self.reader.read(size_pack.size)
+        if len(header) < size_pack.size:
+            return None
+        return json.loads(zlib.decompress(self.reader.read(size_pack.unpack(header)[0])))
+
+    def connect(self):
+        self.sock = socket.create_connection(self.address)
+        self.reader = self.sock.makefile('rb')
+        self.send({
+            'name': 'handshake', 'id': self.name, 'key': self.key,
+            'problems': [[problem, 0] for problem in self.problems], 'executors': self.executors,
+        })
+        response = self.read()
+        if response is None or response['name'] != 'handshake-success':
+            raise CommandError('simulated judge %s failed to connect: %r' % (self.name, response))
+
+    def grade(self, id):
+        self.send({'name': 'submission-acknowledged', 'submission-id': id})
+        self.send({'name': 'grading-begin', 'submission-id': id, 'pretested': False})
+        for position in range(1, self.cases + 1):
+            if self.case_time:
+                time.sleep(self.case_time)
+            self.send({'name': 'test-case-status', 'submission-id': id, 'cases': [{
+                'position': position, 'status': 0, 'time': 0.01, 'memory': 1024, 'points': 1, 'total-points': 1,
+                'output': '', 'feedback': '', 'extended-feedback': '',
+            }]})
+        self.send({'name': 'grading-end', 'submission-id': id})
+
+    def run(self):
+        try:
+            while True:
+                packet = self.read()
+                if packet is None:
+                    break
+                if packet['name'] == 'ping':
+                    self.send({'name': 'ping-response', 'when': packet['when'], 'time': time.time(), 'load': 0})
+                elif packet['name'] == 'submission-request':
+                    self.grade(packet['submission-id'])
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'measure how many submissions per second an in-process bridge sustains with simulated judges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-j', '--judges', type=int, default=8, help='number of simulated judges')
+        parser.add_argument('-s', '--submissions', type=int, default=1000, help='number of submissions to judge')
+        parser.add_argument('-p', '--problems', type=int, default=10, help='number of distinct problems')
+        parser.add_argument('-c', '--cases', type=int, default=10, help='test cases per submission')
+        parser.add_argument('--case-time', type=float, default=0, help='seconds each simulated test case takes')
+        parser.add_argument('--clients', type=int, default=4, help='number of threads sending submissions')
+        parser.add_argument('--keepalive', action='store_true', help='keep connections to the bridge open')
+        parser.add_argument('--timeout', type=float, default=600, help='seconds to wait for grading to finish')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='do not prompt before destroying an existing test database')
+
+    def handle(self, *args, **options):
+        logging.getLogger('judge.bridge').setLevel(logging.WARNING)
+        logging.getLogger('judge.judgeapi').setLevel(logging.WARNING)
+
+        # Everything is written to a throwaway test database, never to the real one.
+        connection = db.connections['default']
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST']['NAME']:
+            # Threads can't write to an in-memory SQLite database at the same time, even to different tables.
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempfile.gettempdir(), 'benchmark_bridge.sqlite3')
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options['interactive'], serialize=False)
+        try:
+            self.benchmark(options)
+        finally:
+            db.connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def create_data(self, options):
+        language = Language.get_python3()
+        profile = Profile.objects.create(user=User.objects.create(username='benchmark'), language=language)
+        group = ProblemGroup.objects.create(name='benchmark', full_name='benchmark')
+        problems = [Problem.objects.create(code='benchmark%d' % i, name='benchmark', description='', time_limit=1,
+                                           memory_limit=65536, points=1, group=group)
+                    for i in range(options['problems'])]
+        for i in range(options['judges']):
+            Judge.objects.create(name='benchmark%d' % i, auth_key='benchmark')
+
+        Submission.objects.bulk_create([
+            Submission(user=profile, problem=problems[i % len(problems)], language=language)
+            for i in range(options['submissions'])
+        ])
+        submissions = list(Submission.objects.select_related('problem', 'language').order_by('id'))
+        SubmissionSource.objects.bulk_create([
+            SubmissionSource(submission=submission, source='print(%d)' % submission.id) for submission in submissions
+        ])
+        return [problem.code for problem in problems], {language.key: [['python3', [3]]]}, submissions
+
+    def submit(self, harness, submissions):
+        with db.connection.execute_wrapper(harness.counter('site')):
+            for submission in submissions:
+                harness.record(harness.submitted, submission.id)
+                judge_submission(submission)
+        db.connection.close()
+
+    def benchmark(self, options):
+        problems, executors, submissions = self.create_data(options)
+        harness = Harness(len(submissions))
+
+        judges = JudgeList()
+        judge_server = Server([('127.0.0.1', 0)], partial(BenchmarkJudgeHandler, judges=judges, harness=harness,
+                                                          ignore_problems_packet=False))
+        django_server = Server([('127.0.0.1', 0)], partial(DjangoHandler, judges=judges))
+        servers = [judge_server, django_server]
+        for server in servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        simulated = [
+            SimulatedJudge('benchmark%d' % i, 'benchmark', judge_server.servers[0].server_address, problems, executors,
+                           options['cases'], options['case_time'])
+            for i in range(options['judges'])
+        ]
+        try:
+            # One at a time, as handshakes write to the same tables, and SQLite gives up on such deadlocks.
+            for judge in simulated:
+                judge.connect()
+                judge.start()
+                while not Judge.objects.filter(name=judge.name, online=True).exists():
+                    time.sleep(0.01)
+
+            with override_settings(BRIDGED_DJANGO_CONNECT=django_server.servers[0].server_address,
+                                   BRIDGED_DJANGO_KEEPALIVE=options['keepalive'],
+                                   VNOJ_LONG_QUEUE_ALERT_THRESHOLD=None):
+                clients = [threading.Thread(target=self.submit, args=(harness, part))
+                           for part in chunk(submissions, -(-len(submissions) // options['clients']))]
+                start = time.perf_counter()
+                for client in clients:
+                    client.start()
+                for client in clients:
+                    client.join()
+                finished = harness.done.wait(options['timeout'])
+                elapsed = time.perf_counter() - start
+        finally:
+            for judge in simulated:
+                if judge.sock is not None:
+                    judge.close()
+            for server in servers:
+                server.shutdown()
+                for listener in server.servers:
+                    # Waits for the handlers to wrap up, so that the test database can be destroyed.
+                    listener.server_close()
+
+        if not finished:
+            raise CommandError('only %d of %d submissions were graded within %.0fs' % (
+                len(harness.graded), len(submissions), options['timeout'],
+            ))
+        self.report(harness, elapsed, options)
+
+    def report(self, harness, elapsed, options):
+        count = len(harness.graded)
+        wait = sorted(harness.dispatched[id] - harness.submitted[id] for id in harness.graded)
+        grading = sorted(harness.graded[id] - harness.dispatched[id] for id in harness.graded)
+        not_done = Submission.objects.exclude(status='D').count()
+
+        self.stdout.write('%d submissions, %d judges, %d cases each: %.3fs, %.1f submissions/s' % (
+            count, options['judges'], options['cases'], elapsed, count / elapsed,
+        ))
+        for name, values in (('submit to dispatch', wait), ('dispatch to grading end', grading)):
+            self.stdout.write('%s: mean %.1fms, p50 %.1fms, p99 %.1fms, max %.1fms' % (
+                name, statistics.mean(values) * 1e3, percentile(values, 0.5) * 1e3, percentile(values, 0.99) * 1e3,
+                values[-1] * 1e3,
+            ))
+        self.stdout.write('queries per submission: %.1f in the bridge, %.1f to send' % (
+            harness.queries['bridge'] / count, harness.queries['site'] / count,
+        ))
+        if not_done:
+            self.stderr.write('%d submissions did not finish as done!' % not_done)
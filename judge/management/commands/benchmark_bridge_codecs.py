@@ -0,0 +1,68 @@
+import random
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+
+from judge.bridge import codec
+
+
+class Command(BaseCommand):
+    help = 'benchmark encoding and compressing typical judge packets with every available bridge codec'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--packets', type=int, default=20000, help='number of packets per combination')
+        parser.add_argument('-c', '--cases', type=int, default=1, help='test cases per test-case-status packet')
+        parser.add_argument('-o', '--output', type=int, default=64, help='bytes of output per test case')
+        parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9], help='zlib levels to try')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    def make_packets(self, options):
+        rng = random.Random(options['seed'])
+        packets = []
+        for i in range(options['packets']):
+            packets.append({
+                'name': 'test-case-status',
+                'submission-id': 1000000 + i // 50,
+                'cases': [{
+                    'position': i % 50 + j, 'status': rng.choice((0, 0, 0, 1, 4)),
+                    'time': rng.random(), 'points': rng.choice((0, 10)), 'total-points': 10,
+                    'memory': rng.randrange(1000, 256000), 'output': rng.randbytes(options['output'] // 2).hex(),
+                    'extended-feedback': '', 'feedback': '',
+                    'voluntary-context-switches': rng.randrange(100), 'involuntary-context-switches': rng.randrange(10),
+                } for j in range(options['cases'])],
+            })
+        return packets
+
+    def run(self, packet_codec, level, zdict, packets):
+        def compress(data):
+            if zdict:
+                compressor = zlib.compressobj(level, zdict=zdict)
+                return compressor.compress(data) + compressor.flush()
+            return zlib.compress(data, level)
+
+        def decompress(data):
+            decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+            return decompressor.decompress(data) + decompressor.flush()
+
+        start = time.perf_counter()
+        wire = [compress(packet_codec.dumps(packet)) for packet in packets]
+        encode = time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = [packet_codec.loads(decompress(data)) for data in wire]
+        decode = time.perf_counter() - start
+
+        assert decoded == packets
+        return encode, decode, sum(map(len, wire)) / len(wire)
+
+    def handle(self, *args, **options):
+        packets = self.make_packets(options)
+        self.stdout.write('%-8s %5s %5s %12s %12s %10s' % ('codec', 'level', 'dict', 'encode/s', 'decode/s', 'bytes'))
+        for name, packet_codec in codec.CODECS.items():
+            for level in options['levels']:
+                for zdict in (None, codec.PACKET_DICTIONARY):
+                    encode, decode, size = self.run(packet_codec, level, zdict, packets)
+                    self.stdout.write('%-8s %5d %5s %12.0f %12.0f %10.1f' % (
+                        name, level, 'yes' if zdict else 'no', len(packets) / encode, len(packets) / decode, size,
+                    ))
@@ -0,0 +1,60 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from judge.bridge.daemon import recover_queue
+from judge.bridge.judge_list import JudgeList
+from judge.models import Language, Problem, Profile, Submission, SubmissionSource
+from judge.utils.iterator import chunk
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'benchmark how long the bridge takes to rebuild its queue from queued submissions in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--submissions', type=int, default=100000, help='number of queued submissions')
+        parser.add_argument('-c', '--chunk-size', type=int, default=1000, help='rows to read from the database at once')
+        parser.add_argument('--source-size', type=int, default=1024, help='length of each submission source')
+
+    def populate(self, options):
+        profile, problem, language = Profile.objects.first(), Problem.objects.first(), Language.objects.first()
+        if profile is None or problem is None or language is None:
+            raise CommandError('need at least one user, problem and language to create submissions for')
+
+        source = 'x' * options['source_size']
+        start = time.perf_counter()
+        last_id = Submission.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        for ids in chunk(range(options['submissions']), 5000):
+            Submission.objects.bulk_create([
+                Submission(user=profile, problem=problem, language=language, status='QU') for _ in ids
+            ])
+            # Not every database backend returns the ids from a bulk insert.
+            created = list(Submission.objects.filter(id__gt=last_id).values_list('id', flat=True))
+            SubmissionSource.objects.bulk_create([SubmissionSource(submission_id=id, source=source) for id in created])
+            last_id = max(created)
+        return time.perf_counter() - start
+
+    def handle(self, *args, **options):
+        logging.getLogger('judge.bridge').setLevel(logging.WARNING)
+
+        # Everything happens in a transaction that is rolled back, so the benchmark leaves no submissions behind.
+        try:
+            with transaction.atomic():
+                self.stdout.write('Creating %d queued submissions...' % options['submissions'])
+                self.stdout.write('Created in %.3fs' % self.populate(options))
+
+                start = time.perf_counter()
+                recovered = recover_queue(JudgeList(), chunk_size=options['chunk_size'])
+                elapsed = time.perf_counter() - start
+                self.stdout.write('Recovered %d submissions in %.3fs (%.0f/s)' % (
+                    recovered, elapsed, recovered / elapsed,
+                ))
+                raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,162 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from judge.models import Contest, ContestParticipation, ContestProblem, ContestSubmission, Language, Problem, \
+    Profile, Submission, SubmissionTestCase
+from judge.timezone import from_database_time
+
+
+class Rollback(Exception):
+    pass
+
+
+def nested_query_results(participations, problem_id=None):
+    """The best points and time on each batch, found as IOIContestFormat used to, before it kept them in a table."""
+    ids = [participation.id for participation in participations]
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT q.part, q.prob, MIN(q.date) as `date`, q.batch_points
+            FROM (
+                     SELECT cs.participation_id as `part`, cp.id as `prob`, sub.id as `subid`, sub.date as `date`,
+                            tc.points as `points`, tc.batch as `batch`, MIN(tc.points) as `batch_points`
+                     FROM judge_contestproblem cp
+                              INNER JOIN judge_contestsubmission cs
+                                  ON (cs.problem_id = cp.id AND cs.participation_id IN ({ids}))
+                              LEFT OUTER JOIN judge_submission sub ON (sub.id = cs.submission_id AND sub.status = 'D')
+                              INNER JOIN judge_submissiontestcase tc ON sub.id = tc.submission_id
+                     WHERE %s IS NULL OR cp.id = %s
+                     GROUP BY cs.participation_id, cp.id, tc.batch, sub.id
+                 ) q
+                     INNER JOIN (
+                SELECT part, prob, batch, MAX(r.batch_points) as max_batch_points
+                FROM (
+                         SELECT cs.participation_id as `part`, cp.id as `prob`, tc.batch as `batch`,
+                                MIN(tc.points) as `batch_points`
+                         FROM judge_contestproblem cp
+                                  INNER JOIN judge_contestsubmission cs
+                                      ON (cs.problem_id = cp.id AND cs.participation_id IN ({ids}))
+                                  LEFT OUTER JOIN judge_submission sub
+                                      ON (sub.id = cs.submission_id AND sub.status = 'D')
+                                  INNER JOIN judge_submissiontestcase tc ON sub.id = tc.submission_id
+                         WHERE %s IS NULL OR cp.id = %s
+                         GROUP BY cs.participation_id, cp.id, tc.batch, sub.id
+                     ) r
+                GROUP BY part, prob, batch
+            ) p
+            ON p.part = q.part AND p.prob = q.prob AND (p.batch = q.batch OR p.batch is NULL AND q.batch is NULL)
+            WHERE p.max_batch_points = q.batch_points
+            GROUP BY q.part, q.prob, q.batch
+            ORDER BY q.part, q.prob, q.batch
+        """.format(ids=', '.join(['%s'] * len(ids))), (*ids, problem_id, problem_id, *ids, problem_id, problem_id))
+        # SQLite returns dates as text.
+        return [(part, prob, from_database_time(parse_datetime(date) if isinstance(date, str) else date), points)
+                for part, prob, date, points in cursor.fetchall()]
+
+
+class Command(BaseCommand):
+    help = 'benchmark scoring an IOI contest from the best result of each batch, against the nested query it replaced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--participants', type=int, default=20, help='number of participants')
+        parser.add_argument('--problems', type=int, default=3, help='number of problems')
+        parser.add_argument('-b', '--batches', type=int, default=120, help='number of batches of each problem')
+        parser.add_argument('--cases', type=int, default=2, help='number of cases in each batch')
+        parser.add_argument('-s', '--submissions', type=int, default=10,
+                            help='submissions of each participant to each problem')
+        parser.add_argument('-r', '--repeat', type=int, default=20, help='graded submissions to time')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def populate(self, options, rng):
+        profile, language = Profile.objects.first(), Language.objects.first()
+        problems = list(Problem.objects.all()[:options['problems']])
+        if profile is None or language is None or len(problems) < options['problems']:
+            raise CommandError('need at least one user and language, and %d problems' % options['problems'])
+
+        now = timezone.now()
+        contest = Contest.objects.create(key='benchmark_ioi_batches', name='benchmark', start_time=now,
+                                         end_time=now + timedelta(hours=5), format_name='ioi16',
+                                         format_config={'cumtime': True})
+        contest_problems = [ContestProblem.objects.create(contest=contest, problem=problem, points=100, order=i)
+                            for i, problem in enumerate(problems)]
+        # Participations of one user are told apart by their virtual number.
+        participations = [ContestParticipation.objects.create(contest=contest, user=profile, virtual=i + 1,
+                                                              real_start=now)
+                          for i in range(options['participants'])]
+
+        cases = []
+        for participation in participations:
+            for contest_problem in contest_problems:
+                for _ in range(options['submissions']):
+                    submission = Submission.objects.create(user=profile, problem=contest_problem.problem,
+                                                           language=language, contest_object=contest, status='D',
+                                                           result='WA')
+                    Submission.objects.filter(id=submission.id).update(
+                        date=now + timedelta(seconds=rng.randrange(5 * 60 * 60)),
+                    )
+                    ContestSubmission.objects.create(submission=submission, problem=contest_problem,
+                                                     participation=participation)
+                    for batch in range(1, options['batches'] + 1):
+                        for case in range(options['cases']):
+                            points = rng.choice((0, 1))
+                            cases.append(SubmissionTestCase(submission=submission, case=len(cases), batch=batch,
+                                                            status='AC' if points else 'WA', points=points, total=1))
+        SubmissionTestCase.objects.bulk_create(cases, batch_size=5000)
+        return contest, participations, len(cases)
+
+    def time(self, label, count, function):
+        start = time.perf_counter()
+        for _ in range(count):
+            result = function()
+        elapsed = time.perf_counter() - start
+        self.stdout.write('%-40s %10.2fms' % (label, elapsed / count * 1000))
+        return result
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        # Everything happens in a transaction that is rolled back, so the benchmark leaves no contest behind.
+        try:
+            with transaction.atomic():
+                contest, participations, cases = self.populate(options, rng)
+                self.stdout.write('Created %d test cases' % cases)
+                format = contest.format
+                submissions = list(Submission.objects.filter(contest_object=contest).select_related('contest'))
+
+                self.time('rebuild all batch results', 1, lambda: format.update_batch_results(participations))
+                self.time('nested query, whole contest', 1, lambda: nested_query_results(participations))
+                self.time('batch results, whole contest', 1, lambda: format.get_bulk_format_data(participations))
+
+                graded = rng.sample(submissions, min(options['repeat'], len(submissions)))
+                by_id = {participation.id: participation for participation in participations}
+                it = iter(graded * 2)
+
+                def nested_submission():
+                    submission = next(it)
+                    return nested_query_results([by_id[submission.contest.participation_id]],
+                                                submission.contest.problem_id)
+
+                def apply_submission():
+                    submission = next(it)
+                    participation = by_id[submission.contest.participation_id]
+                    format.apply_batch_results(participation, submission.contest.problem_id, submission)
+                    return format.get_bulk_format_data([participation], submission.contest.problem_id)
+
+                self.time('nested query, graded submission', len(graded), nested_submission)
+                self.time('batch results, graded submission', len(graded), apply_submission)
+
+                starts = {participation.id: participation.start for participation in participations}
+                expected = {}
+                for part, prob, date, points in nested_query_results(participations):
+                    data = expected.setdefault(part, {}).setdefault(str(prob), {'points': 0, 'time': 0})
+                    data['points'] += points
+                    data['time'] = max(data['time'], (date - starts[part]).total_seconds())
+                self.stdout.write('Results match: %s' % (format.get_bulk_format_data(participations) == expected))
+                raise Rollback()
+        except Rollback:
+            pass
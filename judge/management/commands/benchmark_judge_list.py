@@ -0,0 +1,161 @@
+import logging
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from judge.bridge.judge_list import JudgeList
+from judge.bridge.submission_queue import QueuedSubmission, SubmissionQueue
+from judge.judge_priority import CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY, REJUDGE_PRIORITY
+
+try:
+    from llist import dllist
+except ImportError:
+    from pyllist import dllist
+
+
+class LinearSubmissionQueue(object):
+    """The single linked list with priority markers that JudgeList used to scan from the head on every dispatch."""
+
+    def __init__(self, priorities):
+        self.queue = dllist()
+        self.priority = [self.queue.append(priority) for priority in range(priorities)]
+        self.node_map = {}
+
+    def __len__(self):
+        return len(self.node_map)
+
+    def __contains__(self, id):
+        return id in self.node_map
+
+    def push(self, id, problem, language, source, judge_id, priority, banned_judges=()):
+        submission = QueuedSubmission(id, problem, language, source, judge_id, tuple(banned_judges or ()),
+                                      priority, 0, time.monotonic())
+        self.node_map[id] = self.queue.insert(submission, self.priority[priority])
+
+    def remove(self, id):
+        node = self.node_map.pop(id, None)
+        if node is not None:
+            self.queue.remove(node)
+
+    def record_dispatch(self, priority):
+        pass
+
+    def next_for(self, judge, should_reserve_judge):
+        node = self.queue.first
+        priority = 0
+        while node:
+            if isinstance(node.value, int):
+                priority = node.value + 1
+            elif priority >= REJUDGE_PRIORITY and should_reserve_judge():
+                return None
+            else:
+                submission = node.value
+                if judge.name not in submission.banned_judges and \
+                        judge.can_judge(submission.problem, submission.language, submission.judge_id):
+                    return submission
+            node = node.next
+        return None
+
+
+class BenchmarkJudge(object):
+    def __init__(self, name, problems, executors):
+        self.name = name
+        self.tier = 0
+        self.load = 0
+        self.is_disabled = False
+        self.problems = problems
+        self.executors = executors
+        self._working = False
+
+    @property
+    def working(self):
+        return bool(self._working)
+
+    def can_judge(self, problem, executor, judge_id=None):
+        return problem in self.problems and executor in self.executors and \
+            ((not judge_id and not self.is_disabled) or self.name == judge_id)
+
+    def get_current_submission(self):
+        return self._working or None
+
+    def submit(self, id, problem, language, source):
+        self._working = id
+
+    def disconnect(self, force=False):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'benchmark how quickly the bridge hands queued submissions to judges that become free'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--submissions', type=int, default=50000, help='number of queued submissions')
+        parser.add_argument('-p', '--problems', type=int, default=500, help='number of distinct problems')
+        parser.add_argument('-l', '--languages', type=int, default=4, help='number of distinct languages')
+        parser.add_argument('-j', '--judges', type=int, default=32, help='number of judges')
+        parser.add_argument('-g', '--groups', type=int, default=4,
+                            help='number of disjoint groups of problems, each served by its own judges')
+        parser.add_argument('--hot', type=float, default=0.9,
+                            help='share of submissions for problems that only the first group of judges can grade')
+        parser.add_argument('-d', '--dispatches', type=int, default=2000, help='number of dispatches to time')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    def make_judges(self, options):
+        problems = ['problem%d' % i for i in range(options['problems'])]
+        languages = {'lang%d' % i for i in range(options['languages'])}
+        groups = [problems[i::options['groups']] for i in range(options['groups'])]
+        judges = [BenchmarkJudge('judge%d' % i, set(groups[i % options['groups']]), languages)
+                  for i in range(options['judges'])]
+        return groups, sorted(languages), judges
+
+    def run(self, queue_class, options):
+        rng = random.Random(options['seed'])
+        groups, languages, judges = self.make_judges(options)
+        problems = [problem for group in groups for problem in group]
+
+        judge_list = JudgeList()
+        judge_list.queue = queue_class(judge_list.priorities)
+        judge_list.node_map = judge_list.queue.node_map
+        for judge in judges:
+            judge_list.register(judge)
+
+        start = time.perf_counter()
+        for id in range(1, options['submissions'] + 1):
+            priority = CONTEST_SUBMISSION_PRIORITY if rng.random() < 0.2 else DEFAULT_PRIORITY
+            problem = rng.choice(groups[0] if rng.random() < options['hot'] else problems)
+            judge_list.judge(id, problem, rng.choice(languages), '', None, priority)
+        fill_time = time.perf_counter() - start
+
+        latencies = []
+        dispatched = []
+        for _ in range(options['dispatches']):
+            judge = rng.choice(judges)
+            if not judge.working:
+                continue
+            start = time.perf_counter()
+            judge_list.on_judge_free(judge, judge.get_current_submission())
+            latencies.append(time.perf_counter() - start)
+            dispatched.append(judge.get_current_submission())
+        return fill_time, latencies, dispatched
+
+    def report(self, name, fill_time, latencies):
+        latencies = sorted(latencies)
+        self.stdout.write('%s: filled in %.3fs, %d dispatches, mean %.1fus, p50 %.1fus, p99 %.1fus, max %.1fus' % (
+            name, fill_time, len(latencies), statistics.mean(latencies) * 1e6,
+            latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6, latencies[-1] * 1e6,
+        ))
+
+    def handle(self, *args, **options):
+        logging.getLogger('judge.bridge').setLevel(logging.WARNING)
+
+        with override_settings(VNOJ_LONG_QUEUE_ALERT_THRESHOLD=None):
+            before = self.run(LinearSubmissionQueue, options)
+            after = self.run(SubmissionQueue, options)
+
+        self.report('linear scan', *before[:2])
+        self.report('indexed', *after[:2])
+        if before[2] != after[2]:
+            self.stderr.write('Dispatch order differs between the two queues!')
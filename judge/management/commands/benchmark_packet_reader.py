@@ -0,0 +1,96 @@
+import json
+import random
+import socket
+import statistics
+import struct
+import threading
+import time
+import tracemalloc
+import zlib
+
+from django.core.management.base import BaseCommand
+
+from judge.bridge.base_handler import ZlibPacketHandler
+
+size_pack = struct.Struct('!I')
+
+
+class BenchmarkHandler(ZlibPacketHandler):
+    def __init__(self, request):
+        super().__init__(request, ('127.0.0.1', 0), type('Server', (), {'server_address': ('127.0.0.1', 0)})())
+        self.received = 0
+
+    def on_packet(self, data):
+        self.received += 1
+
+
+class JoiningBenchmarkHandler(BenchmarkHandler):
+    """Reads packets the way ZlibPacketHandler used to: a list of recv() chunks, joined and decompressed at once."""
+
+    def read_sized_packet(self, size, initial=None):
+        buffer = []
+        remainder = size
+        while remainder:
+            data = self.request.recv(remainder)
+            remainder -= len(data)
+            buffer.append(data)
+        self._on_decompressed_packet(zlib.decompress(b''.join(buffer)))
+
+
+class Command(BaseCommand):
+    help = 'benchmark how the bridge reads large zlib packets, such as test case output, from judges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--packets', type=int, default=20, help='number of packets per run')
+        parser.add_argument('-s', '--size', type=float, default=6, help='size of each compressed packet, in MiB')
+        parser.add_argument('-r', '--runs', type=int, default=5, help='number of timed runs per reader')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    def make_packet(self, size, rng):
+        # Hex digits compress roughly 2:1, like typical program output, so the compressed size is easy to hit.
+        output = rng.randbytes(size).hex()
+        packet = zlib.compress(json.dumps({'name': 'test-case-status', 'cases': [{'output': output}]}).encode())
+        return size_pack.pack(len(packet)) + packet
+
+    def run(self, handler_class, data, count, trace=False):
+        server, client = socket.socketpair()
+
+        def send():
+            for _ in range(count):
+                client.sendall(data)
+            client.close()
+
+        thread = threading.Thread(target=send)
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        thread.start()
+        # Skip RequestHandlerMeta, so that the handler is still around to be checked afterwards.
+        handler = handler_class.__new__(handler_class)
+        handler.__init__(server)
+        handler.handle()
+        elapsed = time.perf_counter() - start
+        peak = None
+        if trace:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        thread.join()
+        server.close()
+        assert handler.received == count, handler.received
+        return elapsed, peak
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        data = self.make_packet(int(options['size'] * 1024 * 1024), rng)
+        self.stdout.write('Packet: %.2f MiB compressed, %d packets per run' % (
+            (len(data) - size_pack.size) / 2 ** 20, options['packets'],
+        ))
+
+        for name, handler_class in (('join', JoiningBenchmarkHandler), ('recv_into', BenchmarkHandler)):
+            times = [self.run(handler_class, data, options['packets'])[0] for _ in range(options['runs'])]
+            # Tracing slows allocations down a lot, so memory is measured in a separate, untimed run.
+            peak = self.run(handler_class, data, options['packets'], trace=True)[1]
+            self.stdout.write('%s: median %.3fs (%.1f MiB/s), peak traced memory %.1f MiB' % (
+                name, statistics.median(times), len(data) * options['packets'] / statistics.median(times) / 2 ** 20,
+                peak / 2 ** 20,
+            ))
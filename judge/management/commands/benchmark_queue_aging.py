@@ -0,0 +1,160 @@
+import heapq
+import logging
+import random
+from collections import defaultdict
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from judge.bridge.judge_list import JudgeList
+from judge.judge_priority import BATCH_REJUDGE_PRIORITY, CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY, \
+    REJUDGE_PRIORITY
+
+PRIORITY_NAMES = {
+    CONTEST_SUBMISSION_PRIORITY: 'contest',
+    DEFAULT_PRIORITY: 'normal',
+    REJUDGE_PRIORITY: 'rejudge',
+    BATCH_REJUDGE_PRIORITY: 'batch',
+}
+
+
+class Simulation(object):
+    """Feeds a JudgeList with submissions and judges that grade them, on a simulated clock rather than a real one."""
+
+    def __init__(self, options):
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.now = 0.0
+        self.events = []
+        self.sequence = 0
+        self.arrivals = {}
+        self.waits = defaultdict(list)
+        self.judges = JudgeList()
+
+    def schedule(self, when, action, *args):
+        heapq.heappush(self.events, (when, self.sequence, action, args))
+        self.sequence += 1
+
+    def arrive(self, id, priority):
+        self.arrivals[id] = (self.now, priority)
+        self.judges.judge(id, 'problem', 'lang', '', None, priority)
+
+    def dispatched(self, judge, id):
+        arrived, priority = self.arrivals[id]
+        self.waits[priority].append(self.now - arrived)
+        self.schedule(self.now + self.rng.expovariate(1 / self.options['grading_time']), self.finish, judge, id)
+
+    def finish(self, judge, id):
+        self.judges.on_judge_free(judge, id)
+
+    def run(self):
+        options = self.options
+        ids = iter(range(1, 10 ** 9))
+        for _ in range(options['backlog']):
+            self.schedule(0, self.arrive, next(ids), BATCH_REJUDGE_PRIORITY)
+        for priority, rate in ((CONTEST_SUBMISSION_PRIORITY, options['contest_rate']),
+                               (DEFAULT_PRIORITY, options['normal_rate']),
+                               (REJUDGE_PRIORITY, options['rejudge_rate'])):
+            when = 0
+            while rate:
+                when += self.rng.expovariate(rate)
+                if when > options['duration']:
+                    break
+                self.schedule(when, self.arrive, next(ids), priority)
+
+        for i in range(options['judges']):
+            self.judges.register(SimulatedJudge('judge%d' % i, self))
+
+        clock = SimpleNamespace(monotonic=lambda: self.now)
+        with mock.patch('judge.bridge.judge_list.time', clock), \
+                mock.patch('judge.bridge.submission_queue.time', clock):
+            while self.events and self.events[0][0] <= options['duration']:
+                self.now, _, action, args = heapq.heappop(self.events)
+                action(*args)
+
+        # What never got a judge has waited at least this long, which matters as much as what did.
+        queued = defaultdict(list)
+        for id in self.judges.queue.node_map:
+            arrived, priority = self.arrivals[id]
+            queued[priority].append(self.now - arrived)
+        return self.waits, queued
+
+
+class SimulatedJudge(object):
+    def __init__(self, name, simulation):
+        self.name = name
+        self.simulation = simulation
+        self.tier = 0
+        self.load = 0
+        self.is_disabled = False
+        self._working = False
+
+    @property
+    def working(self):
+        return bool(self._working)
+
+    def can_judge(self, problem, executor, judge_id=None):
+        return not judge_id or self.name == judge_id
+
+    def get_current_submission(self):
+        return self._working or None
+
+    def submit(self, id, problem, language, source):
+        self._working = id
+        self.simulation.dispatched(self, id)
+
+    def disconnect(self, force=False):
+        pass
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'simulate how long each priority waits in the bridge queue under mixed load, with and without aging'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-j', '--judges', type=int, default=8, help='number of judges')
+        parser.add_argument('-d', '--duration', type=float, default=4 * 3600, help='simulated seconds')
+        parser.add_argument('-g', '--grading-time', type=float, default=4, help='mean seconds to grade a submission')
+        parser.add_argument('--contest-rate', type=float, default=0.8, help='contest submissions per second')
+        parser.add_argument('--normal-rate', type=float, default=1.1, help='other submissions per second')
+        parser.add_argument('--rejudge-rate', type=float, default=0.01, help='single rejudges per second')
+        parser.add_argument('--backlog', type=int, default=3000, help='batch rejudges queued at the start')
+        parser.add_argument('--aging-time', type=float, default=600, help='BRIDGED_QUEUE_AGING_TIME to try')
+        parser.add_argument('--min-share', type=float, default=0.1, help='BRIDGED_REJUDGE_MIN_SHARE to try')
+        parser.add_argument('--contest-target', type=float, default=30, help='BRIDGED_CONTEST_LATENCY_TARGET to try')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    def handle(self, *args, **options):
+        logging.getLogger('judge.bridge').setLevel(logging.WARNING)
+
+        policies = [
+            ('strict', {}),
+            ('aging', {'BRIDGED_QUEUE_AGING_TIME': options['aging_time']}),
+            ('share', {'BRIDGED_REJUDGE_MIN_SHARE': options['min_share'],
+                       'BRIDGED_CONTEST_LATENCY_TARGET': options['contest_target']}),
+            ('both', {'BRIDGED_QUEUE_AGING_TIME': options['aging_time'],
+                      'BRIDGED_REJUDGE_MIN_SHARE': options['min_share'],
+                      'BRIDGED_CONTEST_LATENCY_TARGET': options['contest_target']}),
+        ]
+        self.stdout.write('%-7s %-8s %8s %9s %9s %9s %8s %11s' % (
+            'policy', 'priority', 'judged', 'p50', 'p99', 'max', 'queued', 'oldest',
+        ))
+        for name, overrides in policies:
+            defaults = {'BRIDGED_QUEUE_AGING_TIME': None, 'BRIDGED_REJUDGE_MIN_SHARE': 0,
+                        'BRIDGED_CONTEST_LATENCY_TARGET': None}
+            with override_settings(VNOJ_LONG_QUEUE_ALERT_THRESHOLD=None, **dict(defaults, **overrides)):
+                waits, queued = Simulation(options).run()
+            for priority, label in PRIORITY_NAMES.items():
+                values = sorted(waits[priority])
+                if not values and not queued[priority]:
+                    continue
+                self.stdout.write('%-7s %-8s %8d %8.1fs %8.1fs %8.1fs %8d %10.1fs' % (
+                    name, label, len(values),
+                    percentile(values, 0.5) if values else 0, percentile(values, 0.99) if values else 0,
+                    values[-1] if values else 0, len(queued[priority]), max(queued[priority], default=0),
+                ))
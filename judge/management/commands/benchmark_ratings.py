@@ -0,0 +1,55 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.ratings import MEAN_INIT, np, recalculate_ratings_numpy, recalculate_ratings_python, tie_ranker
+
+
+def make_contest(n, rng):
+    """Returns the arguments of recalculate_ratings for a contest of n participants, with many ties."""
+    scores = sorted((rng.randrange(0, 700, 50) for _ in range(n)), reverse=True)
+    ranking = list(tie_ranker(scores, key=lambda score: score))
+    times_ranked = [min(int(rng.expovariate(1 / 8)), 100) for _ in range(n)]
+    historical_p = [[rng.gauss(MEAN_INIT, 400) for _ in range(times)] for times in times_ranked]
+    old_mean = [rng.gauss(MEAN_INIT, 300) if times else MEAN_INIT for times in times_ranked]
+    return ranking, old_mean, times_ranked, historical_p
+
+
+class Command(BaseCommand):
+    help = 'benchmark the NumPy rating solver against the pure Python one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--participants', type=int, nargs='+', default=[1000, 10000, 30000],
+                            help='contest sizes to time')
+        parser.add_argument('--python-limit', type=int, default=2000,
+                            help='largest contest to also time the pure Python solver on, as it is quadratic')
+        parser.add_argument('--seed', type=int, default=0, help='random seed')
+
+    def handle(self, *args, **options):
+        if np is None:
+            raise CommandError('NumPy is not installed')
+
+        rng = random.Random(options['seed'])
+        self.stdout.write('%12s %10s %10s %14s %14s %8s' % (
+            'participants', 'numpy', 'python', 'max mean diff', 'max perf diff', 'ratings',
+        ))
+        for n in options['participants']:
+            contest = make_contest(n, rng)
+            start = time.perf_counter()
+            rating, mean, performance = recalculate_ratings_numpy(*contest)
+            numpy_time = time.perf_counter() - start
+
+            if n > options['python_limit']:
+                self.stdout.write('%12d %9.3fs %10s %14s %14s %8s' % (n, numpy_time, '-', '-', '-', '-'))
+                continue
+
+            start = time.perf_counter()
+            old_rating, old_mean, old_performance = recalculate_ratings_python(*contest)
+            python_time = time.perf_counter() - start
+            self.stdout.write('%12d %9.3fs %9.3fs %14.2e %14.2e %8s' % (
+                n, numpy_time, python_time,
+                max(abs(a - b) for a, b in zip(mean, old_mean)),
+                max(abs(a - b) for a, b in zip(performance, old_performance)),
+                'same' if rating == old_rating else '%d diff' % sum(a != b for a, b in zip(rating, old_rating)),
+            ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from judge.models import Contest
+from judge.ratings import rebuild_ratings
+
+
+class Command(BaseCommand):
+    help = 'rate every rated contest again, in order of end time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', metavar='CONTEST',
+                            help='only rate the contests that ended since this contest did, this one included')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = Contest.objects.get(key=options['since']).end_time
+            except Contest.DoesNotExist:
+                raise CommandError('contest not found: %s' % options['since'])
+
+        def progress(done, total):
+            if done and done % 100 == 0 and done < total:
+                self.stdout.write('Rated %d/%d contests (%.1fs)' % (done, total, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        contests = rebuild_ratings(since=since, progress=progress)
+        self.stdout.write('Rated %d contests in %.1fs' % (len(contests), time.perf_counter() - start))
@@ -9,6 +9,8 @@ class Command(BaseCommand):
                             help='if specified, run a monitor to automatically update problems')
         parser.add_argument('--problem-storage-globs', nargs='*', default=[],
                             help='globs to monitor for problem updates')
+        parser.add_argument('--instance', default=None,
+                            help='name of this instance among those sharing BRIDGED_SHARED_STORE')
 
     def handle(self, *args, **options):
-        judge_daemon(options['monitor'], options['problem_storage_globs'])
+        judge_daemon(options['monitor'], options['problem_storage_globs'], options['instance'])
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0233_merge_20260818_0918'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContestBatchResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch', models.IntegerField(blank=True, null=True, verbose_name='batch number')),
+                ('points', models.FloatField(help_text='The most points any graded submission got on this batch.', verbose_name='points')),
+                ('date', models.DateTimeField(verbose_name='submission time')),
+                ('participation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_results', to='judge.contestparticipation', verbose_name='participation')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_results', to='judge.contestproblem', verbose_name='problem')),
+                ('submission', models.ForeignKey(help_text='The first submission that got these points.', on_delete=django.db.models.deletion.CASCADE, related_name='+', to='judge.submission', verbose_name='submission')),
+            ],
+            options={
+                'verbose_name': 'contest batch result',
+                'verbose_name_plural': 'contest batch results',
+                'unique_together': {('participation', 'problem', 'batch')},
+            },
+        ),
+    ]
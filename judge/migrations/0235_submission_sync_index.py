@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('judge', '0234_contest_batch_result'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['contest_object', 'judged_date', 'id'], name='judge_submi_contest_ade122_idx'),
+        ),
+    ]
@@ -2,8 +2,8 @@ from reversion import revisions
 
 from judge.models.choices import ACE_THEMES, EFFECTIVE_MATH_ENGINES, MATH_ENGINES_CHOICES, TIMEZONE
 from judge.models.comment import Comment, CommentLock, CommentVote
-from judge.models.contest import Contest, ContestAnnouncement, ContestMoss, ContestParticipation, ContestProblem, \
-    ContestSubmission, ContestTag, Rating
+from judge.models.contest import Contest, ContestAnnouncement, ContestBatchResult, ContestMoss, \
+    ContestParticipation, ContestProblem, ContestSubmission, ContestTag, Rating
 from judge.models.interface import BlogPost, BlogPostTag, BlogVote, MiscConfig, NavigationBar, validate_regex
 from judge.models.library import ExamCategory, ExamStatement
 from judge.models.notification import Notification, make_notification
@@ -20,11 +20,12 @@ from judge import contest_format
 from judge.models.problem import Problem
 from judge.models.profile import Organization, Profile
 from judge.models.submission import Submission
-from judge.ratings import rate_contest
+from judge.ratings import rebuild_ratings
+from judge.utils.scoreboard import scoreboard_changed
 from judge.utils.unicode import utf8bytes
 
-__all__ = ['Contest', 'ContestTag', 'ContestAnnouncement', 'ContestParticipation', 'ContestProblem',
-           'ContestSubmission', 'Rating']
+__all__ = ['Contest', 'ContestTag', 'ContestAnnouncement', 'ContestBatchResult', 'ContestParticipation',
+           'ContestProblem', 'ContestSubmission', 'Rating']
 
 
 class MinValueOrNoneValidator(MinValueValidator):
@@ -588,11 +589,8 @@ class Contest(models.Model):
 
     def rate(self):
         with transaction.atomic():
-            Rating.objects.filter(contest__end_time__range=(self.end_time, self._now)).delete()
-            for contest in Contest.objects.filter(
-                is_rated=True, end_time__range=(self.end_time, self._now),
-            ).order_by('end_time'):
-                rate_contest(contest)
+            for contest in rebuild_ratings(since=self.end_time):
+                scoreboard_changed(contest.id)
 
     class Meta:
         permissions = (
@@ -651,6 +649,8 @@ class ContestParticipation(models.Model):
 
     def recompute_results(self):
         with transaction.atomic():
+            # Hold off apply_submission, which writes the same batch results of the format.
+            ContestParticipation.lock([self.id])
             self.contest.format.update_participation(self)
             if self.is_disqualified:
                 self.score = -9999
@@ -659,6 +659,38 @@ class ContestParticipation(models.Model):
                 self.save(update_fields=['score', 'cumtime', 'tiebreaker'])
     recompute_results.alters_data = True
 
+    @classmethod
+    def lock(cls, ids):
+        """Locks the rows of the given participations until the end of the transaction, in order of id."""
+        list(cls.objects.select_for_update().filter(id__in=ids).order_by('id').values_list('id', flat=True))
+
+    @classmethod
+    def recompute_results_bulk(cls, contest, participations):
+        """Does what recompute_results does for a list of participations in `contest`, in a few queries."""
+        with transaction.atomic():
+            cls.lock([participation.id for participation in participations])
+            contest.format.update_participations(participations)
+            for participation in participations:
+                if participation.is_disqualified:
+                    participation.score = -9999
+                    participation.cumtime = 0
+                    participation.tiebreaker = 0
+            cls.objects.bulk_update(participations, ['score', 'cumtime', 'tiebreaker', 'frozen_score',
+                                                     'frozen_cumtime', 'frozen_tiebreaker', 'format_data'])
+            scoreboard_changed(contest.id, [participation.id for participation in participations])
+
+    def apply_submission(self, problem_id, submission=None):
+        if self.is_disqualified:
+            self.recompute_results()
+            return
+
+        with transaction.atomic():
+            # Lock the row, and pick up what other problems' submissions graded in the meantime changed.
+            self.format_data = ContestParticipation.objects.select_for_update() \
+                .values_list('format_data', flat=True).get(id=self.id)
+            self.contest.format.apply_submission(self, problem_id, submission)
+    apply_submission.alters_data = True
+
     def check_ban(self):
         if not settings.VNOJ_SHOULD_BAN_FOR_CHEATING_IN_CONTESTS or self.contest.is_organization_private:
             return
@@ -801,6 +833,24 @@ class ContestSubmission(models.Model):
         verbose_name_plural = _('contest submissions')
 
 
+class ContestBatchResult(models.Model):
+    participation = models.ForeignKey(ContestParticipation, verbose_name=_('participation'), on_delete=CASCADE,
+                                      related_name='batch_results')
+    problem = models.ForeignKey(ContestProblem, verbose_name=_('problem'), on_delete=CASCADE,
+                                related_name='batch_results')
+    batch = models.IntegerField(verbose_name=_('batch number'), null=True, blank=True)
+    points = models.FloatField(verbose_name=_('points'),
+                               help_text=_('The most points any graded submission got on this batch.'))
+    submission = models.ForeignKey(Submission, verbose_name=_('submission'), on_delete=CASCADE, related_name='+',
+                                   help_text=_('The first submission that got these points.'))
+    date = models.DateTimeField(verbose_name=_('submission time'))
+
+    class Meta:
+        unique_together = ('participation', 'problem', 'batch')
+        verbose_name = _('contest batch result')
+        verbose_name_plural = _('contest batch results')
+
+
 class Rating(models.Model):
     user = models.ForeignKey(Profile, verbose_name=_('user'), related_name='ratings', on_delete=CASCADE)
     contest = models.ForeignKey(Contest, verbose_name=_('contest'), related_name='ratings', on_delete=CASCADE)
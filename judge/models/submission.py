@@ -10,7 +10,7 @@ from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from reversion import revisions
 
-from judge.judgeapi import abort_submission, judge_submission
+from judge.judgeapi import abort_submission, judge_submission, judge_submissions
 from judge.models.problem import Problem, SubmissionSourceAccess
 from judge.models.profile import Profile
 from judge.models.runtime import Language
@@ -138,6 +138,19 @@ class Submission(models.Model):
 
     judge.alters_data = True
 
+    @classmethod
+    def judge_many(cls, submissions, *args, rejudge=False, force_judge=False, rejudge_user=None, **kwargs):
+        """Like calling judge on each submission, but sending them to the bridge in batches."""
+        submissions = [submission for submission in submissions if force_judge or not submission.is_locked]
+        if rejudge:
+            for submission in submissions:
+                with revisions.create_revision(manage_manually=True):
+                    if rejudge_user:
+                        revisions.set_user(rejudge_user)
+                    revisions.set_comment('Rejudged')
+                    revisions.add_to_revision(submission)
+        return judge_submissions(submissions, *args, rejudge=rejudge, **kwargs)
+
     def abort(self):
         abort_submission(self)
 
@@ -186,7 +199,7 @@ class Submission(models.Model):
             contest.points = 0
 
         contest.save()
-        contest.participation.recompute_results()
+        contest.participation.apply_submission(contest.problem_id, self)
 
     update_contest.alters_data = True
 
@@ -291,6 +304,9 @@ class Submission(models.Model):
 
             # For organization problem list: last submission time filter
             models.Index(fields=['problem', '-date']),
+
+            # For the contest sync API, which pages through the submissions of a contest by judge time
+            models.Index(fields=['contest_object', 'judged_date', 'id']),
         ]
 
 
@@ -0,0 +1,314 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from judge.models import ContestParticipation, ContestSubmission, Language, Submission, SubmissionTestCase
+from judge.models.tests.util import CommonDataMixin, create_contest, create_contest_participation, \
+    create_contest_problem, create_problem
+from judge.tasks import rescore_contest
+
+# Problem index, minutes into the contest, result, and the points of each case, by batch.
+SUBMISSIONS = [
+    (0, 10, 'WA', [[0, 0], [10]]),
+    (1, 20, 'CE', []),
+    (0, 30, 'WA', [[20, 0], [0]]),
+    (1, 40, 'AC', [[50, 50]]),
+    (0, 50, 'IE', []),
+    (0, 150, 'WA', [[20, 20], [0]]),
+    (0, 160, 'AC', [[20, 20], [60]]),
+    (1, 170, 'WA', [[0, 0]]),
+]
+
+RESULT_FIELDS = ('score', 'cumtime', 'tiebreaker', 'frozen_score', 'frozen_cumtime', 'frozen_tiebreaker',
+                 'format_data')
+
+# What the implementation of each format before set-based rescoring computed for SUBMISSIONS, with the contest
+# problems by index, after a full recompute.
+EXPECTED_RESULTS = {
+    'default': {
+        'cumtime': 19800,
+        'format_data': {0: {'points': 100.0, 'time': 9600.0}, 1: {'points': 100.0, 'time': 10200.0}},
+        'frozen_cumtime': 0,
+        'frozen_score': 0.0,
+        'frozen_tiebreaker': 0.0,
+        'score': 200.0,
+        'tiebreaker': 0.0,
+    },
+    'ioi': {
+        'cumtime': 12000,
+        'format_data': {0: {'points': 100.0, 'time': 9600.0}, 1: {'points': 100.0, 'time': 2400.0}},
+        'frozen_cumtime': 0,
+        'frozen_score': 0.0,
+        'frozen_tiebreaker': 0.0,
+        'score': 200.0,
+        'tiebreaker': 9600.0,
+    },
+    'ecoo': {
+        'cumtime': 19800,
+        'format_data': {
+            0: {'bonus': 16.0, 'points': 100.0, 'time': 9600.0},
+            1: {'bonus': 0, 'points': 0.0, 'time': 10200.0},
+        },
+        'frozen_cumtime': 0,
+        'frozen_score': 0.0,
+        'frozen_tiebreaker': 0.0,
+        'score': 116.0,
+        'tiebreaker': 0.0,
+    },
+    'ioi16': {
+        'cumtime': 12000,
+        'format_data': {0: {'points': 80.0, 'time': 9600.0}, 1: {'points': 50.0, 'time': 2400.0}},
+        'frozen_cumtime': 0,
+        'frozen_score': 0.0,
+        'frozen_tiebreaker': 0.0,
+        'score': 130.0,
+        'tiebreaker': 0.0,
+    },
+    'atcoder': {
+        'cumtime': 10500,
+        'format_data': {
+            0: {'penalty': 3, 'points': 100.0, 'time': 9600.0},
+            1: {'penalty': 0, 'points': 100.0, 'time': 2400.0},
+        },
+        'frozen_cumtime': 0,
+        'frozen_score': 0.0,
+        'frozen_tiebreaker': 0.0,
+        'score': 200.0,
+        'tiebreaker': 0.0,
+    },
+    'icpc': {
+        'cumtime': 260,
+        'format_data': {
+            0: {
+                'frozen_points': 0,
+                'frozen_tries': 4,
+                'is_frozen': True,
+                'points': 100.0,
+                'time': 9600.0,
+                'tries': 4,
+            },
+            1: {
+                'frozen_points': 100.0,
+                'frozen_tries': 1,
+                'is_frozen': False,
+                'points': 100.0,
+                'time': 2400.0,
+                'tries': 1,
+            },
+        },
+        'frozen_cumtime': 40,
+        'frozen_score': 100.0,
+        'frozen_tiebreaker': 40.0,
+        'score': 200.0,
+        'tiebreaker': 160.0,
+    },
+    'vnoj': {
+        'cumtime': 12900,
+        'format_data': {
+            0: {
+                'frozen_penalty': 1,
+                'frozen_points': 20.0,
+                'frozen_time': 1800.0,
+                'penalty': 3,
+                'pending': 2,
+                'points': 100.0,
+                'time': 9600.0,
+            },
+            1: {
+                'frozen_penalty': 0,
+                'frozen_points': 100.0,
+                'frozen_time': 2400.0,
+                'penalty': 0,
+                'pending': 1,
+                'points': 100.0,
+                'time': 2400.0,
+            },
+        },
+        'frozen_cumtime': 4500,
+        'frozen_score': 120.0,
+        'frozen_tiebreaker': 2400.0,
+        'score': 200.0,
+        'tiebreaker': 9600.0,
+    },
+}
+
+
+class ContestFormatTestCase(CommonDataMixin, TestCase):
+    @classmethod
+    def setUpTestData(self):
+        super().setUpTestData()
+        self.problems = [create_problem(code='format_%d' % i, points=100, partial=True) for i in range(2)]
+
+    def create_participation(self, format_name, format_config=None, user='normal'):
+        now = timezone.now()
+        contest = create_contest(
+            key='%s_format' % format_name,
+            start_time=now - timezone.timedelta(hours=3),
+            end_time=now + timezone.timedelta(hours=1),
+            frozen_last_minutes=120,
+            format_name=format_name,
+            format_config=format_config,
+        )
+        self.contest_problems = [
+            create_contest_problem(contest=contest, problem=problem, points=100, partial=True, order=i)
+            for i, problem in enumerate(self.problems)
+        ]
+        return create_contest_participation(contest=contest, user=user)
+
+    def submit(self, participation, problem, minutes, result, batches):
+        cases = [case for batch in batches for case in batch]
+        case_points = sum(cases)
+        submission = Submission.objects.create(
+            user=participation.user,
+            problem=self.problems[problem],
+            language=Language.get_python3(),
+            contest_object=participation.contest,
+            status='CE' if result == 'CE' else 'IE' if result == 'IE' else 'D',
+            result=result,
+            case_points=case_points,
+            case_total=100 if cases else 0,
+            points=case_points,
+        )
+        Submission.objects.filter(id=submission.id).update(date=participation.start +
+                                                           timezone.timedelta(minutes=minutes))
+        ContestSubmission.objects.create(
+            submission=submission,
+            problem=self.contest_problems[problem],
+            participation=participation,
+            points=case_points,
+        )
+        case = 0
+        for batch, points in enumerate(batches):
+            for point in points:
+                case += 1
+                SubmissionTestCase.objects.create(submission=submission, case=case, status='AC' if point else 'WA',
+                                                  points=point, total=point or 10,
+                                                  batch=batch + 1 if len(batches) > 1 else None)
+        return Submission.objects.get(id=submission.id)
+
+    def results(self, participation):
+        participation = ContestParticipation.objects.get(id=participation.id)
+        return {field: getattr(participation, field) for field in RESULT_FIELDS}
+
+    def assertMatchesRecompute(self, format_name, format_config=None):
+        participation = self.create_participation(format_name, format_config)
+        for data in SUBMISSIONS:
+            self.submit(participation, *data).update_contest()
+            applied = self.results(participation)
+
+            participation.refresh_from_db()
+            participation.recompute_results()
+            self.assertEqual(applied, self.results(participation), 'after submitting %s' % (data,))
+
+        expected = dict(EXPECTED_RESULTS[format_name])
+        expected['format_data'] = {str(self.contest_problems[index].id): data
+                                   for index, data in expected['format_data'].items()}
+        self.assertEqual(self.results(participation), expected)
+        return participation
+
+    def assertBulkMatchesRecompute(self, format_name, format_config=None):
+        participations = [self.create_participation(format_name, format_config, user)
+                          for user in ('normal', 'superuser', 'staff_problem_edit_own')]
+        for i, participation in enumerate(participations):
+            for data in SUBMISSIONS[i:]:
+                self.submit(participation, *data)
+        participations[1].set_disqualified(True)
+
+        contest = participations[0].contest
+        with mock.patch.object(rescore_contest, 'update_state') as update_state:
+            self.assertEqual(rescore_contest(contest.key), 3)
+        update_state.assert_called_with(state='PROGRESS', meta={'done': 3, 'total': 3, 'stage': mock.ANY})
+        rescored = [self.results(participation) for participation in participations]
+
+        for participation in participations:
+            participation.refresh_from_db()
+            participation.recompute_results()
+        self.assertEqual(rescored, [self.results(participation) for participation in participations])
+        self.assertEqual(rescored[1]['score'], -9999)
+
+    def test_default(self):
+        participation = self.assertMatchesRecompute('default')
+        self.assertEqual(participation.score, 200)
+        self.assertBulkMatchesRecompute('default')
+
+    def test_legacy_ioi(self):
+        self.assertMatchesRecompute('ioi', {'cumtime': True, 'last_score_altering': True})
+        self.assertBulkMatchesRecompute('ioi', {'cumtime': True, 'last_score_altering': True})
+
+    def test_ecoo(self):
+        self.assertMatchesRecompute('ecoo', {'cumtime': True, 'first_ac_bonus': 10, 'time_bonus': 5})
+        self.assertBulkMatchesRecompute('ecoo', {'cumtime': True, 'first_ac_bonus': 10, 'time_bonus': 5})
+
+    def test_ioi(self):
+        participation = self.assertMatchesRecompute('ioi16', {'cumtime': True})
+        # The best of each batch of the first problem comes from a different submission.
+        self.assertEqual(participation.format_data[str(self.contest_problems[0].id)]['points'], 80)
+        self.assertBulkMatchesRecompute('ioi16', {'cumtime': True})
+
+    def test_ioi_rejudge(self):
+        participation = self.create_participation('ioi16', {'cumtime': True})
+        submissions = [self.submit(participation, *data) for data in SUBMISSIONS]
+        for submission in submissions:
+            submission.update_contest()
+
+        # The submission that got the most points on the first batch no longer does.
+        submission = submissions[6]
+        submission.test_cases.filter(case=1).update(points=0)
+        submission.update_contest()
+        participation.refresh_from_db()
+        applied = self.results(participation)
+        participation.recompute_results()
+        self.assertEqual(applied, self.results(participation))
+        self.assertEqual(participation.format_data[str(self.contest_problems[0].id)]['points'], 80)
+        self.assertEqual(participation.batch_results.get(problem=self.contest_problems[0], batch=1).submission_id,
+                         submissions[5].id)
+
+    def test_ioi_without_batch_results(self):
+        participation = self.create_participation('ioi16', {'cumtime': True})
+        for data in SUBMISSIONS[:5]:
+            self.submit(participation, *data).update_contest()
+
+        # As after upgrading during a contest, when the best results on batches were not kept yet.
+        participation.batch_results.all().delete()
+        self.submit(participation, *SUBMISSIONS[5]).update_contest()
+        participation.refresh_from_db()
+        # The second batch is still from the first submission.
+        self.assertEqual(participation.format_data[str(self.contest_problems[0].id)]['points'], 30)
+        self.assertEqual(participation.batch_results.filter(problem=self.contest_problems[0]).count(), 2)
+
+    def test_bulk_queries(self):
+        participations = [self.create_participation('default', user=user)
+                          for user in ('normal', 'superuser', 'staff_problem_edit_own')]
+        for participation in participations:
+            for data in SUBMISSIONS:
+                self.submit(participation, *data)
+
+        contest = participations[0].contest
+        with CaptureQueriesContext(connection) as one:
+            ContestParticipation.recompute_results_bulk(contest, list(contest.users.all()[:1]))
+        with CaptureQueriesContext(connection) as many:
+            ContestParticipation.recompute_results_bulk(contest, list(contest.users.all()))
+        self.assertEqual(len(one), len(many))
+
+    def test_disqualified(self):
+        participation = self.create_participation('default')
+        participation.set_disqualified(True)
+        self.submit(participation, 1, 10, 'AC', [[100]]).update_contest()
+        participation.refresh_from_db()
+        self.assertEqual(participation.score, -9999)
+        self.assertEqual(participation.format_data[str(self.contest_problems[1].id)]['points'], 100)
+
+    def test_atcoder(self):
+        self.assertMatchesRecompute('atcoder')
+        self.assertBulkMatchesRecompute('atcoder')
+
+    def test_icpc(self):
+        self.assertMatchesRecompute('icpc')
+        self.assertBulkMatchesRecompute('icpc')
+
+    def test_vnoj(self):
+        self.assertMatchesRecompute('vnoj')
+        self.assertBulkMatchesRecompute('vnoj')
@@ -1,12 +1,17 @@
 from bisect import bisect
+from collections import defaultdict
 from math import pi, sqrt, tanh
 from operator import attrgetter, itemgetter
 
 from django.db import transaction
-from django.db.models import Count, OuterRef, Subquery
+from django.db.models import Count, OuterRef, Q, Subquery
 from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 BETA2 = 328.33 ** 2
 RATING_INIT = 1200      # Newcomer's rating when applying the rating floor/ceiling
@@ -76,7 +81,7 @@ def get_var(times_ranked, cache=[VAR_INIT]):
     return cache[times_ranked]
 
 
-def recalculate_ratings(ranking, old_mean, times_ranked, historical_p):
+def recalculate_ratings_python(ranking, old_mean, times_ranked, historical_p):
     n = len(ranking)
     new_p = [0.] * n
     new_mean = [0.] * n
@@ -139,23 +144,142 @@ def recalculate_ratings(ranking, old_mean, times_ranked, historical_p):
     return new_rating, new_mean, new_p
 
 
+# Elements of the arrays evaluated at once by recalculate_ratings_numpy, to bound its memory use.
+NUMPY_CHUNK_SIZE = 1 << 22
+
+
+def _bisect_numpy(f, y_tg, bounds=VALID_RANGE):
+    """
+    Solves f(x) = y_tg for each element of y_tg, where f is non-decreasing in each element and evaluated for all of
+    them at once. Takes the same steps as solve does for each element.
+    """
+    n = len(y_tg)
+    L = np.full(n, bounds[0])
+    R = np.full(n, bounds[1])
+    Ly = np.full(n, np.nan)
+    Ry = np.full(n, np.nan)
+    exact = np.full(n, np.nan)
+    # Every element starts from the same bounds, so they all take as many steps.
+    width = bounds[1] - bounds[0]
+    while width > 2:
+        x = (L + R) / 2
+        y = f(x)
+        above, below = y > y_tg, y < y_tg
+        R = np.where(above, x, R)
+        Ry = np.where(above, y, Ry)
+        L = np.where(below, x, L)
+        Ly = np.where(below, y, Ly)
+        exact = np.where(~above & ~below & np.isnan(exact), x, exact)
+        width /= 2
+    # Use linear interpolation to be slightly more accurate.
+    Ly = np.where(np.isnan(Ly), f(L), Ly)
+    Ry = np.where(np.isnan(Ry), f(R), Ry)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (y_tg - Ly) / (Ry - Ly)
+    x = np.where(y_tg <= Ly, L, np.where(y_tg >= Ry, R, L * (1 - ratio) + R * ratio))
+    return np.where(np.isnan(exact), x, exact)
+
+
+def recalculate_ratings_numpy(ranking, old_mean, times_ranked, historical_p):
+    """
+    Does what recalculate_ratings_python does with NumPy arrays.
+
+    Every participant's performance solves the same equation for a different target, so the left side is evaluated
+    on a grid of step 1 spanning the best and worst performance, and inverted by linear interpolation. Means are
+    solved by bisecting for all participants at once.
+    """
+    n = len(ranking)
+    if n < 2:
+        return recalculate_ratings_python(ranking, old_mean, times_ranked, historical_p)
+
+    ranking = np.asarray(ranking, dtype=float)
+    old_mean = np.asarray(old_mean, dtype=float)
+    times_ranked = np.asarray(times_ranked, dtype=int)
+    var = np.array([get_var(t) for t in range(times_ranked.max() + 2)])
+
+    # Note: pre-multiply delta by TANH_C to improve efficiency.
+    delta = TANH_C * np.sqrt(var[times_ranked] + VAR_PER_CONTEST + BETA2)
+
+    # Calculate performance. Beating s adds 1 / delta[s] to the target, losing to s subtracts it, and ties count as
+    # half a win, as per Elo-MMR.
+    order = np.argsort(ranking, kind='stable')
+    sorted_ranking = ranking[order]
+    cumulative = np.concatenate(([0.], np.cumsum(1. / delta[order])))
+    beaten = cumulative[-1] - cumulative[np.searchsorted(sorted_ranking, ranking, side='right')]
+    beaten_by = cumulative[np.searchsorted(sorted_ranking, ranking, side='left')]
+    y_tg = beaten - beaten_by
+
+    rows = max(1, NUMPY_CHUNK_SIZE // n)
+
+    def p_tanhs(x):
+        return np.concatenate([
+            (np.tanh((x[i:i + rows, None] - old_mean) / (2 * delta)) / delta).sum(axis=1)
+            for i in range(0, len(x), rows)
+        ])
+
+    best, worst = _bisect_numpy(p_tanhs, y_tg[[y_tg.argmax(), y_tg.argmin()]])
+    grid = np.arange(np.floor(worst) - 1, np.ceil(best) + 2)
+    new_p = np.interp(y_tg, p_tanhs(grid), grid)
+
+    # Calculate mean, from the tanh terms of this performance followed by the historical ones, padded with zero weights.
+    history = max(map(len, historical_p)) + 1
+    h = np.zeros((n, history))
+    h[:, 0] = new_p
+    valid = np.zeros((n, history), dtype=bool)
+    valid[:, 0] = True
+    for i, p in enumerate(historical_p):
+        h[i, 1:len(p) + 1] = p
+        valid[i, 1:len(p) + 1] = True
+    j = np.arange(history)
+    h_var = var[np.maximum(times_ranked[:, None] + 1 - j, 0)]
+    gamma2 = np.where(j > 0, VAR_PER_CONTEST, 0)
+    w = np.cumprod((h_var / (h_var + gamma2)) ** 2, axis=1) * valid
+    s = sqrt(BETA2) * TANH_C
+
+    def tanhs(x, start=0):
+        return (w[:, start:] / s * np.tanh((x[:, None] - h[:, start:]) / (2 * s))).sum(axis=1)
+
+    w0 = 1. / var[times_ranked + 1] - w.sum(axis=1) / BETA2
+    p0 = tanhs(old_mean, 1) / w0 + old_mean
+    new_mean = _bisect_numpy(lambda x: w0 * x + tanhs(x), w0 * p0)
+
+    # Display a slightly lower rating to incentivize participation.
+    # As times_ranked increases, new_rating converges to new_mean.
+    new_rating = np.maximum(1, np.round(new_mean - (np.sqrt(var[times_ranked + 1]) - SD_LIM)))
+
+    return new_rating.astype(int).tolist(), new_mean.tolist(), new_p.tolist()
+
+
+recalculate_ratings = recalculate_ratings_numpy if np is not None else recalculate_ratings_python
+
+
+def rated_participations(contest):
+    """
+    Returns the participations of a contest that can be rated, in rank order, leaving out those that the rating
+    floor and ceiling exclude, as these depend on the ratings before the contest.
+    """
+    users = contest.users.order_by('is_disqualified', '-score', 'cumtime', 'tiebreaker') \
+        .annotate(submissions=Count('submission')) \
+        .exclude(user_id__in=contest.rate_exclude.all()) \
+        .filter(virtual=0)
+    if not contest.rate_all:
+        users = users.filter(submissions__gt=0)
+    if not contest.rate_disqualified:
+        users = users.filter(is_disqualified=False)
+    return users
+
+
 def rate_contest(contest):
     from judge.models import Rating, Profile
 
     rating_subquery = Rating.objects.filter(user=OuterRef('user'))
     rating_sorted = rating_subquery.order_by('-contest__end_time')
-    users = contest.users.order_by('is_disqualified', '-score', 'cumtime', 'tiebreaker') \
-        .annotate(submissions=Count('submission'),
-                  last_rating=Coalesce(Subquery(rating_sorted.values('rating')[:1]), RATING_INIT),
+    users = rated_participations(contest) \
+        .annotate(last_rating=Coalesce(Subquery(rating_sorted.values('rating')[:1]), RATING_INIT),
                   last_mean=Coalesce(Subquery(rating_sorted.values('mean')[:1]), MEAN_INIT),
                   times=Coalesce(Subquery(rating_subquery.order_by().values('user_id')
                                           .annotate(count=Count('id')).values('count')), 0)) \
-        .exclude(user_id__in=contest.rate_exclude.all()) \
-        .filter(virtual=0).values('id', 'user_id', 'score', 'cumtime', 'tiebreaker', 'last_mean', 'times')
-    if not contest.rate_all:
-        users = users.filter(submissions__gt=0)
-    if not contest.rate_disqualified:
-        users = users.filter(is_disqualified=False)
+        .values('id', 'user_id', 'score', 'cumtime', 'tiebreaker', 'last_mean', 'times')
     if contest.rating_floor is not None:
         users = users.exclude(last_rating__lt=contest.rating_floor)
     if contest.rating_ceiling is not None:
@@ -190,6 +314,94 @@ def rate_contest(contest):
                             .order_by('-contest__end_time').values('rating')[:1]))
 
 
+# Rows written at once by rebuild_ratings.
+REBUILD_CHUNK_SIZE = 1000
+
+
+class RatingHistory:
+    __slots__ = ('rating', 'mean', 'performances')
+
+    def __init__(self):
+        self.rating = RATING_INIT
+        self.mean = MEAN_INIT
+        # In order of contest end time, oldest first.
+        self.performances = []
+
+
+def rebuild_ratings(since=None, progress=None):
+    """
+    Replaces the ratings of every rated contest that ended since `since`, or of all of them, by rating them again in
+    order of end time. The rating history of every user is carried forward in memory instead of being queried for
+    each contest, and the ratings and profiles are written in bulk.
+
+    `progress` is called with the number of contests rated so far and the total. Returns the contests rated.
+    """
+    from judge.models import Contest, ContestParticipation, Profile, Rating
+
+    now = timezone.now()
+    contests = Contest.objects.filter(is_rated=True, end_time__lte=now).order_by('end_time') \
+                              .prefetch_related('rate_exclude')
+    replaced = Rating.objects.all()
+    history = defaultdict(RatingHistory)
+    if since is not None:
+        contests = contests.filter(end_time__gte=since)
+        replaced = replaced.filter(contest__end_time__range=(since, now))
+        # Only the history of those rated again, or whose ratings are replaced, is needed.
+        users = Q(user_id__in=ContestParticipation.objects.filter(contest__in=contests).values('user_id')) | \
+            Q(user_id__in=replaced.values('user_id'))
+        for user_id, rating, mean, performance in Rating.objects.filter(users, contest__end_time__lt=since) \
+                .order_by('contest__end_time').values_list('user_id', 'rating', 'mean', 'performance') \
+                .iterator(chunk_size=REBUILD_CHUNK_SIZE):
+            user = history[user_id]
+            user.rating, user.mean = rating, mean
+            user.performances.append(performance)
+
+    contests = list(contests)
+    with transaction.atomic():
+        changed_users = set(replaced.values_list('user_id', flat=True).distinct())
+        replaced.delete()
+
+        ratings = []
+        for done, contest in enumerate(contests):
+            if progress is not None:
+                progress(done, len(contests))
+
+            users = rated_participations(contest).values_list('id', 'user_id', 'score', 'cumtime', 'tiebreaker')
+            users = [user for user in users
+                     if (contest.rating_floor is None or history[user[1]].rating >= contest.rating_floor) and
+                     (contest.rating_ceiling is None or history[user[1]].rating <= contest.rating_ceiling)]
+            users_history = [history[user[1]] for user in users]
+
+            ranking = list(tie_ranker(users, key=itemgetter(2, 3, 4)))
+            rating, mean, performance = recalculate_ratings(
+                ranking,
+                [user.mean for user in users_history],
+                [len(user.performances) for user in users_history],
+                [user.performances[::-1] for user in users_history],
+            )
+
+            for (pid, user_id, *_), user, r, m, perf, z in zip(users, users_history, rating, mean, performance,
+                                                               ranking):
+                user.rating, user.mean = r, m
+                user.performances.append(perf)
+                ratings.append(Rating(user_id=user_id, contest=contest, rating=r, mean=m, performance=perf,
+                                      last_rated=now, participation_id=pid, rank=z))
+                changed_users.add(user_id)
+
+            if len(ratings) >= REBUILD_CHUNK_SIZE:
+                Rating.objects.bulk_create(ratings, batch_size=REBUILD_CHUNK_SIZE)
+                ratings = []
+        Rating.objects.bulk_create(ratings, batch_size=REBUILD_CHUNK_SIZE)
+
+        profiles = [Profile(id=user_id, rating=history[user_id].rating if history[user_id].performances else None)
+                    for user_id in changed_users]
+        Profile.objects.bulk_update(profiles, ['rating'], batch_size=REBUILD_CHUNK_SIZE)
+
+    if progress is not None:
+        progress(len(contests), len(contests))
+    return contests
+
+
 RATING_LEVELS = ['Newbie', 'Pupil', 'Specialist', 'Expert', 'Candidate Master', 'Master', 'International Master',
                  'Grandmaster', 'International Grandmaster', 'Legendary Grandmaster']
 RATING_VALUES = [1200, 1400, 1600, 1900, 2200, 2300, 2400, 2600, 2900]
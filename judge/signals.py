@@ -13,10 +13,11 @@ from registration.models import RegistrationProfile
 from registration.signals import user_registered
 
 from judge.caching import finished_submission
-from judge.models import BlogPost, Comment, Contest, ContestAnnouncement, ContestProblem, ContestSubmission, \
-    EFFECTIVE_MATH_ENGINES, Judge, Language, License, MiscConfig, Organization, Problem, Profile, Submission, \
-    WebAuthnCredential
+from judge.models import BlogPost, Comment, Contest, ContestAnnouncement, ContestParticipation, ContestProblem, \
+    ContestSubmission, EFFECTIVE_MATH_ENGINES, Judge, Language, License, MiscConfig, Organization, Problem, Profile, \
+    Submission, WebAuthnCredential
 from judge.tasks import on_new_comment
+from judge.utils.scoreboard import scoreboard_changed
 from judge.views.register import RegistrationView
 
 
@@ -82,6 +83,18 @@ def contest_update(sender, instance, **kwargs):
     cache.delete_many(['generated-meta-contest:%d' % instance.id] +
                       [make_template_fragment_key('contest_html', (instance.id, engine))
                        for engine in EFFECTIVE_MATH_ENGINES])
+    scoreboard_changed(instance.id)
+
+
+@receiver(post_save, sender=ContestProblem)
+def contest_problem_update(sender, instance, **kwargs):
+    scoreboard_changed(instance.contest_id)
+
+
+@receiver(post_save, sender=ContestParticipation)
+@receiver(post_delete, sender=ContestParticipation)
+def contest_participation_update(sender, instance, **kwargs):
+    scoreboard_changed(instance.contest_id, [instance.id])
 
 
 @receiver(post_delete, sender=ContestProblem)
@@ -89,6 +102,7 @@ def contest_problem_delete(sender, instance, **kwargs):
     # `contest_object` is the `Contest` object indirectly associated with the `Submission` object
     # `contest` is the `ContestSubmission` object associated with the `Submission` object
     Submission.objects.filter(contest_object=instance.contest, contest__isnull=True).update(contest_object=None)
+    scoreboard_changed(instance.contest_id)
 
 
 @receiver(post_save, sender=License)
@@ -4,38 +4,93 @@ import logging
 import os
 import re
 import zipfile
+from datetime import timedelta
+from itertools import islice
 
 from celery import shared_task
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.core.files.storage import default_storage
+from django.utils import timezone, translation
 from django.utils.translation import gettext as _
 from moss import MOSS
 
 from judge.models import Contest, ContestAnnouncement, ContestMoss, ContestParticipation, ContestSubmission, \
     Notification, Problem, Submission, make_notification
+from judge.ratings import rebuild_ratings
 from judge.utils.celery import Progress
 
-__all__ = ('rescore_contest', 'run_moss', 'prepare_contest_data', 'send_contest_announcement')
+__all__ = ('rescore_contest', 'refresh_contest_ranking', 'rate_all_contests', 'build_contest_replay',
+           'build_ended_contest_replays', 'run_moss', 'prepare_contest_data', 'send_contest_announcement')
 rewildcard = re.compile(r'\*+')
 logger = logging.getLogger('judge.celery')
 
+# Participations rescored together by rescore_contest, in a few queries and one bulk update.
+RESCORE_CHUNK_SIZE = 500
+# How long after a contest ended build_ended_contest_replays still writes its replay data if it is missing.
+REPLAY_BUILD_WINDOW = timedelta(days=1)
+
 
 @shared_task(bind=True)
 def rescore_contest(self, contest_key):
     contest = Contest.objects.get(key=contest_key)
-    participations = contest.users
+    participations = contest.users.all()
 
     rescored = 0
     with Progress(self, participations.count(), stage=_('Recalculating contest scores')) as p:
-        for participation in participations.iterator():
-            participation.recompute_results()
-            rescored += 1
-            if rescored % 10 == 0:
-                p.done = rescored
+        iterator = participations.iterator(chunk_size=RESCORE_CHUNK_SIZE)
+        while True:
+            chunk = list(islice(iterator, RESCORE_CHUNK_SIZE))
+            if not chunk:
+                break
+            ContestParticipation.recompute_results_bulk(contest, chunk)
+            rescored += len(chunk)
+            p.done = rescored
     return rescored
 
 
+@shared_task
+def refresh_contest_ranking(contest_key, show_virtual, frozen, language):
+    # The ranking JSON is built by the view that serves it.
+    from judge.views.contests import refresh_contest_ranking_cache
+
+    contest = Contest.objects.get(key=contest_key)
+    with translation.override(language):
+        refresh_contest_ranking_cache(contest, show_virtual, frozen, language)
+
+
+@shared_task(bind=True)
+def rate_all_contests(self):
+    with Progress(self, Contest.objects.filter(is_rated=True).count(), stage=_('Rating contests')) as p:
+        def progress(done, total):
+            if p.total != total:
+                p.total = total
+            p.done = done
+
+        return len(rebuild_ratings(progress=progress))
+
+
+@shared_task
+def build_contest_replay(contest_key):
+    # The replay data is written by the view that serves it.
+    from judge.views.contests import contest_replay_data_path, stream_contest_replay_data
+
+    contest = Contest.objects.get(key=contest_key)
+    if contest.can_replay and not os.path.exists(contest_replay_data_path(contest)[0]):
+        stream_contest_replay_data(contest)
+
+
+@shared_task
+def build_ended_contest_replays():
+    from judge.views.contests import contest_replay_data_path, schedule_contest_replay_data
+
+    now = timezone.now()
+    for contest in Contest.objects.filter(end_time__range=(now - REPLAY_BUILD_WINDOW, now)):
+        # Through the same lock as the view, so that a build outlasting the schedule is not started again.
+        if contest.can_replay and not os.path.exists(contest_replay_data_path(contest)[0]):
+            schedule_contest_replay_data(contest)
+
+
 @shared_task(bind=True)
 def run_moss(self, contest_key):
     moss_api_key = settings.MOSS_API_KEY
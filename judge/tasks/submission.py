@@ -1,4 +1,5 @@
 from celery import shared_task
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.utils import timezone
@@ -6,6 +7,7 @@ from django.utils.translation import gettext as _
 
 from judge.models import Problem, Profile, Submission
 from judge.utils.celery import Progress
+from judge.utils.iterator import chunk
 
 __all__ = ('apply_submission_filter', 'rejudge_problem_filter', 'rescore_problem')
 
@@ -31,11 +33,11 @@ def rejudge_problem_filter(self, problem_id, id_range=None, languages=None, resu
 
     rejudged = 0
     with Progress(self, queryset.count()) as p:
-        for submission in queryset.iterator():
-            submission.judge(rejudge=True, batch_rejudge=True, rejudge_user=user)
-            rejudged += 1
-            if rejudged % 10 == 0:
-                p.done = rejudged
+        submissions = queryset.select_related('problem', 'language', 'source').iterator()
+        for submissions in chunk(submissions, settings.BRIDGED_DJANGO_BATCH_SIZE):
+            Submission.judge_many(submissions, rejudge=True, batch_rejudge=True, rejudge_user=user)
+            rejudged += len(submissions)
+            p.done = rejudged
     return rejudged
 
 
@@ -1,6 +1,7 @@
 from datetime import timedelta
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.test import TestCase, override_settings
 from django.utils import timezone
 
@@ -15,6 +16,7 @@ from judge.models import (
     Profile,
     Submission,
 )
+from judge.utils.scoreboard import LiveScoreboard
 
 
 @override_settings(GLOBAL_API_KEY='test-api-key-123')
@@ -153,6 +155,11 @@ class ContestSyncAPITestCase(TestCase):
         cls.old_submission.judged_date = base_time - timedelta(days=1)
         cls.old_submission.save(update_fields=['date', 'judged_date'])
 
+    def setUp(self):
+        cache.clear()
+        LiveScoreboard.clear()
+        self.addCleanup(LiveScoreboard.clear)
+
     def test_requires_api_key(self):
         endpoints = [
             '/api/v2/sync/contest/icpc-2025',
@@ -235,6 +242,105 @@ class ContestSyncAPITestCase(TestCase):
         self.assertEqual(response.status_code, 400)
         self.assertIn('error', response.json())
 
+    def test_not_modified(self):
+        endpoints = [
+            '/api/v2/sync/contest/icpc-2025',
+            '/api/v2/sync/contest/icpc-2025/problems',
+            '/api/v2/sync/contest/icpc-2025/participants',
+            '/api/v2/sync/contest/icpc-2025/submissions?from_timestamp=2020-01-01T00:00:00Z',
+        ]
+        for endpoint in endpoints:
+            with self.subTest(endpoint=endpoint):
+                response = self.client.get(endpoint, headers={'X-Global-API-Key': 'test-api-key-123'})
+                self.assertEqual(response.status_code, 200)
+                response = self.client.get(endpoint, headers={'X-Global-API-Key': 'test-api-key-123',
+                                                              'If-None-Match': response['ETag']})
+                self.assertEqual(response.status_code, 304)
+
+    def test_submissions_cursor(self):
+        url = '/api/v2/sync/contest/icpc-2025/submissions?from_timestamp=2020-01-01T00:00:00Z&status=all&limit=1'
+        ids = []
+        for _ in range(4):
+            response = self.client.get(url, headers={'X-Global-API-Key': 'test-api-key-123'})
+            self.assertEqual(response.status_code, 200)
+            ids += [entry['id'] for entry in response.json()]
+            url = response['Link'].split(';')[0].strip('<>')
+            self.assertIn('limit=1', url)
+        self.assertEqual(ids, [str(self.old_submission.id), str(self.final_submission.id),
+                               str(self.processing_submission.id)])
+
+        # Past the end, the next link stays where it is until more submissions are judged.
+        self.assertEqual(response.json(), [])
+        response = self.client.get(url, headers={'X-Global-API-Key': 'test-api-key-123'})
+        self.assertEqual(response['Link'].split(';')[0].strip('<>'), url)
+
+    def test_submissions_graded_out_of_order(self):
+        url = '/api/v2/sync/contest/icpc-2025/submissions?from_timestamp=2020-01-01T00:00:00Z'
+        fast = Submission.objects.create(
+            user=self.team_foo_profile,
+            problem=self.problem_a,
+            language=self.language,
+            status='D',
+            result='AC',
+            points=100,
+            contest_object=self.contest,
+        )
+        # Graded after the processing submission began grading, but done before it.
+        fast.judged_date = self.processing_submission.judged_date + timedelta(seconds=1)
+        fast.save(update_fields=['judged_date'])
+
+        response = self.client.get(url, headers={'X-Global-API-Key': 'test-api-key-123'})
+        self.assertEqual([entry['id'] for entry in response.json()],
+                         [str(self.old_submission.id), str(self.final_submission.id)])
+        url = response['Link'].split(';')[0].strip('<>')
+
+        Submission.objects.filter(id=self.processing_submission.id).update(status='D', result='WA')
+        response = self.client.get(url, headers={'X-Global-API-Key': 'test-api-key-123'})
+        self.assertEqual([entry['id'] for entry in response.json()],
+                         [str(self.processing_submission.id), str(fast.id)])
+
+    def test_submissions_invalid_cursor(self):
+        response = self.client.get(
+            '/api/v2/sync/contest/icpc-2025/submissions',
+            {'cursor': 'not-a-cursor'},
+            headers={'X-Global-API-Key': 'test-api-key-123'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_participants_since(self):
+        url = '/api/v2/sync/contest/icpc-2025/participants'
+        headers = {'X-Global-API-Key': 'test-api-key-123'}
+        response = self.client.get(url, headers=headers)
+        version = response['X-Ranking-Version']
+
+        team_bar = ContestParticipation.objects.get(contest=self.contest, user=self.team_bar_profile)
+        team_bar.score = 600
+        with self.captureOnCommitCallbacks(execute=True):
+            team_bar.save()
+        response = self.client.get(url, {'since': version}, headers=headers)
+        self.assertEqual(response.json(), {
+            'since': int(version),
+            'version': int(response['X-Ranking-Version']),
+            'participants': [
+                {'user': 'team_bar', 'contest': 'icpc-2025', 'rank': 1},
+                {'user': 'team_foo', 'contest': 'icpc-2025', 'rank': 2},
+            ],
+            'removed': [],
+        })
+
+        version = response['X-Ranking-Version']
+        team_foo = ContestParticipation.objects.get(contest=self.contest, user=self.team_foo_profile)
+        team_foo.is_disqualified = True
+        with self.captureOnCommitCallbacks(execute=True):
+            team_foo.save()
+        response = self.client.get(url, {'since': version}, headers=headers)
+        self.assertEqual(response.json()['participants'], [])
+        self.assertEqual(response.json()['removed'], ['team_foo'])
+
+        # The ranks of versions no longer known are sent in full.
+        response = self.client.get(url, {'since': 12345}, headers=headers)
+        self.assertEqual(response.json(), [{'user': 'team_bar', 'contest': 'icpc-2025', 'rank': 1}])
+
     def test_global_api_key_authentication_header(self):
         """Test API access using X-Global-API-Key header"""
         with self.settings(GLOBAL_API_KEY='test-api-key-123'):
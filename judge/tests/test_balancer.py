@@ -0,0 +1,115 @@
+from collections import Counter
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from judge.balancer.balancer import JudgeBalancer
+from judge.balancer.fair_queue import FairQueue
+
+
+class MockJudge:
+    def __init__(self, name, load=0, cpu_count=1):
+        self.name = name
+        self.load = load
+        self.cpu_count = cpu_count
+        self.current_submission_id = None
+        self.submissions = []
+
+    @property
+    def working(self):
+        return bool(self.current_submission_id)
+
+    def submit(self, packet):
+        self.current_submission_id = packet['submission-id']
+        self.submissions.append(packet['submission-id'])
+
+    def disconnect(self, force=False):
+        pass
+
+
+class FairQueueTestCase(SimpleTestCase):
+    def drain(self, queue, count):
+        return [queue.pop()[0] for _ in range(count)]
+
+    def test_backlog_does_not_starve_other_keys(self):
+        queue = FairQueue()
+        for i in range(100):
+            queue.push('mass', i)
+        queue.push('other', 0)
+        queue.push('other', 1)
+        self.assertEqual(self.drain(queue, 4), ['mass', 'other', 'mass', 'other'])
+
+    def test_weights(self):
+        queue = FairQueue()
+        queue.configure('big', 3)
+        for i in range(100):
+            queue.push('big', i)
+            queue.push('small', i)
+        self.assertEqual(Counter(self.drain(queue, 40)), {'big': 30, 'small': 10})
+
+    def test_idle_key_gets_no_credit(self):
+        queue = FairQueue()
+        for i in range(10):
+            queue.push('busy', i)
+        self.drain(queue, 5)
+        for i in range(3):
+            queue.push('idle', i)
+        # Alternating from here on, rather than catching up on the five submissions it was not around for.
+        self.assertEqual(self.drain(queue, 6), ['idle', 'busy', 'idle', 'busy', 'idle', 'busy'])
+
+    def test_ineligible_keys_are_skipped(self):
+        queue = FairQueue()
+        queue.push('a', 1)
+        self.assertIsNone(queue.pop(lambda key: key != 'a'))
+        self.assertEqual(queue.pop(), ('a', 1))
+        self.assertIsNone(queue.pop())
+
+
+class JudgeBalancerTestCase(SimpleTestCase):
+    def setUp(self):
+        config = {'bridges': [
+            {'host': 'a.example', 'port': 9999, 'id': 'a1', 'key': 'k', 'weight': 2},
+            {'host': 'a.example', 'port': 9999, 'id': 'a2', 'key': 'k'},
+            {'host': 'a.example', 'port': 9999, 'id': 'a3', 'key': 'k'},
+            {'host': 'b.example', 'port': 9999, 'id': 'b1', 'key': 'k', 'max_judges': 1},
+            {'host': 'b.example', 'port': 9999, 'id': 'b2', 'key': 'k'},
+        ]}
+        with mock.patch('judge.balancer.balancer.Server'), mock.patch('judge.balancer.balancer.BridgeHandler'):
+            self.balancer = JudgeBalancer(config)
+
+    def submit(self, bridge_id, id):
+        self.balancer.queue_submission(bridge_id, {'submission-id': id})
+
+    def test_least_loaded_judge_first(self):
+        small = MockJudge('small', load=0.5, cpu_count=2)
+        big = MockJudge('big', load=0.5, cpu_count=16)
+        idle = MockJudge('idle', load=0.1, cpu_count=1)
+        for judge in (small, big, idle):
+            self.balancer.register_judge(judge)
+
+        self.submit(0, 1)
+        self.submit(1, 2)
+        self.submit(2, 3)
+        self.assertEqual((idle.submissions, big.submissions, small.submissions), ([1], [2], [3]))
+
+    def test_cap_per_bridge(self):
+        self.submit(3, 1)
+        self.submit(4, 2)
+        self.submit(0, 3)
+        for name in ('x', 'y', 'z'):
+            self.balancer.register_judge(MockJudge(name))
+
+        self.assertEqual(sorted(self.balancer.bridge_to_judge), [0, 3])
+        self.balancer.free_judge(self.balancer.bridge_to_judge[3])
+        self.assertEqual(sorted(self.balancer.bridge_to_judge), [0, 4])
+
+    def test_weight_per_bridge(self):
+        for id, bridge_id in enumerate((0, 1, 2, 3)):
+            self.submit(bridge_id, id)
+        judge = MockJudge('judge')
+        self.balancer.register_judge(judge)
+        for _ in range(3):
+            judge.current_submission_id = None
+            self.balancer.free_judge(judge)
+        # Bridges 0 to 2 connect to the same site, which has twice the weight of the other.
+        self.assertEqual(judge.submissions, [0, 3, 1, 2])
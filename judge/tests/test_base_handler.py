@@ -0,0 +1,74 @@
+import socket
+import struct
+import threading
+import zlib
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from judge.bridge import base_handler
+from judge.bridge.base_handler import ZlibPacketHandler
+
+size_pack = struct.Struct('!I')
+
+
+class RecordingHandler(ZlibPacketHandler):
+    def __init__(self, request, client_address):
+        super().__init__(request, client_address, mock.Mock(server_address=('127.0.0.1', 9999)))
+        self.packets = []
+
+    def on_packet(self, data):
+        self.packets.append(data.decode('utf-8'))
+
+
+def packet(data):
+    compressed = zlib.compress(data.encode('utf-8'))
+    return size_pack.pack(len(compressed)) + compressed
+
+
+class ZlibPacketHandlerTestCase(SimpleTestCase):
+    def receive(self, *chunks, client_address=('127.0.0.1', 12345)):
+        server, client = socket.socketpair()
+        self.addCleanup(server.close)
+
+        def send():
+            # Separate sends, to split packets at awkward places.
+            for chunk in chunks:
+                client.sendall(chunk)
+            client.close()
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        handler = RecordingHandler.__new__(RecordingHandler)
+        handler.__init__(server, client_address)
+        handler.handle()
+        thread.join()
+        return handler
+
+    def test_packets(self):
+        data = packet('first') + packet('second')
+        handler = self.receive(*(data[i:i + 3] for i in range(0, len(data), 3)))
+        self.assertEqual(handler.packets, ['first', 'second'])
+
+    @mock.patch.object(base_handler, 'READ_BUFFER_SIZE', 16)
+    def test_packet_larger_than_buffer(self):
+        data = ''.join(map(str, range(10000)))
+        handler = self.receive(packet(data), packet('after'))
+        self.assertEqual(handler.packets, [data, 'after'])
+
+    @mock.patch.object(RecordingHandler, 'proxies', ['127.0.0.1'])
+    def test_proxy_protocol(self):
+        data = b'PROXY TCP4 10.0.0.1 10.0.0.2 1234 9999\r\n' + packet('first') + packet('second')
+        handler = self.receive(data[:60], data[60:])
+        self.assertEqual(handler.packets, ['first', 'second'])
+        self.assertEqual(handler.client_address, ('10.0.0.1', '1234'))
+
+    def test_peer_closes_mid_packet(self):
+        handler = self.receive(packet('first'), packet('second')[:-2])
+        self.assertEqual(handler.packets, ['first'])
+
+    def test_truncated_stream(self):
+        compressed = zlib.compress(b'truncated')[:-4]
+        with self.assertLogs('judge.bridge', 'WARNING'):
+            handler = self.receive(packet('first'), size_pack.pack(len(compressed)) + compressed, packet('after'))
+        self.assertEqual(handler.packets, ['first'])
@@ -0,0 +1,87 @@
+from django.test import TestCase
+from django.utils import timezone
+
+from judge.bridge.daemon import recover_queue
+from judge.bridge.judge_list import JudgeList
+from judge.judge_priority import BATCH_REJUDGE_PRIORITY, CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY
+from judge.models import ContestParticipation, ContestSubmission, Judge, Language, Submission, SubmissionSource, \
+    SubmissionTestCase
+from judge.models.tests.util import create_contest, create_contest_participation, create_contest_problem, \
+    create_problem, create_user
+
+
+class RecoverQueueTestCase(TestCase):
+    fixtures = ['language_all.json']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.profile = create_user(username='normal').profile
+        cls.problem = create_problem(code='recover')
+        cls.contest = create_contest(key='recover')
+        cls.contest.banned_judges.add(Judge.objects.create(name='banned', auth_key='key'))
+        cls.contest_problem = create_contest_problem(contest=cls.contest, problem=cls.problem)
+
+    def setUp(self):
+        self.judges = JudgeList()
+
+    def submit(self, status='QU', participation=None, **kwargs):
+        submission = Submission.objects.create(user=self.profile, problem=self.problem, status=status,
+                                               language=Language.get_python3(), **kwargs)
+        SubmissionSource.objects.create(submission=submission, source='print(%d)' % submission.id)
+        if participation is not None:
+            ContestSubmission.objects.create(submission=submission, problem=self.contest_problem,
+                                             participation=participation)
+        return submission
+
+    def queued(self, submission):
+        key, node = self.judges.queue.node_map[submission.id]
+        return node.value
+
+    def test_only_unfinished_submissions_are_recovered(self):
+        submissions = [self.submit(status) for status in ('QU', 'D', 'P', 'IE', 'G', 'QU')]
+        self.assertEqual(recover_queue(self.judges, chunk_size=2), 4)
+        self.assertEqual(sorted(self.judges.queue.node_map),
+                         [submission.id for submission in submissions if submission.status in ('QU', 'P', 'G')])
+
+    def test_queued_submission(self):
+        submission = self.submit()
+        recover_queue(self.judges)
+        queued = self.queued(submission)
+        self.assertEqual((queued.problem, queued.language), ('recover', 'PY3'))
+        self.assertEqual(queued.source, 'print(%d)' % submission.id)
+        self.assertEqual(queued.priority, DEFAULT_PRIORITY)
+        self.assertEqual(queued.banned_judges, ())
+
+    def test_started_submission_starts_over(self):
+        submission = self.submit('G', current_testcase=3)
+        SubmissionTestCase.objects.create(submission=submission, case=1, status='AC')
+        recover_queue(self.judges)
+        self.assertIn(submission.id, self.judges.queue)
+        submission.refresh_from_db()
+        self.assertEqual((submission.status, submission.current_testcase), ('QU', 0))
+        self.assertFalse(SubmissionTestCase.objects.filter(submission=submission).exists())
+
+    def test_only_given_submissions_are_recovered(self):
+        graded_elsewhere, stopped = self.submit('G'), self.submit('P')
+        self.submit('QU')
+        self.assertEqual(recover_queue(self.judges, ids=[graded_elsewhere.id, stopped.id],
+                                       exclude=[graded_elsewhere.id]), 1)
+        self.assertEqual(list(self.judges.queue.node_map), [stopped.id])
+        graded_elsewhere.refresh_from_db()
+        stopped.refresh_from_db()
+        self.assertEqual((graded_elsewhere.status, stopped.status), ('G', 'QU'))
+
+    def test_priorities(self):
+        live = create_contest_participation(contest=self.contest, user=self.profile)
+        virtual = ContestParticipation.objects.create(contest=self.contest, user=self.profile, virtual=1)
+        in_contest = self.submit(participation=live)
+        in_virtual = self.submit(participation=virtual)
+        rejudged = self.submit(participation=live, rejudged_date=timezone.now())
+        recover_queue(self.judges)
+
+        self.assertEqual(self.queued(in_contest).priority, CONTEST_SUBMISSION_PRIORITY)
+        self.assertEqual(self.queued(in_contest).banned_judges, ('banned',))
+        self.assertEqual(self.queued(in_virtual).priority, CONTEST_SUBMISSION_PRIORITY)
+        self.assertEqual(self.queued(in_virtual).banned_judges, ())
+        self.assertEqual(self.queued(rejudged).priority, BATCH_REJUDGE_PRIORITY)
+        self.assertEqual(self.queued(rejudged).banned_judges, ('banned',))
@@ -0,0 +1,60 @@
+import threading
+import urllib.error
+import urllib.request
+from functools import partial
+
+from django.test import SimpleTestCase
+
+from judge.bridge.judge_list import JudgeList
+from judge.bridge.metrics import Histogram, MetricsHandler
+from judge.bridge.server import Server
+
+
+class HistogramTestCase(SimpleTestCase):
+    def test_quantiles(self):
+        histogram = Histogram()
+        for value in [0.003] * 98 + [0.2, 7]:
+            histogram.observe(value)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['mean'], 0.07494)
+        self.assertEqual(summary['p50'], 0.005)
+        self.assertEqual(summary['p99'], 0.25)
+        self.assertEqual(summary['max'], 7)
+
+    def test_quantile_capped_by_max(self):
+        histogram = Histogram()
+        histogram.observe(2000)
+        self.assertEqual(histogram.quantile(0.5), 2000)
+        self.assertIsNone(Histogram().quantile(0.5))
+
+
+class MetricsHandlerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.judges = JudgeList()
+        self.server = Server([('127.0.0.1', 0)], partial(MetricsHandler, judges=self.judges))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://%s:%d' % self.server.servers[0].server_address
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        for listener in self.server.servers:
+            listener.server_close()
+
+    def test_metrics(self):
+        self.judges.metrics.observe('dispatch', 0.02)
+        with urllib.request.urlopen(self.url + '/metrics') as response:
+            self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+            text = response.read().decode('utf-8')
+        self.assertIn('bridge_queue_size{priority="0"} 0.0\n', text)
+        self.assertIn('bridge_dispatch_seconds_bucket{le="0.01"} 0.0\n', text)
+        self.assertIn('bridge_dispatch_seconds_bucket{le="0.025"} 1.0\n', text)
+        self.assertIn('bridge_dispatch_seconds_bucket{le="+Inf"} 1.0\n', text)
+        self.assertIn('bridge_dispatch_seconds_count 1.0\n', text)
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            urllib.request.urlopen(self.url + '/')
+        self.assertEqual(context.exception.code, 404)
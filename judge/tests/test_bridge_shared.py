@@ -0,0 +1,216 @@
+import json
+from unittest import mock, skipIf
+
+from django.test import SimpleTestCase, override_settings
+
+from judge.bridge.shared import SharedJudgeList, SharedStore
+from judge.judge_priority import BATCH_REJUDGE_PRIORITY, DEFAULT_PRIORITY
+from judge.tests.test_judge_list import MockJudge
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@skipIf(fakeredis is None, 'fakeredis is not installed')
+class SharedJudgeListTestCase(SimpleTestCase):
+    def setUp(self):
+        self.server = server = fakeredis.FakeServer()
+        self.first = self.instance(server, 'first', ('127.0.0.1', 1))
+        self.second = self.instance(server, 'second', ('127.0.0.1', 2))
+
+    def instance(self, server, name, address):
+        store = SharedStore(fakeredis.FakeRedis(server=server, decode_responses=True), name)
+        store.heartbeat(address)
+        return SharedJudgeList(store)
+
+    def submit(self, judges, id, priority=DEFAULT_PRIORITY, judge_id=None):
+        judges.judge(id, 'problem', 'lang', 'source', judge_id, priority)
+
+    def test_queued_by_one_instance_dispatched_by_another(self):
+        judge = MockJudge('judge')
+        self.second.register(judge)
+        self.submit(self.second, 100)
+
+        self.submit(self.first, 1)
+        self.assertIn(1, self.second.queue)
+        self.assertEqual(self.second.queue.sizes[DEFAULT_PRIORITY], 1)
+
+        self.second.on_judge_free(judge, 100)
+        self.assertEqual(judge.submissions, [100, 1])
+        self.assertEqual(self.first.peer_for_submission(1), ('127.0.0.1', 2))
+        self.assertIsNone(self.second.peer_for_submission(1))
+        self.assertEqual(len(self.first.queue), 0)
+        self.assertEqual(self.first.queue.sizes, [0, 0, 0, 0])
+
+    def test_only_one_instance_claims_a_submission(self):
+        first, second = MockJudge('first'), MockJudge('second')
+        self.first.register(first)
+        self.second.register(second)
+        self.submit(self.first, 100)
+        self.submit(self.second, 101)
+
+        self.submit(self.first, 1)
+        candidate = self.first.queue._first_for(first, DEFAULT_PRIORITY)
+        self.assertEqual(self.second.queue.next_for(second, lambda: False).id, 1)
+        self.assertFalse(self.first.queue._pop(candidate))
+        self.assertIsNone(self.first.queue.next_for(first, lambda: False))
+
+    def test_submission_being_graded_elsewhere_is_not_queued(self):
+        judge = MockJudge('judge')
+        self.second.register(judge)
+
+        self.submit(self.second, 1)
+        self.submit(self.first, 1)
+        self.assertNotIn(1, self.first.queue)
+
+        self.second.on_judge_free(judge, 1)
+        self.assertIsNone(self.first.peer_for_submission(1))
+
+    def test_submission_is_sent_once(self):
+        first, second = MockJudge('first'), MockJudge('second')
+        self.first.register(first)
+        self.second.register(second)
+
+        self.submit(self.second, 1)
+        # As if the first instance looked before the second claimed it.
+        with mock.patch.object(self.first.store, 'grading_owner', return_value=None), \
+                self.assertLogs('judge.bridge', 'ERROR'):
+            self.submit(self.first, 1)
+        self.assertEqual(first.submissions, [])
+        self.assertEqual(second.submissions, [1])
+        self.assertEqual(self.first.peer_for_submission(1), ('127.0.0.1', 2))
+
+    def test_removed_submission_is_skipped(self):
+        judge = MockJudge('judge')
+        self.second.register(judge)
+        self.submit(self.second, 100)
+
+        self.submit(self.first, 1)
+        self.submit(self.first, 2)
+        self.assertFalse(self.first.abort(1))
+        self.assertEqual(len(self.second.queue), 1)
+        self.assertEqual(self.second.queue.oldest(DEFAULT_PRIORITY).id, 2)
+
+        self.second.on_judge_free(judge, 100)
+        self.assertEqual(judge.submissions, [100, 2])
+        self.assertIsNone(self.second.queue.oldest(DEFAULT_PRIORITY))
+
+    def test_failed_dispatch_is_released(self):
+        judge = MockJudge('judge')
+        self.second.register(judge)
+        self.submit(self.second, 100)
+
+        self.submit(self.first, 1)
+        self.submit(self.first, 2)
+        with mock.patch.object(judge, 'submit', side_effect=OSError), self.assertLogs('judge.bridge', 'ERROR'):
+            self.second.on_judge_free(judge, 100)
+        self.assertEqual(len(self.first.queue), 2)
+        self.assertEqual(self.first.queue.oldest(DEFAULT_PRIORITY).id, 1)
+
+    def test_priorities_and_banned_judges(self):
+        judge = MockJudge('judge')
+        self.second.register(judge)
+        self.submit(self.second, 100)
+
+        self.first.judge(1, 'problem', 'lang', 'source', None, DEFAULT_PRIORITY, ['judge'])
+        self.submit(self.first, 2, BATCH_REJUDGE_PRIORITY)
+        self.submit(self.first, 3)
+        self.assertEqual(self.second.queue.sizes, [0, 2, 0, 1])
+
+        self.second.on_judge_free(judge, 100)
+        self.assertEqual(judge.submissions, [100, 3])
+        self.second.on_judge_free(judge, 3)
+        self.assertEqual(judge.submissions, [100, 3, 2])
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=True)
+    def test_queued_submission_of_warm_problem_first(self):
+        judge = MockJudge('judge')
+        judge.problems = {'a', 'b'}
+        self.second.register(judge)
+        self.second.judge(100, 'a', 'lang', 'source', None, DEFAULT_PRIORITY)
+
+        self.first.judge(1, 'b', 'lang', 'source', None, DEFAULT_PRIORITY)
+        self.first.judge(2, 'a', 'lang', 'source', None, DEFAULT_PRIORITY)
+        self.second.on_judge_free(judge, 100)
+        self.assertEqual(judge.submissions, [100, 2])
+
+    def test_tiers_apply_across_instances(self):
+        backup = MockJudge('backup')
+        backup.tier = 1
+        self.first.register(backup)
+        self.assertEqual(self.first.min_tier, 1)
+
+        self.second.register(MockJudge('main'))
+        self.first._update_min_tier()
+        self.assertEqual(self.first.min_tier, 0)
+
+        self.submit(self.first, 1)
+        self.assertEqual(backup.submissions, [])
+        self.assertIn(1, self.first.queue)
+
+    def test_judge_is_connected_once(self):
+        self.first.register(MockJudge('judge'))
+        self.assertEqual(self.second.peer_for_judge('judge'), ('127.0.0.1', 1))
+        self.assertIsNone(self.first.peer_for_judge('judge'))
+
+        with mock.patch.object(self.second, '_forward') as forward:
+            self.second.register(MockJudge('judge'))
+        forward.assert_called_once_with(('127.0.0.1', 1),
+                                        {'name': 'disconnect-judge', 'judge-id': 'judge', 'force': True})
+        self.assertEqual(self.first.peer_for_judge('judge'), ('127.0.0.1', 2))
+
+    def test_forget(self):
+        judge = MockJudge('judge')
+        self.first.register(judge)
+        self.submit(self.first, 1)
+        self.assertIn('first', self.second.store.instances())
+
+        self.first.store.forget()
+        self.assertNotIn('first', self.second.store.instances())
+        self.assertEqual(self.second.store.judges(), {})
+        self.assertIsNone(self.second.peer_for_submission(1))
+
+    def stop(self, judges):
+        """Makes an instance look as if it stopped without forgetting what it registered."""
+        judges.store.client.hset(judges.store.key('instances'), judges.store.instance,
+                                 json.dumps({'address': ['127.0.0.1', 3], 'seen': 0}))
+
+    def test_submission_of_stopped_instance_is_queued(self):
+        third = self.instance(self.server, 'third', ('127.0.0.1', 3))
+        third.register(MockJudge('judge'))
+        self.submit(third, 1)
+        self.stop(third)
+
+        self.submit(self.first, 1)
+        self.assertIn(1, self.first.queue)
+        self.assertIsNone(self.first.store.grading_owner(1))
+
+    def test_orphans_are_claimed_once(self):
+        third = self.instance(self.server, 'third', ('127.0.0.1', 3))
+        third.register(MockJudge('judge'))
+        self.submit(third, 1)
+        self.second.register(MockJudge('other'))
+        self.submit(self.second, 2)
+        self.assertEqual(self.first.store.claim_orphans(), ([], []))
+        self.assertEqual(sorted(self.first.store.live_grading()), [1, 2])
+
+        self.stop(third)
+        self.assertEqual(self.first.store.live_grading(), [2])
+        with mock.patch('judge.bridge.daemon.reset_judges') as reset_judges, \
+                mock.patch('judge.bridge.daemon.recover_queue') as recover_queue, \
+                self.assertLogs('judge.bridge', 'WARNING'):
+            self.first.reclaim()
+        reset_judges.assert_called_once_with(names=['judge'])
+        recover_queue.assert_called_once_with(self.first, ids=[1])
+        self.assertEqual(self.second.store.claim_orphans(), ([], []))
+        self.assertEqual(self.second.store.grading_owner(2), 'second')
+
+    def test_recovery_is_claimed_once(self):
+        self.assertTrue(self.first.store.claim_recovery())
+        self.assertFalse(self.second.store.claim_recovery())
+        self.second.store.release_recovery()
+        self.assertFalse(self.second.store.claim_recovery())
+        self.first.store.release_recovery()
+        self.assertTrue(self.second.store.claim_recovery())
@@ -0,0 +1,136 @@
+import io
+import json
+import socket
+import threading
+import time
+import unittest
+import zlib
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from judge import judgeapi
+from judge.bridge import codec
+from judge.bridge.django_handler import DjangoHandler
+from judge.bridge.judge_list import JudgeList
+from judge.bridge.server import Server
+from judge.judge_priority import BATCH_REJUDGE_PRIORITY
+
+
+class DjangoHandlerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.judge_list = JudgeList()
+        self.judges = mock.Mock(wraps=self.judge_list)
+        self.connections = 0
+
+        def handler(*args, **kwargs):
+            self.connections += 1
+            return DjangoHandler(*args, judges=self.judges, **kwargs)
+
+        self.server = Server([('127.0.0.1', 0)], handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        address = self.server.servers[0].server_address
+        self.settings = override_settings(BRIDGED_DJANGO_CONNECT=address)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        judgeapi._local.__dict__.clear()
+        self.server.shutdown()
+        self.thread.join()
+
+    def submission(self, id, priority=BATCH_REJUDGE_PRIORITY):
+        return {
+            'submission-id': id, 'problem-id': 'problem', 'language': 'lang', 'source': '', 'judge-id': None,
+            'banned-judges': [], 'priority': priority,
+        }
+
+    def test_connection_per_request(self):
+        for id in (1, 2):
+            response = judgeapi.judge_request(dict(self.submission(id), name='submission-request'))
+            self.assertEqual(response, {'name': 'submission-received', 'submission-id': id})
+        self.assertEqual(self.connections, 2)
+
+    @override_settings(BRIDGED_DJANGO_KEEPALIVE=True)
+    def test_pooled_connection(self):
+        for id in (1, 2, 3):
+            response = judgeapi.judge_request(dict(self.submission(id), name='submission-request'))
+            self.assertEqual(response, {'name': 'submission-received', 'submission-id': id})
+        self.assertEqual(self.connections, 1)
+        self.assertEqual(sorted(self.judge_list.queue.node_map), [1, 2, 3])
+
+    @override_settings(BRIDGED_DJANGO_KEEPALIVE=True)
+    def test_pooled_connection_reconnects(self):
+        judgeapi.judge_request(dict(self.submission(1), name='submission-request'))
+        # As if the bridge went away in the meantime.
+        judgeapi._local.bridge.sock.shutdown(socket.SHUT_RDWR)
+        judgeapi.judge_request(dict(self.submission(2), name='submission-request'))
+        self.assertEqual(self.connections, 2)
+
+    def test_batch_request(self):
+        response = judgeapi.judge_request({
+            'name': 'submission-batch-request',
+            'submissions': [self.submission(1), self.submission(2, priority=-1), self.submission(3)],
+        })
+        self.assertEqual(response, {'name': 'submission-batch-received', 'submission-ids': [1, 3]})
+        self.assertEqual(sorted(self.judge_list.queue.node_map), [1, 3])
+        self.judges.judge_batch.assert_called_once()
+
+    def test_locality_stats(self):
+        self.judge_list.locality.hits['judge'] = 3
+        self.judge_list.locality.recent['judge']['problem'] = None
+        self.assertEqual(judgeapi.locality_stats(), {'judge': {'hits': 3, 'misses': 0, 'problems': 1}})
+
+    def test_bridge_status(self):
+        judgeapi.judge_request(dict(self.submission(1), name='submission-request'))
+        status = judgeapi.bridge_status()
+        self.assertEqual([queue['size'] for queue in status['queue']], [0, 0, 0, 1])
+        self.assertEqual(status['judges'], [])
+        self.assertEqual(status['metrics']['counters'], [
+            {'name': 'queued', 'labels': {'priority': BATCH_REJUDGE_PRIORITY}, 'value': 1},
+        ])
+
+    @override_settings(BRIDGED_DJANGO_KEEPALIVE=True)
+    def test_bridge_status_timeout(self):
+        with mock.patch.object(self.judge_list, 'status', side_effect=lambda: time.sleep(1) or {}):
+            with self.assertRaises(socket.timeout):
+                judgeapi.bridge_status(timeout=0.1)
+        # Not left in the pool, where its late reply would be read as that of the next request.
+        self.assertIsNone(getattr(judgeapi._local, 'bridge', None))
+
+    def test_forwarded_judge_requests(self):
+        # As if the judge were connected to another instance, which here is this one again.
+        self.judges.peer_for_judge.return_value = self.server.servers[0].server_address
+        response = judgeapi.judge_request({'name': 'disable-judge', 'judge-id': 'judge', 'is-disabled': True})
+        self.assertEqual(response, {'name': 'judge-disabled', 'judge-id': 'judge', 'is-disabled': True})
+        response = judgeapi.judge_request({'name': 'disconnect-judge', 'judge-id': 'judge', 'force': False})
+        self.assertEqual(response, {'name': 'judge-disconnected', 'judge-id': 'judge'})
+        # Only the instance the requests were passed on to handled them.
+        self.judges.update_disable_judge.assert_called_once_with('judge', True)
+        self.judges.disconnect.assert_called_once_with('judge', force=False)
+        self.assertEqual(self.connections, 4)
+
+    @unittest.skipIf('msgpack' not in codec.CODECS, 'msgpack is not installed')
+    @override_settings(BRIDGED_DJANGO_CODEC='msgpack')
+    def test_reply_in_request_codec(self):
+        with mock.patch.object(codec.JSON, 'loads', side_effect=AssertionError('JSON was used')):
+            response = judgeapi.judge_request(dict(self.submission(1), name='submission-request'))
+        self.assertEqual(response, {'name': 'submission-received', 'submission-id': 1})
+
+
+class ReadPacketTestCase(SimpleTestCase):
+    def read(self, data):
+        data = zlib.compress(data)
+        return judgeapi._read_packet(io.BytesIO(judgeapi.size_pack.pack(len(data)) + data))
+
+    def test_json_values(self):
+        # Some requests are answered with something other than an object, which is never msgpack.
+        for value in (None, True, 42, [1], {'name': 'ok'}):
+            with self.subTest(value=value):
+                self.assertEqual(self.read(json.dumps(value).encode()), value)
+
+    @unittest.skipIf('msgpack' not in codec.CODECS, 'msgpack is not installed')
+    def test_msgpack(self):
+        packet = {'name': 'ok', 'cases': list(range(20))}
+        self.assertEqual(self.read(codec.CODECS['msgpack'].dumps(packet)), packet)
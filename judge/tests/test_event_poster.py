@@ -0,0 +1,100 @@
+import json
+import unittest
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+try:
+    from judge.event_poster_ws import AsyncEventPoster, EventPoster
+except ImportError:
+    # websocket-client is an optional dependency.
+    AsyncEventPoster = EventPoster = None
+
+
+@unittest.skipIf(EventPoster is None, 'websocket-client is not installed')
+class AsyncEventPosterTestCase(SimpleTestCase):
+    def setUp(self):
+        # Not started, so that the test can take batches itself.
+        self.poster = AsyncEventPoster(max_queue=5, max_batch=3)
+
+    def test_refreshes_of_the_same_object_are_merged(self):
+        self.poster.post('sub_a', {'type': 'processing'})
+        self.poster.post('submissions', {'type': 'update-submission', 'id': 1})
+        self.poster.post('submissions', {'type': 'update-submission', 'id': 2})
+        self.poster.post('sub_a', {'type': 'test-case'})
+        self.poster.post('submissions', {'type': 'done-submission', 'id': 1})
+
+        self.assertEqual(self.poster._take_batch(), [
+            ('submissions', {'type': 'update-submission', 'id': 2}),
+            ('sub_a', {'type': 'test-case'}),
+            ('submissions', {'type': 'done-submission', 'id': 1}),
+        ])
+        self.assertEqual(self.poster.stats()['superseded'], 2)
+        self.assertEqual(self.poster.stats()['queue'], 0)
+
+    def test_other_channels_are_never_merged(self):
+        self.poster.post('tickets', {'type': 'new-ticket', 'id': 1})
+        self.poster.post('tickets', {'type': 'new-ticket', 'id': 1})
+        self.assertEqual(len(self.poster._take_batch()), 2)
+        self.assertEqual(self.poster.stats()['superseded'], 0)
+
+    def test_batches_are_bounded(self):
+        for i in range(4):
+            self.poster.post('contest_%d' % i, {'type': 'update'})
+        self.assertEqual(len(self.poster._take_batch()), 3)
+        self.assertEqual(len(self.poster._take_batch()), 1)
+
+    def test_queue_is_bounded(self):
+        for i in range(7):
+            self.poster.post('contest_%d' % i, {'type': 'update'})
+        self.assertEqual(self.poster.stats()['queue'], 5)
+        self.assertEqual(self.poster.stats()['overflowed'], 2)
+
+    @mock.patch('judge.event_poster_ws.time.sleep')
+    def test_survives_unexpected_errors(self, sleep):
+        poster = mock.Mock()
+        poster.post_batch.side_effect = [ValueError('Expecting value'), KeyError('ids'), [1]]
+        with mock.patch('judge.event_poster_ws.EventPoster', return_value=poster):
+            self.assertIsNone(self.poster._post_batch(None, [('a', {})]))
+            self.assertIsNone(self.poster._post_batch(poster, [('a', {}), ('b', {})]))
+            self.assertIs(self.poster._post_batch(None, [('c', {})]), poster)
+        self.assertEqual(self.poster.stats()['failed'], 3)
+        self.assertEqual(self.poster.stats()['sent'], 1)
+        self.assertEqual(sleep.call_count, 2)
+
+
+class FakeConnection:
+    def __init__(self, supports_batch):
+        self.supports_batch = supports_batch
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def recv(self):
+        request = self.sent[-1]
+        if request['command'] == 'post-batch':
+            if not self.supports_batch:
+                return json.dumps({'status': 'error', 'code': 'bad-command'})
+            return json.dumps({'status': 'success', 'ids': list(range(len(request['messages'])))})
+        return json.dumps({'status': 'success', 'id': len(self.sent)})
+
+
+@unittest.skipIf(EventPoster is None, 'websocket-client is not installed')
+class EventPosterBatchTestCase(SimpleTestCase):
+    def create_poster(self, supports_batch):
+        poster = EventPoster.__new__(EventPoster)
+        poster._conn = FakeConnection(supports_batch)
+        return poster
+
+    def test_batch_is_one_frame(self):
+        poster = self.create_poster(supports_batch=True)
+        poster.post_batch([('a', {}), ('b', {})])
+        self.assertEqual([request['command'] for request in poster._conn.sent], ['post-batch'])
+
+    def test_falls_back_to_single_posts(self):
+        poster = self.create_poster(supports_batch=False)
+        poster.post_batch([('a', {}), ('b', {})])
+        poster.post_batch([('c', {})])
+        self.assertEqual([request['command'] for request in poster._conn.sent],
+                         ['post-batch', 'post', 'post', 'post'])
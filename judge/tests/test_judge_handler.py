@@ -0,0 +1,203 @@
+import base64
+import json
+import struct
+import unittest
+import zlib
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from judge.bridge import codec
+from judge.bridge.judge_handler import JudgeHandler
+from judge.models import Language, Submission, SubmissionTestCase
+from judge.models.tests.util import create_problem, create_user
+
+
+def create_handler():
+    server = mock.Mock(server_address=('localhost', 9999))
+    # Skip RequestHandlerMeta, which would start serving the (fake) socket right away.
+    handler = JudgeHandler.__new__(JudgeHandler)
+    handler.__init__(mock.Mock(), ('127.0.0.1', 12345), server, mock.Mock())
+    return handler
+
+
+class JudgeHandlerTestCase(TestCase):
+    fixtures = ['language_all.json']
+
+    def setUp(self):
+        self.submission = Submission.objects.create(
+            user=create_user(username='normal').profile,
+            problem=create_problem(code='bridge'),
+            language=Language.get_python3(),
+            status='QU',
+        )
+        self.handler = create_handler()
+        self.handler.on_grading_begin({'submission-id': self.submission.id, 'pretested': False})
+
+    def packet(self, name, **kwargs):
+        return dict(name=name, **{'submission-id': self.submission.id}, **kwargs)
+
+    def make_case(self, position, status=0, points=1, total=1, time=0.5, memory=1024):
+        return {
+            'position': position, 'status': status, 'time': time, 'memory': memory,
+            'points': points, 'total-points': total, 'output': '',
+        }
+
+    def send_cases(self, *positions):
+        self.handler.on_test_case(self.packet('test-case-status', cases=[self.make_case(i) for i in positions]))
+
+    def saved_cases(self):
+        return list(SubmissionTestCase.objects.filter(submission=self.submission)
+                    .order_by('case').values_list('case', flat=True))
+
+
+class JudgeHandlerTestCaseBufferTestCase(JudgeHandlerTestCase):
+    def test_unbuffered_cases_are_written_immediately(self):
+        self.send_cases(1)
+        self.assertEqual(self.saved_cases(), [1])
+        self.send_cases(2, 3)
+        self.assertEqual(self.saved_cases(), [1, 2, 3])
+        self.assertEqual(Submission.objects.get(id=self.submission.id).current_testcase, 4)
+
+    @override_settings(BRIDGED_TEST_CASE_BUFFER_SIZE=3, BRIDGED_TEST_CASE_BUFFER_TIME=60)
+    def test_buffer_flushes_when_full(self):
+        self.send_cases(1)
+        self.send_cases(2)
+        self.assertEqual(self.saved_cases(), [])
+        self.send_cases(3)
+        self.assertEqual(self.saved_cases(), [1, 2, 3])
+        self.assertEqual(Submission.objects.get(id=self.submission.id).current_testcase, 4)
+
+    @override_settings(BRIDGED_TEST_CASE_BUFFER_SIZE=100, BRIDGED_TEST_CASE_BUFFER_TIME=60)
+    def test_buffer_flushes_at_batch_end(self):
+        self.handler.on_batch_begin(self.packet('batch-begin'))
+        self.send_cases(1, 2)
+        self.assertEqual(self.saved_cases(), [])
+        self.handler.on_batch_end(self.packet('batch-end'))
+        self.assertEqual(self.saved_cases(), [1, 2])
+
+    @override_settings(BRIDGED_TEST_CASE_BUFFER_SIZE=100, BRIDGED_TEST_CASE_BUFFER_TIME=0)
+    def test_buffer_flushes_when_expired(self):
+        self.send_cases(1)
+        self.assertEqual(self.saved_cases(), [1])
+
+    @override_settings(BRIDGED_TEST_CASE_BUFFER_SIZE=100, BRIDGED_TEST_CASE_BUFFER_TIME=60)
+    def test_buffer_flushes_at_grading_end(self):
+        self.send_cases(1, 2)
+        self.handler.on_grading_end(self.packet('grading-end'))
+        self.assertEqual(self.saved_cases(), [1, 2])
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual(submission.status, 'D')
+        self.assertEqual(submission.result, 'AC')
+        self.assertEqual(submission.case_points, 2)
+
+    @override_settings(BRIDGED_TEST_CASE_BUFFER_SIZE=100, BRIDGED_TEST_CASE_BUFFER_TIME=60)
+    def test_buffer_flushes_on_internal_error(self):
+        self.send_cases(1)
+        with self.assertLogs('judge.bridge', 'ERROR'):
+            self.handler.on_internal_error(self.packet('internal-error', message='oops'))
+        self.assertEqual(self.saved_cases(), [1])
+        self.assertEqual(Submission.objects.get(id=self.submission.id).status, 'IE')
+
+    @override_settings(BRIDGED_TEST_CASE_BUFFER_SIZE=100, BRIDGED_TEST_CASE_BUFFER_TIME=60)
+    def test_buffer_flushes_on_disconnect(self):
+        self.send_cases(1, 2)
+        self.handler.on_disconnect()
+        self.assertEqual(self.saved_cases(), [1, 2])
+
+
+class JudgeHandlerGradingEndTestCase(JudgeHandlerTestCase):
+    def send_batched_cases(self):
+        self.handler.on_test_case(self.packet('test-case-status', cases=[
+            self.make_case(1, points=2, total=2, time=0.25, memory=100),
+        ]))
+        self.handler.on_batch_begin(self.packet('batch-begin'))
+        self.handler.on_test_case(self.packet('test-case-status', cases=[
+            self.make_case(2, points=3, total=3, time=1.5, memory=300),
+            self.make_case(3, status=1, points=0, total=3, time=0.5, memory=200),
+        ]))
+        self.handler.on_batch_end(self.packet('batch-end'))
+        self.handler.on_batch_begin(self.packet('batch-begin'))
+        self.handler.on_test_case(self.packet('test-case-status', cases=[
+            self.make_case(4, points=4, total=5, time=0.75, memory=50),
+        ]))
+        self.handler.on_batch_end(self.packet('batch-end'))
+
+    def assertGraded(self):
+        submission = Submission.objects.get(id=self.submission.id)
+        self.assertEqual(submission.status, 'D')
+        self.assertEqual(submission.result, 'WA')
+        self.assertEqual(submission.time, 1.5)
+        self.assertEqual(submission.memory, 300)
+        self.assertEqual(submission.case_points, 6)
+        self.assertEqual(submission.case_total, 10)
+
+    def test_result_from_received_cases(self):
+        self.send_batched_cases()
+        with CaptureQueriesContext(connection) as queries:
+            self.handler.on_grading_end(self.packet('grading-end'))
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT') and
+                          'judge_submissiontestcase' in query['sql']])
+        self.assertGraded()
+
+    def test_result_from_database_when_grading_was_not_seen(self):
+        self.send_batched_cases()
+        # A fresh handler, as if the bridge restarted before grading ended.
+        self.handler = create_handler()
+        self.handler.on_grading_end(self.packet('grading-end'))
+        self.assertGraded()
+
+
+class JudgeHandlerNegotiationTestCase(SimpleTestCase):
+    def setUp(self):
+        self.handler = create_handler()
+
+    def sent(self, zdict=None):
+        data = self.handler.request.sendall.call_args[0][0]
+        self.assertEqual(struct.unpack('!I', data[:4])[0], len(data) - 4)
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return decompressor.decompress(data[4:]) + decompressor.flush()
+
+    def test_old_judge_gets_json(self):
+        self.handler._negotiate({'id': 'judge'})
+        self.assertEqual(json.loads(self.sent()), {'name': 'handshake-success'})
+        self.assertIs(self.handler.codec, codec.JSON)
+        self.assertIsNone(self.handler.zlib_dictionary)
+
+    @override_settings(BRIDGED_JUDGE_CODECS=['json'])
+    def test_disabled_codec_is_refused(self):
+        self.handler._negotiate({'codecs': ['msgpack', 'json']})
+        self.assertEqual(json.loads(self.sent()), {'name': 'handshake-success', 'codec': 'json'})
+        self.assertIs(self.handler.codec, codec.JSON)
+
+    @override_settings(BRIDGED_ZLIB_DICTIONARY=True)
+    def test_dictionary(self):
+        self.handler._negotiate({'codecs': ['json'], 'zlib-dictionary': True})
+        response = json.loads(self.sent())
+        self.assertEqual(base64.b64decode(response['zlib-dictionary']), codec.PACKET_DICTIONARY)
+
+        self.handler.send({'name': 'ping', 'when': 1})
+        self.assertEqual(json.loads(self.sent(codec.PACKET_DICTIONARY)), {'name': 'ping', 'when': 1})
+
+        compressor = zlib.compressobj(zdict=codec.PACKET_DICTIONARY)
+        with mock.patch.object(self.handler, 'on_ping_response') as on_ping_response:
+            self.handler.handlers['ping-response'] = on_ping_response
+            self.handler._on_packet(compressor.compress(b'{"name":"ping-response"}') + compressor.flush())
+        on_ping_response.assert_called_once_with({'name': 'ping-response'})
+
+    @unittest.skipIf('msgpack' not in codec.CODECS, 'msgpack is not installed')
+    def test_msgpack(self):
+        import msgpack
+
+        self.handler._negotiate({'codecs': ['msgpack', 'json']})
+        self.assertEqual(json.loads(self.sent()), {'name': 'handshake-success', 'codec': 'msgpack'})
+
+        self.handler.send({'name': 'ping', 'when': 1})
+        self.assertEqual(msgpack.unpackb(self.sent()), {'name': 'ping', 'when': 1})
+
+        with mock.patch.object(self.handler, 'on_ping_response') as on_ping_response:
+            self.handler.handlers['ping-response'] = on_ping_response
+            self.handler.on_packet(msgpack.packb({'name': 'ping-response', 'load': 0.5}))
+        on_ping_response.assert_called_once_with({'name': 'ping-response', 'load': 0.5})
@@ -1,8 +1,11 @@
-from django.test import SimpleTestCase
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
 
 from judge.bridge.judge_handler import SubmissionUnavailable
 from judge.bridge.judge_list import JudgeList
-from judge.judge_priority import DEFAULT_PRIORITY
+from judge.judge_priority import BATCH_REJUDGE_PRIORITY, CONTEST_SUBMISSION_PRIORITY, DEFAULT_PRIORITY, \
+    REJUDGE_PRIORITY
 
 
 class MockJudge:
@@ -37,6 +40,9 @@ class MockJudge:
     def disconnect(self, force=False):
         pass
 
+    def get_status(self, now):
+        return {'name': self.name, 'submission': self.get_current_submission(), 'utilization': 0.5}
+
 
 class JudgeListVanishedSubmissionTestCase(SimpleTestCase):
     def setUp(self):
@@ -83,3 +89,282 @@ class JudgeListVanishedSubmissionTestCase(SimpleTestCase):
         self.assertEqual(judge.submissions, [1, 3])
         self.assertEqual(self.judges.submission_map[3], judge)
         self.assertIn(judge, self.judges.judges)
+
+
+class JudgeListDispatchOrderTestCase(SimpleTestCase):
+    def setUp(self):
+        self.judges = JudgeList()
+        self.busy = MockJudge('busy')
+        self.busy.problems = {'a', 'b', 'c'}
+        self.judges.register(self.busy)
+        self.judges.judge(100, 'a', 'lang', 'source', None, DEFAULT_PRIORITY)
+
+    def submit(self, id, problem='a', priority=DEFAULT_PRIORITY, judge_id=None, banned_judges=()):
+        self.judges.judge(id, problem, 'lang', 'source', judge_id, priority, list(banned_judges))
+
+    def free(self, judge):
+        submission = judge.get_current_submission()
+        self.judges.on_judge_free(judge, submission)
+        return judge.get_current_submission()
+
+    def test_fifo_across_problems(self):
+        self.submit(1, 'b')
+        self.submit(2, 'a')
+        self.submit(3, 'b')
+        self.assertEqual(self.free(self.busy), 1)
+        self.assertEqual(self.free(self.busy), 2)
+        self.assertEqual(self.free(self.busy), 3)
+        self.assertEqual(len(self.judges.queue), 0)
+
+    def test_more_urgent_priority_first(self):
+        self.submit(1, 'a', priority=REJUDGE_PRIORITY)
+        self.submit(2, 'b', priority=DEFAULT_PRIORITY)
+        self.submit(3, 'c', priority=CONTEST_SUBMISSION_PRIORITY)
+        self.assertEqual(self.free(self.busy), 3)
+        self.assertEqual(self.free(self.busy), 2)
+        self.assertEqual(self.free(self.busy), 1)
+
+    def test_skips_submissions_judge_cannot_grade(self):
+        self.busy.problems = {'b'}
+        self.submit(1, 'a')
+        self.submit(2, 'b', banned_judges=['busy'])
+        self.submit(3, 'b', judge_id='other')
+        self.submit(4, 'b')
+        self.assertEqual(self.free(self.busy), 4)
+        self.assertEqual(sorted(self.judges.node_map), [1, 2, 3])
+
+    def test_pinned_submission_goes_to_its_judge(self):
+        self.submit(1, 'a')
+        self.submit(2, 'a', judge_id='busy')
+        self.busy.is_disabled = True
+        self.assertEqual(self.free(self.busy), 2)
+        self.assertEqual(sorted(self.judges.node_map), [1])
+
+    def test_judge_reserved_for_urgent_work(self):
+        other = MockJudge('other')
+        other.problems = {'a', 'b', 'c'}
+        self.judges.register(other)
+        self.submit(1, 'a')
+        self.assertEqual(other.get_current_submission(), 1)
+
+        self.submit(2, 'b', priority=REJUDGE_PRIORITY)
+        self.assertEqual(self.free(self.busy), None)
+        self.submit(3, 'c', priority=CONTEST_SUBMISSION_PRIORITY)
+        self.assertEqual(self.busy.get_current_submission(), 3)
+        self.assertEqual(sorted(self.judges.node_map), [2])
+
+    def test_abort_removes_queued_submission(self):
+        self.submit(1, 'a')
+        self.submit(2, 'a')
+        self.assertFalse(self.judges.abort(1))
+        self.assertEqual(self.free(self.busy), 2)
+        self.assertEqual(len(self.judges.queue), 0)
+
+
+class JudgeListLocalityTestCase(SimpleTestCase):
+    def setUp(self):
+        self.judges = JudgeList()
+        self.warm = MockJudge('warm')
+        self.cold = MockJudge('cold')
+        self.warm.problems = self.cold.problems = {'a', 'b'}
+        self.judges.register(self.warm)
+        self.judges.judge(1, 'a', 'lang', 'source', None, DEFAULT_PRIORITY)
+        self.judges.on_judge_free(self.warm, 1)
+        self.judges.register(self.cold)
+
+    def submit(self, id, problem='a'):
+        self.judges.judge(id, problem, 'lang', 'source', None, DEFAULT_PRIORITY)
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=True, BRIDGED_LOCALITY_LOAD_TOLERANCE=0.5)
+    def test_prefers_warm_judge_with_comparable_load(self):
+        self.warm.load, self.cold.load = 1.25, 1
+        self.submit(2)
+        self.assertEqual(self.warm.get_current_submission(), 2)
+        self.assertEqual(self.judges.locality_stats()['warm'], {'hits': 1, 'misses': 1, 'problems': 1})
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=True, BRIDGED_LOCALITY_LOAD_TOLERANCE=0.5)
+    def test_avoids_warm_judge_with_much_higher_load(self):
+        self.warm.load, self.cold.load = 2, 1
+        self.submit(2)
+        self.assertEqual(self.cold.get_current_submission(), 2)
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=True)
+    def test_cold_problem_goes_to_least_loaded_judge(self):
+        self.warm.load, self.cold.load = 0.5, 0
+        self.submit(2, 'b')
+        self.assertEqual(self.cold.get_current_submission(), 2)
+        self.assertEqual(self.judges.locality_stats()['cold'], {'hits': 0, 'misses': 1, 'problems': 1})
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=False)
+    def test_disabled(self):
+        self.warm.load, self.cold.load = 0.25, 0
+        self.submit(2)
+        self.assertEqual(self.cold.get_current_submission(), 2)
+
+    def queue_while_busy(self, times=(0, 0)):
+        # Both judges are busy, the warm one with the problem it graded before.
+        self.warm.load, self.cold.load = 0, 1
+        self.submit(2)
+        self.submit(3, 'b')
+        self.assertEqual((self.warm.get_current_submission(), self.cold.get_current_submission()), (2, 3))
+        for id, problem, now in ((4, 'b', times[0]), (5, 'a', times[1])):
+            with mock.patch.object(self.judges.queue, 'now', return_value=now):
+                self.submit(id, problem)
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=True, BRIDGED_LOCALITY_QUEUE_TOLERANCE=10)
+    def test_queued_submission_of_warm_problem_first(self):
+        self.queue_while_busy()
+        self.judges.on_judge_free(self.warm, 2)
+        self.assertEqual(self.warm.get_current_submission(), 5)
+        self.judges.on_judge_free(self.cold, 3)
+        self.assertEqual(self.cold.get_current_submission(), 4)
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=True, BRIDGED_LOCALITY_QUEUE_TOLERANCE=10)
+    def test_queued_submission_of_warm_problem_much_later(self):
+        self.queue_while_busy(times=(0, 20))
+        self.judges.on_judge_free(self.warm, 2)
+        self.assertEqual(self.warm.get_current_submission(), 4)
+
+    @override_settings(BRIDGED_LOCALITY_DISPATCH=False)
+    def test_queued_disabled(self):
+        self.queue_while_busy()
+        self.judges.on_judge_free(self.warm, 2)
+        self.assertEqual(self.warm.get_current_submission(), 4)
+
+    @override_settings(BRIDGED_LOCALITY_CACHE_SIZE=2)
+    def test_only_recent_problems_are_remembered(self):
+        for problem in ('b', 'c', 'a'):
+            self.judges.locality.record(self.warm, problem)
+        self.assertEqual(list(self.judges.locality.recent['warm']), ['c', 'a'])
+        self.assertEqual(self.judges.locality_stats()['warm'], {'hits': 0, 'misses': 4, 'problems': 2})
+
+
+class JudgeListStatusTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        clock = mock.Mock(monotonic=lambda: self.now)
+        for module in ('judge.bridge.judge_list', 'judge.bridge.submission_queue'):
+            patcher = mock.patch(module + '.time', clock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.judges = JudgeList()
+        self.judge = MockJudge('judge')
+        self.judges.register(self.judge)
+
+    def submit(self, id, priority=DEFAULT_PRIORITY):
+        self.judges.judge(id, 'problem', 'lang', 'source', None, priority)
+
+    def histogram(self, name, **labels):
+        return self.judges.metrics.histograms[name, tuple(sorted(labels.items()))]
+
+    def test_queue(self):
+        self.submit(1)
+        self.submit(2)
+        self.now += 5
+        self.submit(3, CONTEST_SUBMISSION_PRIORITY)
+        self.now += 2
+
+        status = self.judges.status()
+        self.assertEqual(status['queue'][:2], [
+            {'priority': CONTEST_SUBMISSION_PRIORITY, 'size': 1, 'oldest': 2},
+            {'priority': DEFAULT_PRIORITY, 'size': 1, 'oldest': 7},
+        ])
+        self.assertEqual(status['judges'], [{'name': 'judge', 'submission': 1, 'utilization': 0.5}])
+
+    def test_queue_wait(self):
+        self.submit(1)
+        self.submit(2)
+        self.now += 3
+        self.judges.on_judge_free(self.judge, 1)
+
+        histogram = self.histogram('queue_wait', priority=DEFAULT_PRIORITY)
+        self.assertEqual(histogram.count, 2)
+        self.assertEqual(histogram.sum, 3)
+        self.assertEqual(self.histogram('dispatch').count, 2)
+
+    def test_prometheus(self):
+        self.submit(1)
+        self.submit(2)
+        text = self.judges.prometheus()
+        self.assertIn('bridge_queue_size{priority="1"} 1.0\n', text)
+        self.assertIn('bridge_judge_utilization{judge="judge"} 0.5\n', text)
+        self.assertIn('bridge_queue_wait_seconds_bucket{priority="1",le="0.001"} 1.0\n', text)
+        self.assertIn('bridge_queue_wait_seconds_count{priority="1"} 1.0\n', text)
+        self.assertIn('bridge_queued_total{priority="1"} 1.0\n', text)
+
+
+class JudgeListAgingTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        patcher = mock.patch('judge.bridge.submission_queue.time', mock.Mock(monotonic=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.judges = JudgeList()
+        self.busy = MockJudge('busy')
+        self.judges.register(self.busy)
+        self.submit(100, DEFAULT_PRIORITY)
+
+    def submit(self, id, priority):
+        self.judges.judge(id, 'problem', 'lang', 'source', None, priority)
+
+    def free(self):
+        self.judges.on_judge_free(self.busy, self.busy.get_current_submission())
+        return self.busy.get_current_submission()
+
+    def test_strict_by_default(self):
+        self.submit(1, BATCH_REJUDGE_PRIORITY)
+        self.now += 10000
+        self.submit(2, DEFAULT_PRIORITY)
+        self.assertEqual(self.free(), 2)
+
+    @override_settings(BRIDGED_QUEUE_AGING_TIME=100)
+    def test_aged_rejudges_compete_with_newer_submissions(self):
+        self.submit(1, BATCH_REJUDGE_PRIORITY)
+        self.now += 150
+        self.submit(2, DEFAULT_PRIORITY)
+        self.submit(3, REJUDGE_PRIORITY)
+        # 1 counts as arriving at 200, and 3 at 250.
+        self.assertEqual(self.free(), 2)
+
+        self.now += 110
+        self.submit(4, DEFAULT_PRIORITY)
+        self.assertEqual(self.free(), 1)
+        self.assertEqual(self.free(), 3)
+        self.assertEqual(self.free(), 4)
+
+    @override_settings(BRIDGED_QUEUE_AGING_TIME=100)
+    def test_aged_rejudge_skips_judge_reservation(self):
+        self.submit(1, REJUDGE_PRIORITY)
+        self.assertIsNone(self.judges.queue.next_for(self.busy, lambda: True))
+        self.now += 100
+        self.assertEqual(self.judges.queue.next_for(self.busy, lambda: True).id, 1)
+
+    @override_settings(BRIDGED_QUEUE_AGING_TIME=1)
+    def test_nothing_ages_past_contest_submissions(self):
+        self.submit(1, BATCH_REJUDGE_PRIORITY)
+        self.now += 10000
+        self.submit(2, CONTEST_SUBMISSION_PRIORITY)
+        self.assertEqual(self.free(), 2)
+        self.assertEqual(self.free(), 1)
+
+    @override_settings(BRIDGED_REJUDGE_MIN_SHARE=0.5)
+    def test_rejudge_min_share(self):
+        self.submit(1, BATCH_REJUDGE_PRIORITY)
+        self.submit(2, CONTEST_SUBMISSION_PRIORITY)
+        self.submit(3, BATCH_REJUDGE_PRIORITY)
+        self.submit(4, DEFAULT_PRIORITY)
+        self.assertEqual(self.free(), 1)
+        self.assertEqual(self.judges.queue.rejudge_share(), 0.5)
+        self.assertEqual(self.free(), 2)
+        self.assertEqual(self.free(), 3)
+        self.assertEqual(self.free(), 4)
+
+    @override_settings(BRIDGED_REJUDGE_MIN_SHARE=0.5, BRIDGED_CONTEST_LATENCY_TARGET=30)
+    def test_contest_latency_target(self):
+        self.submit(1, BATCH_REJUDGE_PRIORITY)
+        self.submit(2, CONTEST_SUBMISSION_PRIORITY)
+        self.now += 30
+        self.assertEqual(self.free(), 2)
+        self.assertEqual(self.free(), 1)
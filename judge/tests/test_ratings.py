@@ -0,0 +1,119 @@
+import random
+from unittest import mock, skipIf
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from judge.management.commands.benchmark_ratings import make_contest
+from judge.models import ContestParticipation, Profile, Rating
+from judge.models.tests.util import create_contest, create_contest_participation, create_user
+from judge.ratings import np, rate_contest, rebuild_ratings, recalculate_ratings_numpy, recalculate_ratings_python
+
+
+@skipIf(np is None, 'NumPy is not installed')
+class RecalculateRatingsTestCase(SimpleTestCase):
+    def assertEquivalent(self, ranking, old_mean, times_ranked, historical_p):
+        rating, mean, performance = recalculate_ratings_numpy(ranking, old_mean, times_ranked, historical_p)
+        old_rating, old_mean, old_performance = recalculate_ratings_python(ranking, old_mean, times_ranked,
+                                                                           historical_p)
+        for a, b in zip(rating, old_rating):
+            self.assertLessEqual(abs(a - b), 1)
+        for a, b in zip(mean, old_mean):
+            self.assertAlmostEqual(a, b, delta=0.01)
+        for a, b in zip(performance, old_performance):
+            self.assertAlmostEqual(a, b, delta=0.01)
+        self.assertTrue(all(isinstance(r, int) for r in rating))
+
+    def test_random_contests(self):
+        rng = random.Random(0)
+        for n in (2, 3, 10, 100, 400):
+            with self.subTest(participants=n):
+                self.assertEquivalent(*make_contest(n, rng))
+
+    def test_small_contests(self):
+        self.assertEqual(recalculate_ratings_numpy([], [], [], []), ([], [], []))
+        self.assertEqual(recalculate_ratings_numpy([1], [1500.], [0], [[]]),
+                         recalculate_ratings_python([1], [1500.], [0], [[]]))
+
+    def test_everyone_tied(self):
+        self.assertEquivalent([2.5] * 4, [1500., 1800., 1200., 1500.], [0, 3, 1, 0],
+                              [[], [1700., 1900., 1800.], [1300.], []])
+
+    def test_newcomers(self):
+        self.assertEquivalent([1, 2, 3, 4, 5], [1500.] * 5, [0] * 5, [[]] * 5)
+
+
+class RebuildRatingsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        now = timezone.now()
+        users = [create_user(username='rated_%d' % i).profile for i in range(8)]
+        cls.contests = []
+        for i in range(6):
+            contest = create_contest(
+                key='rated_%d' % i,
+                start_time=now - timezone.timedelta(days=10 - i, hours=2),
+                end_time=now - timezone.timedelta(days=10 - i),
+                is_rated=True,
+                rate_all=True,
+                rate_disqualified=(i != 3),
+                rating_floor=1300 if i == 4 else None,
+                rate_exclude=('rated_0',) if i == 2 else (),
+            )
+            for j, user in enumerate(rng.sample(users, 6)):
+                create_contest_participation(contest=contest, user=user, score=rng.randrange(3) * 100,
+                                             cumtime=rng.randrange(1000), is_disqualified=(i == 3 and j == 0))
+            cls.contests.append(contest)
+
+    def results(self):
+        return (
+            list(Rating.objects.order_by('contest__end_time', 'user_id')
+                 .values_list('user_id', 'contest_id', 'participation_id', 'rank', 'rating', 'mean', 'performance')),
+            list(Profile.objects.order_by('id').values_list('id', 'rating')),
+        )
+
+    def rate_one_by_one(self):
+        Rating.objects.all().delete()
+        Profile.objects.update(rating=None)
+        for contest in self.contests:
+            rate_contest(contest)
+        return self.results()
+
+    def assertResultsEqual(self, a, b):
+        self.assertEqual(a[1], b[1])
+        self.assertEqual(len(a[0]), len(b[0]))
+        for x, y in zip(*(a[0], b[0])):
+            self.assertEqual(x[:5], y[:5])
+            self.assertAlmostEqual(x[5], y[5])
+            self.assertAlmostEqual(x[6], y[6])
+
+    def test_rebuild(self):
+        expected = self.rate_one_by_one()
+        progress = mock.Mock()
+        self.assertEqual(rebuild_ratings(progress=progress), self.contests)
+        progress.assert_called_with(6, 6)
+        self.assertResultsEqual(self.results(), expected)
+        self.assertEqual(Rating.objects.filter(contest=self.contests[3]).count(), 5)
+        self.assertLess(Rating.objects.filter(contest=self.contests[4]).count(), 6)
+
+    def test_rebuild_since(self):
+        ContestParticipation.objects.filter(contest=self.contests[3]).update(score=0)
+        expected = self.rate_one_by_one()
+        for rating in Rating.objects.filter(contest__in=self.contests[3:]):
+            rating.rating = rating.mean = rating.performance = 0
+            rating.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(rebuild_ratings(since=self.contests[3].end_time), self.contests[3:])
+        self.assertResultsEqual(self.results(), expected)
+        self.assertLess(len(queries), 40)
+
+    def test_disqualify(self):
+        self.rate_one_by_one()
+        participation = ContestParticipation.objects.get(contest=self.contests[3], user__user__username='rated_2')
+        participation.set_disqualified(True)
+        self.assertFalse(Rating.objects.filter(participation=participation).exists())
+        self.assertResultsEqual(self.results(), self.rate_one_by_one())
@@ -1,3 +1,6 @@
+import time
+
+from django.conf import settings
 from django.core.cache import cache
 
 
@@ -31,3 +34,100 @@ def bulk_invalidate_notification_caches(profile_ids):
 
 def storage_pie_cache_factory(org_id):
     return CacheFactory(f'storage_pie_data_{org_id}', default_timeout=7 * 86400)
+
+
+class CacheMetrics:
+    """Counters kept in the cache, so that they add up across processes."""
+
+    def __init__(self, prefix, names):
+        self._prefix = prefix
+        self._names = names
+
+    def incr(self, name, delta=1):
+        key = f'{self._prefix}:{name}'
+        if not cache.add(key, delta, None):
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                cache.set(key, delta, None)
+
+    def get(self):
+        values = cache.get_many([f'{self._prefix}:{name}' for name in self._names])
+        return {name: values.get(f'{self._prefix}:{name}', 0) for name in self._names}
+
+
+class SingleFlightCache(CacheFactory):
+    """
+    A cache entry that is slow to build. Once it expires, one process at a time rebuilds it, while the others keep
+    getting the previous value for up to `stale_timeout` more seconds. When there is no previous value, the others wait
+    for the first build for up to `lock_timeout` seconds.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, key, default_timeout, stale_timeout, lock_timeout, metrics):
+        super().__init__(key, default_timeout)
+        self._stale_timeout = stale_timeout
+        self._lock_timeout = lock_timeout
+        self._metrics = metrics
+
+    def get_lock_key(self):
+        return f'{self._key}:lock'
+
+    def get_cache(self):
+        entry = super().get_cache()
+        return None if entry is None else entry[1]
+
+    def set_cache(self, data, timeout_s=None):
+        timeout_s = self._default_timeout if timeout_s is None else timeout_s
+        cache.set(self.get_cache_key(), (time.time() + timeout_s, data), timeout_s + self._stale_timeout)
+
+    def rebuild(self, build):
+        """Builds and caches the value, and releases the lock on rebuilding it."""
+        start = time.monotonic()
+        try:
+            data = build()
+            self.set_cache(data)
+        finally:
+            cache.delete(self.get_lock_key())
+        self._metrics.incr('rebuilds')
+        self._metrics.incr('rebuild_ms', int((time.monotonic() - start) * 1000))
+        return data
+
+    def get_or_build(self, build, refresh=None):
+        """
+        Returns the cached value, rebuilding it with `build` if needed. With `refresh`, a stale value is rebuilt by
+        calling `refresh` instead, which must arrange for rebuild() to be called elsewhere.
+        """
+        entry = super().get_cache()
+        if entry is not None and entry[0] > time.time():
+            self._metrics.incr('hits')
+            return entry[1]
+
+        if entry is not None:
+            if cache.add(self.get_lock_key(), 1, self._lock_timeout):
+                if refresh is None:
+                    self._metrics.incr('misses')
+                    return self.rebuild(build)
+                refresh()
+            self._metrics.incr('stale')
+            return entry[1]
+
+        self._metrics.incr('misses')
+        deadline = time.monotonic() + self._lock_timeout
+        while not cache.add(self.get_lock_key(), 1, self._lock_timeout) and time.monotonic() < deadline:
+            time.sleep(self.POLL_INTERVAL)
+            data = self.get_cache()
+            if data is not None:
+                return data
+        return self.rebuild(build)
+
+
+def scoreboard_cache_metrics():
+    return CacheMetrics('scoreboard_cache', ('hits', 'stale', 'misses', 'rebuilds', 'rebuild_ms'))
+
+
+def contest_ranking_cache_factory(contest, show_virtual, frozen, language):
+    return SingleFlightCache(f'contest_ranking_json_{contest.key}_{show_virtual}_{frozen}_{language}',
+                             contest.scoreboard_cache_timeout, settings.VNOJ_SCOREBOARD_CACHE_STALE_TIME,
+                             settings.VNOJ_SCOREBOARD_CACHE_LOCK_TIME, scoreboard_cache_metrics())
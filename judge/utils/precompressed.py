@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ['PrecompressedFile', 'PrecompressedJSON', 'accepted_encoding', 'precompressed_file_path']
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+re_accepts = {
+    'br': re.compile(r'\bbr\b'),
+    'gzip': re.compile(r'\bgzip\b'),
+}
+
+# The suffix of the file holding each encoding of a PrecompressedFile, in order of preference.
+FILE_SUFFIXES = {
+    'br': '.br',
+    'gzip': '.gz',
+}
+
+
+def accepted_encoding(request, encodings):
+    """Returns the first of `encodings` that the client accepts, or None."""
+    accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    for encoding in encodings:
+        if re_accepts[encoding].search(accept_encoding):
+            return encoding
+    return None
+
+
+def precompressed_file_path(request, path):
+    """
+    Returns the best encoding the client accepts among those written next to the file at `path` by PrecompressedFile,
+    or None, and the path of the file holding it.
+    """
+    encoding = accepted_encoding(request, [encoding for encoding, suffix in FILE_SUFFIXES.items()
+                                           if os.path.exists(path + suffix)])
+    return encoding, path + FILE_SUFFIXES[encoding] if encoding is not None else path
+
+
+class PrecompressedJSON:
+    """
+    A JSON document that is encoded once, along with its gzip and, if the brotli package is installed, brotli
+    compressions, so that serving it again only copies bytes. Its ETag is a hash of its content.
+    """
+
+    __slots__ = ('content', 'etag', 'encodings')
+
+    def __init__(self, data, compress=True):
+        self.content = json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+        # Weak, as the same ETag is sent for every encoding of the content.
+        self.etag = 'W/"%s"' % hashlib.sha1(self.content).hexdigest()
+        self.encodings = {}
+        if compress:
+            if brotli is not None:
+                self.encodings['br'] = brotli.compress(self.content, quality=BROTLI_QUALITY)
+            self.encodings['gzip'] = gzip.compress(self.content, GZIP_LEVEL, mtime=0)
+
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def response(self, request):
+        """Returns a response with the best encoding the client accepts, or a 304 if it has this content already."""
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if '*' in etags or any(etag.removeprefix('W/') == self.etag.removeprefix('W/') for etag in etags):
+            response = HttpResponseNotModified()
+        else:
+            encoding = accepted_encoding(request, self.encodings)
+            if encoding is not None:
+                response = HttpResponse(self.encodings[encoding], content_type='application/json')
+                response['Content-Encoding'] = encoding
+            else:
+                response = HttpResponse(self.content, content_type='application/json')
+            patch_vary_headers(response, ('Accept-Encoding',))
+
+        response['ETag'] = self.etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class PrecompressedFile:
+    """
+    Writes a text file bit by bit, along with its gzip and, if the brotli package is installed, brotli compressions
+    next to it. Everything is written to temporary files, which replace the files at the given path only once all was
+    written, so that readers never see a partial file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+
+    def __enter__(self):
+        directory, name = os.path.split(self.path)
+        os.makedirs(directory, exist_ok=True)
+        suffixes = {None: '', 'gzip': FILE_SUFFIXES['gzip']}
+        if brotli is not None:
+            suffixes['br'] = FILE_SUFFIXES['br']
+        for encoding, suffix in suffixes.items():
+            fd, tmp = tempfile.mkstemp(prefix=name + suffix + '.', suffix='.tmp', dir=directory)
+            self.files[encoding] = (open(fd, 'wb'), tmp, self.path + suffix)
+
+        self.gzip = gzip.GzipFile(fileobj=self.files['gzip'][0], mode='wb', compresslevel=GZIP_LEVEL, mtime=0)
+        self.brotli = brotli.Compressor(quality=BROTLI_QUALITY) if brotli is not None else None
+        return self
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.files[None][0].write(data)
+        self.gzip.write(data)
+        if self.brotli is not None:
+            self.files['br'][0].write(self.brotli.process(data))
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        written = exc_type is None
+        try:
+            if written:
+                self.gzip.close()
+                if self.brotli is not None:
+                    self.files['br'][0].write(self.brotli.finish())
+        except BaseException:
+            written = False
+            raise
+        finally:
+            # The uncompressed file goes last, as its existence is what tells readers that the file was written.
+            for file, tmp, path in reversed(self.files.values()):
+                file.close()
+                if written:
+                    os.chmod(tmp, 0o644)
+                    os.replace(tmp, path)
+                else:
+                    os.unlink(tmp)
@@ -0,0 +1,247 @@
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+__all__ = ['ReplayTimelines', 'get_replay_scorer']
+
+
+class ProblemState(object):
+    """What is known of the submissions of one participant to one problem, as they arrive in time order."""
+
+    __slots__ = ('best_points', 'best_time', 'tries_up_to_best', 'tries', 'last_points', 'last_time')
+
+    def __init__(self):
+        self.best_points = 0
+        self.best_time = 0
+        self.tries_up_to_best = 0
+        self.tries = 0
+        self.last_points = 0
+        self.last_time = 0
+
+    def update(self, points, time):
+        if points > self.best_points:
+            self.best_points = points
+            self.best_time = time
+            self.tries_up_to_best = self.tries + 1
+        self.tries += 1
+        self.last_points = points
+        self.last_time = max(self.last_time, time)
+
+
+class ReplayScorer(object):
+    """
+    Scores a participant from the states of their problems as the replay engine in contest-replay.js does, so that
+    the ranks found here match those shown by a client that has the whole replay data.
+    """
+
+    max_time = False
+    has_tiebreaker = False
+
+    def __init__(self, config, duration):
+        self.config = config
+        self.duration = duration
+
+    def problem_score(self, state, points):
+        return state.best_points
+
+    def problem_time(self, state):
+        return state.last_time
+
+    def problem_penalty(self, state):
+        return 0
+
+    def problem_tiebreaker(self, state):
+        return 0
+
+    def score(self, states, problems):
+        """Returns the score, cumulative time and tiebreaker given the states of problems by id and their points."""
+        score = cumtime = penalty = tiebreaker = 0
+        for problem_id, points in problems:
+            state = states.get(problem_id)
+            if state is None:
+                continue
+            problem_score = self.problem_score(state, points)
+            if problem_score > 0:
+                score += problem_score
+                time = self.problem_time(state)
+                cumtime = max(cumtime, time) if self.max_time else cumtime + time
+                penalty += self.problem_penalty(state)
+                if self.has_tiebreaker:
+                    tiebreaker = max(tiebreaker, self.problem_tiebreaker(state))
+        return score, max(cumtime + penalty, 0), tiebreaker
+
+
+class ICPCReplayScorer(ReplayScorer):
+    has_tiebreaker = True
+
+    def problem_score(self, state, points):
+        return state.best_points if state.best_points == points else 0
+
+    def problem_time(self, state):
+        return state.best_time // 60
+
+    def problem_penalty(self, state):
+        return (state.tries_up_to_best - 1) * self.config.get('penalty', 20)
+
+    def problem_tiebreaker(self, state):
+        return state.best_time // 60
+
+
+class VNOJReplayScorer(ReplayScorer):
+    has_tiebreaker = True
+
+    def __init__(self, config, duration):
+        super().__init__(config, duration)
+        self.max_time = bool(config.get('LSO'))
+
+    def problem_time(self, state):
+        return state.best_time
+
+    def problem_penalty(self, state):
+        return (state.tries_up_to_best - 1) * self.config.get('penalty', 5) * 60
+
+    def problem_tiebreaker(self, state):
+        return state.best_time
+
+
+class AtCoderReplayScorer(ReplayScorer):
+    max_time = True
+
+    def problem_time(self, state):
+        return state.best_time
+
+    def problem_penalty(self, state):
+        return (state.tries_up_to_best - 1) * self.config.get('penalty', 5) * 60
+
+
+class LegacyIOIReplayScorer(ReplayScorer):
+    has_tiebreaker = True
+
+    def problem_time(self, state):
+        return state.best_time if self.config.get('cumtime') else 0
+
+    def problem_tiebreaker(self, state):
+        return state.best_time
+
+
+class ECOOReplayScorer(ReplayScorer):
+    def problem_score(self, state, points):
+        bonus = 0
+        if state.tries == 1 and state.last_points == points:
+            bonus += self.config.get('first_ac_bonus', 10)
+        time_bonus = self.config.get('time_bonus', 5)
+        remaining = self.duration - state.last_time
+        if time_bonus and remaining > 0:
+            bonus += remaining // 60 // time_bonus
+        return state.last_points + bonus
+
+    def problem_time(self, state):
+        return state.last_time if self.config.get('cumtime') else 0
+
+
+# Keyed by the names contest-replay.js gives the formats; any other format is scored as the default one.
+REPLAY_SCORERS = {
+    'icpc': ICPCReplayScorer,
+    'vnoj': VNOJReplayScorer,
+    'atcoder': AtCoderReplayScorer,
+    'ioi': LegacyIOIReplayScorer,
+    'ecoo': ECOOReplayScorer,
+}
+
+
+def get_replay_scorer(format_name, config, duration):
+    return REPLAY_SCORERS.get(format_name, ReplayScorer)(config or {}, duration)
+
+
+class ReplayTimelines(object):
+    """
+    The standing of every live participant of a contest over time, made from its replay data: for each participant,
+    the times at which their standing changed, in order, and their sort key from each of those times on. The standing
+    of anyone at any time is then found by a binary search, so that the rank of a virtual participant at some time
+    into the contest costs no more than one search for each live participant.
+    """
+
+    MAX_TIMELINES = 32
+    _timelines = OrderedDict()
+    _timelines_lock = threading.Lock()
+
+    def __init__(self, scorer, problems, participations, subs):
+        """
+        `problems` are pairs of ids and points, `participations` pairs of ids and whether they are disqualified, and
+        `subs` lists of participation id, problem id, points and seconds into the contest, in time order.
+        """
+        self.scorer = scorer
+        self.problems = problems
+        disqualified = dict(participations)
+        states = {id: {} for id in disqualified}
+        self.times = {id: [] for id in disqualified}
+        self.keys = {id: [] for id in disqualified}
+
+        for part_id, problem_id, points, time in subs:
+            if part_id not in states:
+                continue
+            state = states[part_id].get(problem_id)
+            if state is None:
+                state = states[part_id][problem_id] = ProblemState()
+            state.update(points, time)
+            key = self.sort_key(disqualified[part_id], *scorer.score(states[part_id], problems))
+            times = self.times[part_id]
+            if times and times[-1] == time:
+                self.keys[part_id][-1] = key
+            else:
+                times.append(time)
+                self.keys[part_id].append(key)
+
+        self.initial_keys = {id: self.sort_key(is_disqualified, 0, 0, 0)
+                             for id, is_disqualified in disqualified.items()}
+
+    @classmethod
+    def get(cls, key, build):
+        """Returns the timelines kept for `key`, made by calling `build` if there are none."""
+        with cls._timelines_lock:
+            timelines = cls._timelines.pop(key, None)
+            if timelines is not None:
+                cls._timelines[key] = timelines
+                return timelines
+
+        timelines = build()
+        with cls._timelines_lock:
+            cls._timelines[key] = timelines
+            while len(cls._timelines) > cls.MAX_TIMELINES:
+                cls._timelines.popitem(last=False)
+        return timelines
+
+    @classmethod
+    def clear(cls):
+        with cls._timelines_lock:
+            cls._timelines.clear()
+
+    @staticmethod
+    def sort_key(is_disqualified, score, cumtime, tiebreaker):
+        return bool(is_disqualified), -score, cumtime, tiebreaker
+
+    def standing(self, part_id, elapsed):
+        """Returns the sort key of a live participant counting only their submissions up to `elapsed` seconds in."""
+        index = bisect_right(self.times[part_id], elapsed)
+        return self.keys[part_id][index - 1] if index else self.initial_keys[part_id]
+
+    def rank(self, subs, elapsed, is_disqualified=False):
+        """
+        Returns the score, cumulative time and tiebreaker that the given pairs of problem id and points with seconds
+        into the contest earn by `elapsed` seconds in, the rank they get among the live participants at that time, and
+        the number of participants ranked along with them.
+        """
+        states = {}
+        for problem_id, points, time in subs:
+            if time > elapsed:
+                break
+            state = states.get(problem_id)
+            if state is None:
+                state = states[problem_id] = ProblemState()
+            state.update(points, time)
+        score, cumtime, tiebreaker = self.scorer.score(states, self.problems)
+        key = self.sort_key(is_disqualified, score, cumtime, tiebreaker)
+
+        cutoff = min(elapsed, self.scorer.duration)
+        ahead = sum(self.standing(part_id, cutoff) < key for part_id in self.times)
+        return score, cumtime, tiebreaker, ahead + 1, len(self.times) + 1
@@ -0,0 +1,191 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+__all__ = ['LiveScoreboard', 'get_scoreboard_changes', 'get_scoreboard_version', 'scoreboard_changed']
+
+VERSION_KEY = 'scoreboard_version:%d'
+CHANGES_KEY = 'scoreboard_changes:%d:%d'
+CHANGES_TIMEOUT = 3600
+# A version counter starts from the time in milliseconds times this, so that one made again after the last was evicted
+# never gives out versions that were given out before.
+VERSION_TIME_SCALE = 1000
+
+
+def _first_version():
+    return int(time.time() * 1000) * VERSION_TIME_SCALE
+
+
+def scoreboard_changed(contest_id, participation_ids=None):
+    """
+    Records, once the current transaction commits, that the given participations of a contest changed, or that its
+    whole ranking did if no participations are given. Each record advances the contest's scoreboard version by one.
+    """
+    if participation_ids is not None:
+        participation_ids = list(participation_ids)
+
+    def record():
+        key = VERSION_KEY % contest_id
+        cache.add(key, _first_version(), None)
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            # The counter was evicted in the meantime; readers reload in full when they cannot follow the changes.
+            version = _first_version() + 1
+            cache.set(key, version, None)
+        cache.set(CHANGES_KEY % (contest_id, version), participation_ids, CHANGES_TIMEOUT)
+
+    transaction.on_commit(record)
+
+
+def get_scoreboard_version(contest_id):
+    key = VERSION_KEY % contest_id
+    version = cache.get(key)
+    if version is None:
+        # Made here too, so that the first change after it is one readers can follow.
+        cache.add(key, _first_version(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def get_scoreboard_changes(contest_id, since, version):
+    """
+    Returns the set of ids of the participations that changed after version `since` up to `version`, or None if that
+    is unknown, e.g. because the whole ranking changed or the changes are too many or too old to follow.
+    """
+    if since > version or version - since > settings.VNOJ_LIVE_SCOREBOARD_MAX_DELTA:
+        return None
+
+    keys = [CHANGES_KEY % (contest_id, v) for v in range(since + 1, version + 1)]
+    changes = cache.get_many(keys)
+    ids = set()
+    for key in keys:
+        if changes.get(key) is None:
+            return None
+        ids.update(changes[key])
+    return ids
+
+
+def _sort_key(row):
+    return (row['is_disqualified'], -row['score'], row['cumtime'], row['tiebreaker'], -row['submission_count'],
+            row['id'])
+
+
+class LiveScoreboard(object):
+    """
+    The ranking of a contest, kept in memory in rank order. When read, it catches up with the changes recorded by
+    scoreboard_changed by reloading only the participations that changed.
+
+    Rows are the dicts of make_contest_ranking_json, with the submission count, which are given by a loader that is
+    called with a list of participation ids, or with None for all of them.
+    """
+
+    MAX_SCOREBOARDS = 32
+    _scoreboards = OrderedDict()
+    _scoreboards_lock = threading.Lock()
+
+    def __init__(self, contest_id):
+        self.contest_id = contest_id
+        self.lock = threading.Lock()
+        self.version = None
+        self.loaded_at = 0
+        self.rows = {}
+        self.order = []
+        self.rankings = {}
+        self.payloads = {}
+
+    @classmethod
+    def get(cls, contest_id, frozen, kind='ranking'):
+        """Returns the scoreboard of a contest kept for `kind` of rows, which tells apart those of different loaders."""
+        key = (contest_id, frozen, kind)
+        with cls._scoreboards_lock:
+            scoreboard = cls._scoreboards.pop(key, None) or cls(contest_id)
+            cls._scoreboards[key] = scoreboard
+            while len(cls._scoreboards) > cls.MAX_SCOREBOARDS:
+                cls._scoreboards.popitem(last=False)
+        return scoreboard
+
+    @classmethod
+    def clear(cls):
+        with cls._scoreboards_lock:
+            cls._scoreboards.clear()
+
+    def _reload(self, load, ids):
+        if ids is None:
+            self.rows = {row['id']: row for row in load(None)}
+            self.order = sorted(map(_sort_key, self.rows.values()))
+            self.loaded_at = time.monotonic()
+            return
+
+        for id in ids:
+            row = self.rows.pop(id, None)
+            if row is not None:
+                del self.order[bisect_left(self.order, _sort_key(row))]
+        if ids:
+            for row in load(list(ids)):
+                self.rows[row['id']] = row
+                insort(self.order, _sort_key(row))
+
+    def _refresh(self, load):
+        # Read the version before the rows, so that anything changed while loading shows up as a later version.
+        version = get_scoreboard_version(self.contest_id)
+        if self.version is None or time.monotonic() - self.loaded_at > settings.VNOJ_LIVE_SCOREBOARD_MAX_AGE:
+            self._reload(load, None)
+        elif version != self.version:
+            self._reload(load, get_scoreboard_changes(self.contest_id, self.version, version))
+        else:
+            return
+        self.version = version
+        self.rankings = {}
+        self.payloads = {}
+
+    def _ranking(self, live_only):
+        ranking = self.rankings.get(live_only)
+        if ranking is None:
+            ranking = []
+            rank = 0
+            delta = 1
+            last_key = None
+            for key in self.order:
+                row = self.rows[key[-1]]
+                if live_only and row['virtual']:
+                    continue
+                if key[:4] != last_key:
+                    rank += delta
+                    delta = 0
+                delta += 1
+                last_key = key[:4]
+                ranking.append(dict(row, rank=rank))
+            self.rankings[live_only] = ranking
+        return ranking
+
+    def payload(self, load, key, encode, live_only=True):
+        """
+        Returns what `encode` makes of the current version and the ranked rows, only of live participations if
+        `live_only`. It is made once for each `key` until the ranking changes.
+        """
+        with self.lock:
+            self._refresh(load)
+            payload = self.payloads.get((key, live_only))
+            if payload is None:
+                payload = self.payloads[key, live_only] = encode(self.version, self._ranking(live_only))
+            return payload
+
+    def delta(self, load, since, live_only=True):
+        """
+        Returns the current version, the ranked rows that changed after version `since`, and the id and rank of every
+        row in order, or None if the changes since then are unknown.
+        """
+        with self.lock:
+            self._refresh(load)
+            version = self.version
+            ranking = self._ranking(live_only)
+        ids = get_scoreboard_changes(self.contest_id, since, version)
+        if ids is None:
+            return None
+        return version, [row for row in ranking if row['id'] in ids], [[row['id'], row['rank']] for row in ranking]
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from judge.utils.cache_helper import CacheMetrics, SingleFlightCache
+
+
+class SingleFlightCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000.0
+        clock = SimpleNamespace(time=lambda: self.now, monotonic=lambda: self.now, sleep=self.sleep)
+        patcher = mock.patch('judge.utils.cache_helper.time', clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.on_sleep = None
+        self.metrics = CacheMetrics('test_cache', ('hits', 'stale', 'misses', 'rebuilds', 'rebuild_ms'))
+        self.cache = SingleFlightCache('test_key', 60, 30, 10, self.metrics)
+        self.builds = 0
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.on_sleep is not None:
+            self.on_sleep()
+
+    def build(self):
+        self.builds += 1
+        self.now += 2
+        return self.builds
+
+    def lock(self):
+        return cache.add(self.cache.get_lock_key(), 1)
+
+    def test_hit_and_rebuild(self):
+        self.assertEqual(self.cache.get_or_build(self.build), 1)
+        self.assertEqual(self.cache.get_or_build(self.build), 1)
+
+        self.now += 60
+        self.assertEqual(self.cache.get_or_build(self.build), 2)
+        self.assertEqual(self.metrics.get(), {'hits': 1, 'stale': 0, 'misses': 2, 'rebuilds': 2, 'rebuild_ms': 4000})
+        self.assertTrue(self.lock())
+
+    def test_stale_value_served_while_rebuilding(self):
+        self.cache.get_or_build(self.build)
+        self.now += 70
+        self.assertTrue(self.lock())
+        self.assertEqual(self.cache.get_or_build(self.build), 1)
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(self.metrics.get()['stale'], 1)
+
+    def test_refresh_elsewhere(self):
+        self.cache.get_or_build(self.build)
+        self.now += 60
+        refresh = mock.Mock()
+        self.assertEqual(self.cache.get_or_build(self.build, refresh), 1)
+        self.assertEqual(self.cache.get_or_build(self.build, refresh), 1)
+        refresh.assert_called_once_with()
+
+        self.cache.rebuild(self.build)
+        self.assertEqual(self.cache.get_or_build(self.build, refresh), 2)
+        refresh.assert_called_once_with()
+
+    def test_waits_for_first_build(self):
+        self.assertTrue(self.lock())
+        self.on_sleep = lambda: self.cache.rebuild(lambda: 'elsewhere')
+        self.assertEqual(self.cache.get_or_build(self.build), 'elsewhere')
+        self.assertEqual(self.builds, 0)
+
+    def test_gives_up_waiting(self):
+        self.assertTrue(self.lock())
+        self.assertEqual(self.cache.get_or_build(self.build), 1)
+        self.assertAlmostEqual(self.now, 1012)
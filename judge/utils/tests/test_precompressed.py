@@ -0,0 +1,80 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import skipIf
+
+from django.test import RequestFactory, SimpleTestCase
+
+from judge.utils.precompressed import PrecompressedFile, PrecompressedJSON, brotli, precompressed_file_path
+
+
+class PrecompressedJSONTestCase(SimpleTestCase):
+    data = {'participations': [{'id': i, 'score': 100.0 - i} for i in range(100)]}
+
+    def setUp(self):
+        self.payload = PrecompressedJSON(self.data)
+
+    def get(self, payload=None, **headers):
+        return (payload or self.payload).response(RequestFactory().get('/', **headers))
+
+    def test_identity(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(json.loads(response.content), self.data)
+        self.assertEqual(response['ETag'], self.payload.etag)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_gzip(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.data)
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        response = self.get(HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(json.loads(brotli.decompress(response.content)), self.data)
+
+    def test_not_compressed(self):
+        response = self.get(PrecompressedJSON(self.data, compress=False), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertEqual(json.loads(response.content), self.data)
+
+    def test_not_modified(self):
+        self.assertEqual(PrecompressedJSON(self.data).etag, self.payload.etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=self.payload.etag).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=self.payload.etag[2:]).status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH='W/"other", ' + self.payload.etag).status_code, 304)
+
+        response = self.get(HTTP_IF_NONE_MATCH=PrecompressedJSON({}).etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class PrecompressedFileTestCase(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'data', 'file.json')
+
+    def test_write(self):
+        with PrecompressedFile(self.path) as f:
+            f.write('{"a":')
+            f.write('1}')
+        with open(self.path) as f:
+            self.assertEqual(f.read(), '{"a":1}')
+        with gzip.open(self.path + '.gz', 'rt') as f:
+            self.assertEqual(f.read(), '{"a":1}')
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(precompressed_file_path(request, self.path), ('gzip', self.path + '.gz'))
+        self.assertEqual(precompressed_file_path(RequestFactory().get('/'), self.path), (None, self.path))
+
+    def test_failure(self):
+        with self.assertRaises(ValueError):
+            with PrecompressedFile(self.path) as f:
+                f.write('{"a":')
+                raise ValueError()
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), [])
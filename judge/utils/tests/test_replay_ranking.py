@@ -0,0 +1,68 @@
+from django.test import SimpleTestCase
+
+from judge.utils.replay_ranking import ReplayTimelines, get_replay_scorer
+
+PROBLEMS = [(1, 100.0), (2, 100.0)]
+PARTICIPATIONS = [(10, False), (11, False), (12, True)]
+# Participation id, problem id, points and seconds into the contest, in time order.
+SUBS = [
+    [10, 1, 100.0, 600],
+    [11, 1, 0.0, 900],
+    [12, 1, 100.0, 1200],
+    [11, 1, 100.0, 1800],
+    [11, 2, 50.0, 1800],
+    [10, 2, 100.0, 3000],
+]
+
+
+class ReplayTimelinesTestCase(SimpleTestCase):
+    def timelines(self, format_name, config=None):
+        return ReplayTimelines(get_replay_scorer(format_name, config, 3600), PROBLEMS, PARTICIPATIONS, SUBS)
+
+    def test_standing(self):
+        timelines = self.timelines('default')
+        self.assertEqual(timelines.standing(10, 0), (False, 0, 0, 0))
+        self.assertEqual(timelines.standing(10, 600), (False, -100.0, 600, 0))
+        self.assertEqual(timelines.standing(10, 2999), (False, -100.0, 600, 0))
+        self.assertEqual(timelines.standing(11, 1800), (False, -150.0, 3600, 0))
+        self.assertEqual(timelines.standing(12, 3600), (True, -100.0, 1200, 0))
+        self.assertEqual(timelines.times[11], [900, 1800])
+
+    def test_rank(self):
+        timelines = self.timelines('default')
+        self.assertEqual(timelines.rank([], 300), (0, 0, 0, 1, 4))
+        self.assertEqual(timelines.rank([(1, 100.0, 500)], 700), (100.0, 500, 0, 1, 4))
+        self.assertEqual(timelines.rank([(1, 100.0, 700)], 700), (100.0, 700, 0, 2, 4))
+        # Submissions after the time asked for do not count.
+        self.assertEqual(timelines.rank([(1, 100.0, 700), (2, 100.0, 2000)], 1900)[3], 3)
+        self.assertEqual(timelines.rank([(1, 100.0, 700), (2, 100.0, 2000)], 2000)[3], 1)
+        # Disqualified participants come last, and times past the end of the contest count as the end.
+        self.assertEqual(timelines.rank([], 3600, is_disqualified=True)[3], 4)
+        self.assertEqual(timelines.rank([(1, 100.0, 5000), (2, 100.0, 5000)], 7200)[3], 2)
+
+    def test_icpc(self):
+        timelines = self.timelines('icpc', {'penalty': 20})
+        # Only full points count, in minutes, with penalties for tries before.
+        self.assertEqual(timelines.standing(11, 1800), (False, -100.0, 50.0, 30.0))
+        self.assertEqual(timelines.rank([(1, 100.0, 1500)], 1800), (100.0, 25.0, 25.0, 2, 4))
+
+    def test_atcoder(self):
+        timelines = self.timelines('atcoder')
+        self.assertEqual(timelines.standing(11, 1800), (False, -150.0, 2100, 0))
+        self.assertEqual(timelines.standing(10, 3600), (False, -200.0, 3000, 0))
+
+    def test_ecoo(self):
+        timelines = self.timelines('ecoo')
+        # A first solve earns 10 points, and a point for every 5 minutes left.
+        self.assertEqual(timelines.standing(10, 600), (False, -120.0, 0, 0))
+        # A time bonus of 0 turns the bonus off.
+        timelines = self.timelines('ecoo', {'time_bonus': 0})
+        self.assertEqual(timelines.standing(10, 600), (False, -110.0, 0, 0))
+        self.assertEqual(timelines.rank([(1, 100.0, 700)], 700)[:4], (110.0, 0, 0, 1))
+
+    def test_get(self):
+        ReplayTimelines.clear()
+        self.addCleanup(ReplayTimelines.clear)
+        first = ReplayTimelines.get((1, 0), lambda: self.timelines('default'))
+        self.assertIs(ReplayTimelines.get((1, 0), lambda: self.fail('built again')), first)
+        self.assertIsNot(ReplayTimelines.get((1, 1), lambda: self.timelines('default')), first)
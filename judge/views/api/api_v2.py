@@ -1,13 +1,26 @@
+import json
+from functools import partial
+
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied, ValidationError
-from django.db.models import F
+from django.db.models import Min, Q
 from django.http import Http404, JsonResponse
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
 from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
 from django.views.generic.detail import BaseDetailView
 
 from judge.models import Contest, ContestParticipation, Submission
+from judge.utils.precompressed import PrecompressedJSON
+from judge.utils.scoreboard import LiveScoreboard
+
+# Most submissions sent at once by the submissions sync endpoint.
+SYNC_SUBMISSIONS_LIMIT = 2000
+# The ranks of each ranking version sent by the participants sync endpoint, kept for clients asking what changed since.
+SYNC_RANKS_KEY = 'sync_participant_ranks:%d:%d:%d'
+SYNC_RANKS_TIMEOUT = 300
 
 
 class APIKeyRequiredException(Exception):
@@ -93,10 +106,8 @@ class APIContestSyncBase(APIKeyRequiredMixin, APIMixin, BaseDetailView):
         return self.get_api_data(context)
 
     def render_to_response(self, context, **response_kwargs):
-        data = self.get_data(context)
-        if not isinstance(data, dict):
-            response_kwargs.setdefault('safe', False)
-        return JsonResponse(data, **response_kwargs)
+        # With an ETag, pollers that already have the data only get a 304.
+        return PrecompressedJSON(self.get_data(context), compress=False).response(self.request)
 
 
 class APIContestSyncDetail(APIContestSyncBase):
@@ -127,54 +138,112 @@ class APIContestSyncProblems(APIContestSyncBase):
 
 
 class APIContestSyncParticipants(APIContestSyncBase):
-    def get_api_data(self, context):
-        contest = context['object']
-        score_field = 'frozen_score' if contest.is_frozen else 'score'
-        cumtime_field = 'frozen_cumtime' if contest.is_frozen else 'cumtime'
-        tiebreaker_field = 'frozen_tiebreaker' if contest.is_frozen else 'tiebreaker'
-        participations = (
-            contest.users
-            .filter(virtual=ContestParticipation.LIVE, is_disqualified=False)
-            .annotate(username=F('user__user__username'))
-            .order_by(F(score_field).desc(), cumtime_field, tiebreaker_field, 'id')
-            .values('username', score_field, cumtime_field, tiebreaker_field)
-        )
-        results = []
-        last_scores = None
-        current_rank = 0
-        for index, participation in enumerate(participations, start=1):
-            score_tuple = (
-                participation[score_field],
-                participation[cumtime_field],
-                participation[tiebreaker_field],
+    """
+    The ranks of the live participants of a contest, along with the version of the ranking in the X-Ranking-Version
+    header. Given that version as `since`, only the participants whose rank changed after it are sent, and those who
+    left the ranking, unless the ranks of that version are no longer known.
+    """
+
+    def load_rows(self, contest, frozen, ids):
+        prefix = 'frozen_' if frozen else ''
+        queryset = contest.users.filter(virtual=ContestParticipation.LIVE)
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        return [
+            {
+                'id': id,
+                'user': username,
+                'is_disqualified': is_disqualified,
+                'virtual': ContestParticipation.LIVE,
+                'score': score,
+                'cumtime': cumtime,
+                'tiebreaker': tiebreaker,
+                'submission_count': 0,
+            }
+            for id, username, is_disqualified, score, cumtime, tiebreaker in queryset.values_list(
+                'id', 'user__user__username', 'is_disqualified',
+                prefix + 'score', prefix + 'cumtime', prefix + 'tiebreaker',
             )
-            if score_tuple != last_scores:
-                current_rank = index
-                last_scores = score_tuple
-            results.append({
-                'user': participation['username'],
-                'contest': contest.key,
-                'rank': current_rank,
-            })
-        return results
+        ]
+
+    def get_ranking(self, contest, frozen):
+        """Returns the ranking version, the rank of each participant by username, and the ranking to send."""
+        def encode(version, ranking):
+            participants = [{'user': row['user'], 'contest': contest.key, 'rank': row['rank']}
+                            for row in ranking if not row['is_disqualified']]
+            ranks = {participant['user']: participant['rank'] for participant in participants}
+            cache.set(SYNC_RANKS_KEY % (contest.id, frozen, version), ranks, SYNC_RANKS_TIMEOUT)
+            return version, ranks, PrecompressedJSON(participants, compress=False)
+
+        if settings.VNOJ_LIVE_SCOREBOARD:
+            scoreboard = LiveScoreboard.get(contest.id, frozen, 'sync')
+        else:
+            scoreboard = LiveScoreboard(contest.id)
+        return scoreboard.payload(partial(self.load_rows, contest, frozen), 'participants', encode)
+
+    def render_to_response(self, context, **response_kwargs):
+        contest = context['object']
+        frozen = contest.is_frozen
+        version, ranks, payload = self.get_ranking(contest, frozen)
+
+        since = self.request.GET.get('since', '')
+        old_ranks = cache.get(SYNC_RANKS_KEY % (contest.id, frozen, int(since))) if since.isdigit() else None
+        if old_ranks is None:
+            response = payload.response(self.request)
+        else:
+            response = PrecompressedJSON({
+                'since': int(since),
+                'version': version,
+                'participants': [{'user': user, 'contest': contest.key, 'rank': rank}
+                                 for user, rank in ranks.items() if old_ranks.get(user) != rank],
+                'removed': [user for user in old_ranks if user not in ranks],
+            }, compress=False).response(self.request)
+        response['X-Ranking-Version'] = version
+        return response
+
+
+def encode_submission_cursor(judged_date, id):
+    return urlsafe_base64_encode(json.dumps([judged_date.isoformat(), id]).encode())
+
+
+def decode_submission_cursor(cursor):
+    try:
+        judged_date, id = json.loads(urlsafe_base64_decode(cursor))
+        judged_date = parse_datetime(judged_date)
+    except (TypeError, ValueError):
+        raise ValidationError('invalid cursor')
+    if judged_date is None or not isinstance(id, int):
+        raise ValidationError('invalid cursor')
+    return judged_date, id
 
 
 class APIContestSyncSubmissions(APIContestSyncBase):
+    """
+    The submissions of a contest in order of judge time, from `from_timestamp` or after a `cursor`. The Link header
+    gives the URL of what comes next, which is also where to ask again for submissions judged later. Unless `status`
+    is `all`, submissions judged after one still grading are held back until it is done.
+    """
+
     def get_api_data(self, context):
         contest = context['object']
-        from_timestamp = self.request.GET.get('from_timestamp')
-        if not from_timestamp:
-            raise ValidationError('from_timestamp is required')
+        cursor = self.request.GET.get('cursor')
+        if cursor:
+            judged_date, last_id = decode_submission_cursor(cursor)
+        else:
+            from_timestamp = self.request.GET.get('from_timestamp')
+            if not from_timestamp:
+                raise ValidationError('from_timestamp is required')
 
-        parsed = parse_datetime(from_timestamp)
-        if parsed is None:
-            raise ValidationError('from_timestamp must be ISO 8601')
-        if timezone.is_naive(parsed):
-            parsed = timezone.make_aware(parsed, timezone=timezone.utc)
+            judged_date = parse_datetime(from_timestamp)
+            if judged_date is None:
+                raise ValidationError('from_timestamp must be ISO 8601')
+            last_id = 0
+        if timezone.is_naive(judged_date):
+            judged_date = timezone.make_aware(judged_date, timezone=timezone.utc)
 
         limit_param = self.request.GET.get('limit')
         if limit_param is None:
-            limit = 2000
+            limit = SYNC_SUBMISSIONS_LIMIT
         else:
             try:
                 limit = int(limit_param)
@@ -182,21 +251,29 @@ class APIContestSyncSubmissions(APIContestSyncBase):
                 raise ValidationError('limit must be an integer')
             if limit < 1:
                 raise ValidationError('limit must be positive')
-            limit = min(limit, 2000)
+            limit = min(limit, SYNC_SUBMISSIONS_LIMIT)
 
         status = self.request.GET.get('status', 'final')
         if status not in ('final', 'all'):
             raise ValidationError('status must be "final" or "all"')
 
-        submissions = (
-            Submission.objects
-            .filter(contest_object=contest, judged_date__gte=parsed)
-            .select_related('user__user', 'problem', 'contest_object')
-            .order_by('judged_date', 'id')
+        submissions = Submission.objects.filter(
+            Q(judged_date__gt=judged_date) | Q(judged_date=judged_date, id__gt=last_id), contest_object=contest,
         )
         if status == 'final':
+            # The judge time is when grading began, so what is still grading would end up behind a cursor past it.
+            grading = submissions.filter(status__in=Submission.IN_PROGRESS_GRADING_STATUS) \
+                .aggregate(Min('judged_date'))['judged_date__min']
             submissions = submissions.exclude(status__in=Submission.IN_PROGRESS_GRADING_STATUS)
-        submissions = submissions[:limit]
+            if grading is not None:
+                submissions = submissions.filter(judged_date__lt=grading)
+        submissions = submissions.select_related('user__user', 'problem', 'contest_object') \
+            .order_by('judged_date', 'id')
+        submissions = list(submissions[:limit])
+
+        if submissions:
+            judged_date, last_id = submissions[-1].judged_date, submissions[-1].id
+        self.next_cursor = encode_submission_cursor(judged_date, last_id)
 
         return [
             {
@@ -210,3 +287,12 @@ class APIContestSyncSubmissions(APIContestSyncBase):
             }
             for submission in submissions
         ]
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        params = self.request.GET.copy()
+        params.pop('from_timestamp', None)
+        params['cursor'] = self.next_cursor
+        response['Link'] = '<%s?%s>; rel="next"' % (self.request.build_absolute_uri(self.request.path),
+                                                    params.urlencode())
+        return response
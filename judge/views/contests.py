@@ -12,6 +12,7 @@ from django.contrib.auth.context_processors import PermWrapper
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist, PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import IntegrityError
 from django.db.models import BooleanField, Case, Count, F, FloatField, IntegerField, Max, Min, OuterRef, Q, Subquery, \
     Sum, Value, When
@@ -23,6 +24,7 @@ from django.template.defaultfilters import date as date_filter, floatformat
 from django.template.loader import get_template
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from django.utils.functional import cached_property
 from django.utils.html import _json_script_escapes, escape, format_html
 from django.utils.safestring import mark_safe
@@ -43,12 +45,18 @@ from judge.forms import ContestAnnouncementForm, ContestCloneForm, ContestDownlo
 from judge.models import Contest, ContestAnnouncement, ContestMoss, ContestParticipation, ContestProblem, \
     ContestSubmission, ContestTag, Language, Organization, Problem, ProblemClarification, Profile, Solution, Submission
 from judge.ratings import RATING_CLASS, RATING_LEVELS, RATING_VALUES
-from judge.tasks import on_new_contest, prepare_contest_data, rescore_problem, run_moss
+from judge.tasks import build_contest_replay, on_new_contest, prepare_contest_data, refresh_contest_ranking, \
+    rescore_problem, run_moss
+from judge.utils.cache_helper import contest_ranking_cache_factory
 from judge.utils.celery import redirect_to_task_status, task_status_by_id, task_status_url_by_id
 from judge.utils.cms import parse_csv_ranking
 from judge.utils.infinite_paginator import InfinitePaginationMixin
+from judge.utils.iterator import chunk
 from judge.utils.opengraph import generate_opengraph
+from judge.utils.precompressed import PrecompressedFile, PrecompressedJSON, precompressed_file_path
 from judge.utils.problems import _get_result_data, user_attempted_ids, user_completed_ids
+from judge.utils.replay_ranking import ReplayTimelines, get_replay_scorer
+from judge.utils.scoreboard import LiveScoreboard
 from judge.utils.stats import get_bar_chart, get_pie_chart, get_stacked_bar_chart
 from judge.utils.views import SingleObjectFormView, TitleMixin, \
     add_file_response, generic_message, paginate_query_context
@@ -879,7 +887,7 @@ def _serialize_format_data(contest, problems, raw_format_data, frozen):
     return result
 
 
-def make_contest_ranking_json(contest, problems, queryset, frozen=False):
+def make_contest_ranking_json(contest, problems, queryset, frozen=False, submission_count=False):
     # Pre-compute URL templates once to avoid per-row reverse() overhead.
     _user_url_tpl = reverse('user_page', args=['__USERNAME__'])
     _org_url_tpl = reverse('organization_home', args=['__SLUG__'])
@@ -903,6 +911,7 @@ def make_contest_ranking_json(contest, problems, queryset, frozen=False):
         'user__user__username', 'user__user__first_name',
         'rating__rating',
         '_org_short_name', '_org_slug', '_badge_mini', '_badge_name',
+        *(('submission_count',) if submission_count else ()),
     )
 
     participations_data = []
@@ -917,6 +926,7 @@ def make_contest_ranking_json(contest, problems, queryset, frozen=False):
             'rating': row['rating__rating'],
             'user': _serialize_user(row, _user_url_tpl, _org_url_tpl),
             'format_data': _serialize_format_data(contest, problems, row['format_data'], frozen),
+            **({'submission_count': row['submission_count']} if submission_count else {}),
         })
     return participations_data
 
@@ -935,6 +945,114 @@ def _add_ranks_to_participation_json(participations):
         last_key = key
 
 
+def make_contest_ranking_base(contest, user=None, can_edit=False):
+    """Returns (problems, problems_data, contest_dict) with fields shared by all ranking JSON views."""
+    problems = list(
+        contest.contest_problems.select_related('problem').defer('problem__description').order_by('order'),
+    )
+    problems_data = [
+        {
+            'id': prob.id,
+            'code': prob.problem.code,
+            'label': contest.get_label_for_problem(i),
+            'name': prob.problem.name,
+            'points': float(prob.points),
+            'is_pretested': prob.is_pretested,
+            'url': reverse('problem_detail', args=[prob.problem.code]),
+        }
+        for i, prob in enumerate(problems)
+    ]
+    contest_data = {
+        'key': contest.key,
+        'format': contest.format_name,
+        'format_config': contest.format.config,
+        'can_edit': can_edit,
+        **({
+            'admin_url_template': reverse(
+                'admin:judge_contestparticipation_change',
+                args=[0],
+            ).replace('/0/', '/__ID__/'),
+            'can_change_participation': user.has_perm(
+                'judge.change_contestparticipation',
+            ),
+            'disqualify_url': reverse('contest_participation_disqualify', args=[contest.key]),
+        } if can_edit else {}),
+        'points_precision': contest.points_precision,
+        'run_pretests_only': contest.run_pretests_only,
+        'ended': contest.ended,
+        'url_templates': {
+            'all_submissions': reverse('contest_all_user_submissions', args=[contest.key, '__USERNAME__']),
+            'problem_submissions': reverse(
+                'contest_user_submissions',
+                args=[contest.key, '__USERNAME__', '__PROBLEM__'],
+            ),
+        },
+        'rating_config': {
+            'values': RATING_VALUES,
+            'classes': RATING_CLASS,
+            'names': RATING_LEVELS,
+        },
+    }
+    return problems, problems_data, contest_data
+
+
+def contest_ranking_queryset(contest, show_virtual=False, frozen=False):
+    if frozen:
+        queryset = base_contest_frozen_ranking_queryset(contest)
+    else:
+        queryset = base_contest_ranking_queryset(contest)
+    if not show_virtual:
+        queryset = queryset.filter(virtual=ContestParticipation.LIVE)
+    return queryset
+
+
+def make_contest_ranking_data(contest, show_virtual=False, frozen=False):
+    """Returns the full ranking JSON of a contest, as shown to those who cannot edit it."""
+    problems, problems_data, contest_data = make_contest_ranking_base(contest)
+    queryset = contest_ranking_queryset(contest, show_virtual, frozen)
+    participations = make_contest_ranking_json(contest, problems, queryset, frozen=frozen)
+    _add_ranks_to_participation_json(participations)
+    contest_data['is_frozen'] = frozen
+    contest_data['has_rating'] = contest.ratings.exists()
+    return {'contest': contest_data, 'problems': problems_data, 'participations': participations, 'version': None}
+
+
+def add_contest_replay_url(contest, data):
+    if not contest.can_replay or 'contest' not in data:
+        return data
+    return {
+        **data,
+        'contest': {
+            **data['contest'],
+            'replay_url': reverse('contest_replay_data', args=[contest.key, contest.replay_version]),
+            'replay_duration': int((contest.end_time - contest.start_time).total_seconds()),
+        },
+    }
+
+
+def refresh_contest_ranking_cache(contest, show_virtual, frozen, language):
+    contest_ranking_cache_factory(contest, show_virtual, frozen, language).rebuild(
+        lambda: PrecompressedJSON(add_contest_replay_url(contest, make_contest_ranking_data(contest, show_virtual,
+                                                                                            frozen))),
+    )
+
+
+def virtual_participation_subs(participation):
+    """Returns the problem id, points and seconds after starting of each scored submission of a participation."""
+    subs = []
+    for prob_id, points, result, sub_date in (
+        ContestSubmission.objects
+        .filter(participation=participation)
+        .values_list('problem_id', 'points', 'submission__result', 'submission__date')
+        .order_by('submission__date')
+    ):
+        if result in (None, 'CE', 'IE'):
+            continue
+        t = (sub_date - participation.real_start).total_seconds()
+        subs.append([prob_id, float(points), round(t, 3)])
+    return subs
+
+
 class ContestRankingBase(ContestMixin, TitleMixin, DetailView):
     template_name = 'contest/ranking.html'
     tab = None
@@ -955,54 +1073,7 @@ class ContestRankingBase(ContestMixin, TitleMixin, DetailView):
 
     def _build_json_base(self):
         """Returns (problems, problems_data, contest_dict) with fields shared by all ranking JSON views."""
-        contest = self.object
-        problems = list(
-            contest.contest_problems.select_related('problem').defer('problem__description').order_by('order'),
-        )
-        problems_data = [
-            {
-                'id': prob.id,
-                'code': prob.problem.code,
-                'label': contest.get_label_for_problem(i),
-                'name': prob.problem.name,
-                'points': float(prob.points),
-                'is_pretested': prob.is_pretested,
-                'url': reverse('problem_detail', args=[prob.problem.code]),
-            }
-            for i, prob in enumerate(problems)
-        ]
-        contest_data = {
-            'key': contest.key,
-            'format': contest.format_name,
-            'format_config': contest.format.config,
-            'can_edit': self.can_edit,
-            **({
-                'admin_url_template': reverse(
-                    'admin:judge_contestparticipation_change',
-                    args=[0],
-                ).replace('/0/', '/__ID__/'),
-                'can_change_participation': self.request.user.has_perm(
-                    'judge.change_contestparticipation',
-                ),
-                'disqualify_url': reverse('contest_participation_disqualify', args=[contest.key]),
-            } if self.can_edit else {}),
-            'points_precision': contest.points_precision,
-            'run_pretests_only': contest.run_pretests_only,
-            'ended': contest.ended,
-            'url_templates': {
-                'all_submissions': reverse('contest_all_user_submissions', args=[contest.key, '__USERNAME__']),
-                'problem_submissions': reverse(
-                    'contest_user_submissions',
-                    args=[contest.key, '__USERNAME__', '__PROBLEM__'],
-                ),
-            },
-            'rating_config': {
-                'values': RATING_VALUES,
-                'classes': RATING_CLASS,
-                'names': RATING_LEVELS,
-            },
-        }
-        return problems, problems_data, contest_data
+        return make_contest_ranking_base(self.object, self.request.user, self.can_edit)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -1032,9 +1103,14 @@ class ContestRanking(ContestRankingBase):
             return p
         return None
 
+    @property
+    def use_live_scoreboard(self):
+        return settings.VNOJ_LIVE_SCOREBOARD and self._show_full_ranking
+
     @property
     def bypass_cache_ranking(self):
         return (
+            self.use_live_scoreboard or
             self.object.scoreboard_cache_timeout == 0 or
             self.can_edit or
             (self.request.user.is_authenticated and not self.object.can_see_full_scoreboard(self.request.user))
@@ -1048,23 +1124,12 @@ class ContestRanking(ContestRankingBase):
             self.show_virtual = self.request.session.get('show_virtual', False)
 
     def get_ranking_queryset(self):
-        if self.is_frozen:
-            queryset = base_contest_frozen_ranking_queryset(self.object)
-        else:
-            queryset = base_contest_ranking_queryset(self.object)
-        if not self.show_virtual:
-            queryset = queryset.filter(virtual=ContestParticipation.LIVE)
-        return queryset
+        return contest_ranking_queryset(self.object, self.show_virtual, self.is_frozen)
 
     @property
     def _show_full_ranking(self):
         return self.object.can_see_full_scoreboard(self.request.user)
 
-    @property
-    def json_cache_key(self):
-        return f'contest_ranking_json_{self.object.key}_{self.show_virtual}_{self.is_frozen}_' \
-               f'{self.request.LANGUAGE_CODE}'
-
     def _build_ranking_json_data(self):
         contest = self.object
         problems, problems_data, contest_data = self._build_json_base()
@@ -1082,7 +1147,46 @@ class ContestRanking(ContestRankingBase):
         contest_data['is_frozen'] = self.is_frozen
         contest_data['has_rating'] = contest.ratings.exists()
 
-        return {'contest': contest_data, 'problems': problems_data, 'participations': participations}
+        return {'contest': contest_data, 'problems': problems_data, 'participations': participations,
+                'version': None}
+
+    def _build_live_ranking_payload(self):
+        contest = self.object
+        problems, problems_data, contest_data = self._build_json_base()
+        contest_data['is_frozen'] = self.is_frozen
+        contest_data['has_rating'] = contest.ratings.exists()
+        base = self._inject_replay_url({'contest': contest_data, 'problems': problems_data})
+
+        def encode(version, participations):
+            return PrecompressedJSON({**base, 'participations': participations, 'version': version})
+
+        # What differs between viewers is small, and encoded only once per version for each of them.
+        return self.live_scoreboard.payload(partial(self._load_live_rows, problems),
+                                            json.dumps(base, sort_keys=True, cls=DjangoJSONEncoder), encode,
+                                            live_only=not self.show_virtual)
+
+    @property
+    def live_scoreboard(self):
+        return LiveScoreboard.get(self.object.id, self.is_frozen)
+
+    def _load_live_rows(self, problems, ids):
+        queryset = (base_contest_frozen_ranking_queryset if self.is_frozen else base_contest_ranking_queryset)(
+            self.object,
+        )
+        if ids is not None:
+            queryset = queryset.filter(id__in=ids)
+        return make_contest_ranking_json(self.object, problems, queryset, frozen=self.is_frozen, submission_count=True)
+
+    def _build_ranking_delta(self, since):
+        """Returns the participations that changed after version `since`, or None to send the whole ranking."""
+        problems = list(self.object.contest_problems.order_by('order'))
+        delta = self.live_scoreboard.delta(partial(self._load_live_rows, problems), since,
+                                           live_only=not self.show_virtual)
+        if delta is None:
+            return None
+        version, participations, order = delta
+        return {'delta': True, 'since': since, 'version': version, 'is_frozen': self.is_frozen,
+                'participations': participations, 'order': order}
 
     def _build_virtual_json_data(self):
         virtual_part = self._virtual_participation
@@ -1091,17 +1195,7 @@ class ContestRanking(ContestRankingBase):
         contest_data['is_frozen'] = self.is_frozen
         contest_data['has_rating'] = contest.ratings.exists()
 
-        own_subs = []
-        for prob_id, points, result, sub_date in (
-            ContestSubmission.objects
-            .filter(participation=virtual_part)
-            .values_list('problem_id', 'points', 'submission__result', 'submission__date')
-            .order_by('submission__date')
-        ):
-            if result in (None, 'CE', 'IE'):
-                continue
-            t = (sub_date - virtual_part.real_start).total_seconds()
-            own_subs.append([prob_id, float(points), round(t, 3)])
+        own_subs = virtual_participation_subs(virtual_part)
 
         profile = self.request.profile
         _user_url_tpl = reverse('user_page', args=['__USERNAME__'])
@@ -1125,39 +1219,40 @@ class ContestRanking(ContestRankingBase):
                     'badge': None,
                 },
                 'subs': own_subs,
+                'rank_url': reverse('contest_virtual_rank', args=[contest.key]),
             },
         }
 
-    def get_cached_json_ranking_data(self):
+    def get_ranking_payload(self):
+        """Returns the ranking JSON as a PrecompressedJSON, compressed only if it is kept to be served again."""
         if self._virtual_participation:
-            return self._build_virtual_json_data()
+            return PrecompressedJSON(self._inject_replay_url(self._build_virtual_json_data()), compress=False)
+        if self.use_live_scoreboard:
+            return self._build_live_ranking_payload()
         if self.bypass_cache_ranking:
-            return self._build_ranking_json_data()
-        cached = cache.get(self.json_cache_key)
-        if cached is None:
-            cached = self._build_ranking_json_data()
-            cache.set(self.json_cache_key, cached, self.object.scoreboard_cache_timeout)
-        return cached
+            return PrecompressedJSON(self._inject_replay_url(self._build_ranking_json_data()), compress=False)
+        refresh = None
+        if settings.VNOJ_SCOREBOARD_CACHE_CELERY_REFRESH:
+            refresh = partial(refresh_contest_ranking.delay, self.object.key, self.show_virtual, self.is_frozen,
+                              self.request.LANGUAGE_CODE)
+        return contest_ranking_cache_factory(
+            self.object, self.show_virtual, self.is_frozen, self.request.LANGUAGE_CODE,
+        ).get_or_build(lambda: PrecompressedJSON(self._inject_replay_url(self._build_ranking_json_data())), refresh)
 
     def _inject_replay_url(self, data):
-        contest = self.object
-        if not contest.can_replay or 'contest' not in data:
-            return data
-        return {
-            **data,
-            'contest': {
-                **data['contest'],
-                'replay_url': reverse('contest_replay_data', args=[contest.key, contest.replay_version]),
-                'replay_duration': int((contest.end_time - contest.start_time).total_seconds()),
-            },
-        }
+        return add_contest_replay_url(self.object, data)
 
     def get(self, request, *args, **kwargs):
         if 'data' in request.GET:
             self.object = self.get_object()
             self._resolve_show_virtual()
             self.check_can_see_own_scoreboard()
-            return JsonResponse(self._inject_replay_url(self.get_cached_json_ranking_data()))
+            since = request.GET.get('since', '')
+            if since.isdigit() and self.use_live_scoreboard and not self._virtual_participation:
+                delta = self._build_ranking_delta(int(since))
+                if delta is not None:
+                    return JsonResponse(delta)
+            return self.get_ranking_payload().response(request)
         return super().get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
@@ -1169,9 +1264,7 @@ class ContestRanking(ContestRankingBase):
         context['is_frozen'] = self.is_frozen
         context['cache_timeout'] = 0 if self.bypass_cache_ranking else self.object.scoreboard_cache_timeout
         context['can_see_full_submission_list'] = self.object.can_see_full_submission_list(self.request.user)
-        context['ranking_json'] = json.dumps(
-            self._inject_replay_url(self.get_cached_json_ranking_data()),
-        ).translate(_json_script_escapes)
+        context['ranking_json'] = self.get_ranking_payload().text().translate(_json_script_escapes)
         return context
 
 
@@ -1279,56 +1372,110 @@ def contest_replay_data_path(contest):
     return os.path.join(replay_dir, filename), filename
 
 
-def build_contest_replay_data(contest):
-    duration = int((contest.end_time - contest.start_time).total_seconds())
+# Participations and submissions read from the database at once while writing replay data.
+REPLAY_CHUNK_SIZE = 1000
+# How long a client waits before asking again for replay data that is being written.
+REPLAY_RETRY_AFTER = 5
+# How long to wait for replay data being written before writing it again.
+REPLAY_BUILD_LOCK_TIME = 300
 
-    problems = list(
+
+def _contest_replay_problems(contest):
+    return list(
         contest.contest_problems
         .select_related('problem').defer('problem__description').order_by('order'),
     )
 
+
+def _iter_contest_replay_participations(contest, problems):
     parts_qs = contest.users.filter(virtual=ContestParticipation.LIVE)
-    participations_data = make_contest_ranking_json(contest, problems, parts_qs)
-    for p in participations_data:
-        del p['score'], p['cumtime'], p['tiebreaker'], p['format_data']
+    ids = list(parts_qs.order_by('id').values_list('id', flat=True))
+    for chunk_ids in chunk(ids, REPLAY_CHUNK_SIZE):
+        for p in make_contest_ranking_json(contest, problems, parts_qs.filter(id__in=chunk_ids).order_by('id')):
+            del p['score'], p['cumtime'], p['tiebreaker'], p['format_data']
+            yield p
 
+
+def _iter_contest_replay_subs(contest):
     subs_qs = (
         ContestSubmission.objects
         .filter(
             participation__contest=contest,
             participation__virtual=ContestParticipation.LIVE,
         )
-        .values_list('participation_id', 'problem_id', 'points', 'submission__result', 'submission__date')
-        .order_by('submission__date')
+        .values_list('id', 'participation_id', 'problem_id', 'points', 'submission__result', 'submission__date')
+        .order_by('submission__date', 'id')
     )
 
-    subs = []
-    for part_id, prob_id, points, result, sub_date in subs_qs:
-        if result in (None, 'CE', 'IE'):
-            continue
-        t = (sub_date - contest.start_time).total_seconds()
-        subs.append([part_id, prob_id, float(points), round(t, 3)])
+    # Paged by (date, id) rather than read through one query, which the database driver may buffer whole.
+    page = subs_qs
+    while True:
+        rows = list(page[:REPLAY_CHUNK_SIZE])
+        for id, part_id, prob_id, points, result, sub_date in rows:
+            if result in (None, 'CE', 'IE'):
+                continue
+            t = (sub_date - contest.start_time).total_seconds()
+            yield [part_id, prob_id, float(points), round(t, 3)]
+        if len(rows) < REPLAY_CHUNK_SIZE:
+            break
+        id, sub_date = rows[-1][0], rows[-1][-1]
+        page = subs_qs.filter(Q(submission__date__gt=sub_date) | Q(submission__date=sub_date, id__gt=id))
+
 
+def _contest_replay_header(contest, problems):
     return {
         'start': int(contest.start_time.timestamp()),
-        'duration': duration,
+        'duration': int((contest.end_time - contest.start_time).total_seconds()),
         'frozen': 0,
         'problems': [prob.id for prob in problems],
-        'participations': participations_data,
-        'subs': subs,
     }
 
 
+def build_contest_replay_data(contest):
+    problems = _contest_replay_problems(contest)
+    return {
+        **_contest_replay_header(contest, problems),
+        'participations': list(_iter_contest_replay_participations(contest, problems)),
+        'subs': list(_iter_contest_replay_subs(contest)),
+    }
+
+
+def _dump_replay_json(data):
+    return json.dumps(data, separators=(',', ':'))
+
+
 def write_contest_replay_data(contest, data):
     filepath, filename = contest_replay_data_path(contest)
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    tmp = filepath + '.tmp'
-    with open(tmp, 'w') as f:
+    with PrecompressedFile(filepath) as f:
         json.dump(data, f, separators=(',', ':'))
-    os.replace(tmp, filepath)
     return filepath, filename
 
 
+def stream_contest_replay_data(contest):
+    """
+    Writes what write_contest_replay_data(contest, build_contest_replay_data(contest)) does, but a few rows at a time,
+    so that memory use does not grow with the size of the contest.
+    """
+    filepath, filename = contest_replay_data_path(contest)
+    problems = _contest_replay_problems(contest)
+    with PrecompressedFile(filepath) as f:
+        f.write(_dump_replay_json(_contest_replay_header(contest, problems))[:-1])
+        for key, rows in (('participations', _iter_contest_replay_participations(contest, problems)),
+                          ('subs', _iter_contest_replay_subs(contest))):
+            f.write(',"%s":[' % key)
+            for i, row in enumerate(rows):
+                f.write(',' + _dump_replay_json(row) if i else _dump_replay_json(row))
+            f.write(']')
+        f.write('}')
+    return filepath, filename
+
+
+def schedule_contest_replay_data(contest):
+    """Has a worker write the replay data of the current version of a contest, unless one is already doing so."""
+    if cache.add('contest_replay_build:%d:%d' % (contest.id, contest.replay_version), True, REPLAY_BUILD_LOCK_TIME):
+        build_contest_replay.delay(contest.key)
+
+
 class ContestReplayData(ContestMixin, SingleObjectMixin, View):
     def get(self, request, *args, **kwargs):
         contest = self.get_object()
@@ -1340,23 +1487,73 @@ class ContestReplayData(ContestMixin, SingleObjectMixin, View):
         if version != contest.replay_version:
             raise Http404()
 
-        filepath, filename = self.prepare_replay_data(contest)
-
-        if getattr(settings, 'DMOJ_CONTEST_REPLAY_INTERNAL', None):
-            url_path = '%s/%s' % (settings.DMOJ_CONTEST_REPLAY_INTERNAL, filename)
-        else:
-            url_path = None
+        filepath, filename = contest_replay_data_path(contest)
+        if not os.path.exists(filepath):
+            # Normally written by a worker once the contest ended, but it may have been invalidated since.
+            schedule_contest_replay_data(contest)
+            response = HttpResponse(status=503)
+            response['Retry-After'] = REPLAY_RETRY_AFTER
+            return response
 
         response = HttpResponse(content_type='application/json')
         response['Cache-Control'] = 'public, max-age=31536000, immutable'
-        add_file_response(request, response, url_path, filepath)
+        if getattr(settings, 'DMOJ_CONTEST_REPLAY_INTERNAL', None) and \
+                request.META.get('SERVER_SOFTWARE', '').startswith('nginx/'):
+            # nginx can serve the compressed files itself, with gzip_static and brotli_static.
+            add_file_response(request, response, '%s/%s' % (settings.DMOJ_CONTEST_REPLAY_INTERNAL, filename),
+                              filepath)
+        else:
+            encoding, filepath = precompressed_file_path(request, filepath)
+            add_file_response(request, response, None, filepath)
+            if encoding is not None:
+                response['Content-Encoding'] = encoding
+            patch_vary_headers(response, ('Accept-Encoding',))
         return response
 
-    def prepare_replay_data(self, contest):
-        filepath, filename = contest_replay_data_path(contest)
-        if not os.path.exists(filepath):
-            write_contest_replay_data(contest, build_contest_replay_data(contest))
-        return filepath, filename
+
+def contest_replay_timelines(contest):
+    """Returns the ReplayTimelines of the live participants of a contest, made once for each replay version."""
+    def build():
+        duration = int((contest.end_time - contest.start_time).total_seconds())
+        problems = [(prob.id, float(prob.points)) for prob in contest.contest_problems.order_by('order')]
+        participations = contest.users.filter(virtual=ContestParticipation.LIVE).values_list('id', 'is_disqualified')
+        return ReplayTimelines(get_replay_scorer(contest.format_name, contest.format.config, duration), problems,
+                               list(participations), _iter_contest_replay_subs(contest))
+
+    return ReplayTimelines.get((contest.id, contest.replay_version), build)
+
+
+class ContestVirtualRank(ContestMixin, SingleObjectMixin, View):
+    """The rank of the current virtual participation among the live participants, as of some time into the contest."""
+
+    def get(self, request, *args, **kwargs):
+        contest = self.get_object()
+        if not contest.can_replay or not contest.can_see_own_scoreboard(request.user):
+            raise Http404()
+        participation = request.participation
+        if (participation is None or participation.contest_id != contest.id or
+                participation.virtual <= ContestParticipation.LIVE):
+            return JsonResponse({'error': 'not in a virtual participation of this contest'}, status=404)
+
+        # Defaults to now, and cannot be later than that, as what is yet to be submitted is unknown.
+        elapsed = (timezone.now() - participation.real_start).total_seconds()
+        requested = request.GET.get('elapsed', '')
+        if requested.isdigit():
+            elapsed = min(elapsed, int(requested))
+
+        score, cumtime, tiebreaker, rank, total = contest_replay_timelines(contest).rank(
+            virtual_participation_subs(participation), elapsed, participation.is_disqualified,
+        )
+        response = JsonResponse({
+            'elapsed': int(elapsed),
+            'score': score,
+            'cumtime': cumtime,
+            'tiebreaker': tiebreaker,
+            'rank': rank,
+            'total': total,
+        })
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
 
 class ContestMossMixin(ContestMixin, PermissionRequiredMixin):
@@ -1,3 +1,4 @@
+import logging
 from collections import defaultdict
 from functools import partial
 
@@ -6,10 +7,17 @@ from django.shortcuts import render
 from django.utils.translation import gettext as _
 from packaging import version
 
+from judge.judgeapi import bridge_status
 from judge.models import Judge, Language, RuntimeVersion
+from judge.utils.cache_helper import scoreboard_cache_metrics
 
 __all__ = ['status_all', 'status_table']
 
+logger = logging.getLogger('judge.views.status')
+
+# Seconds to wait for the bridge to report its status, so that pages showing it do not hang along with the bridge.
+BRIDGE_STATUS_TIMEOUT = 2
+
 
 def get_judges(request):
     if request.user.is_superuser or request.user.is_staff:
@@ -28,15 +36,36 @@ def status_all(request):
     })
 
 
+def get_bridge_context():
+    try:
+        bridge = bridge_status(timeout=BRIDGE_STATUS_TIMEOUT)
+    except Exception:
+        logger.exception('Failed to get the status of the bridge')
+        bridge = None
+    return {
+        'bridge': bridge,
+        'priority_names': [_('Contest'), _('Normal'), _('Rejudge'), _('Batch rejudge')],
+    }
+
+
 def status_oj(request):
     if not request.user.is_superuser:
         return HttpResponseBadRequest(_('You must be admin to view this content.'), content_type='text/plain')
 
     return render(request, 'status/oj-status.html', {
         'title': _('OJ Status'),
+        'scoreboard_cache': scoreboard_cache_metrics().get(),
+        **get_bridge_context(),
     })
 
 
+def status_bridge(request):
+    if not request.user.is_superuser:
+        return HttpResponseBadRequest(_('You must be admin to view this content.'), content_type='text/plain')
+
+    return render(request, 'status/bridge-status.html', get_bridge_context())
+
+
 def status_table(request):
     see_all, judges = get_judges(request)
     return render(request, 'status/judge-status-table.html', {
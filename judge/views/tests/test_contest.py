@@ -1,17 +1,30 @@
+import gzip
+import json
+import shutil
+import tempfile
+import time
 from unittest.mock import patch
 
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from django.utils import timezone
 
-from judge.models import Solution
+from judge.models import ContestSubmission, Language, Solution, Submission
 from judge.models.tests.util import (
     create_contest,
+    create_contest_participation,
     create_contest_problem,
     create_problem,
     create_solution,
     create_user,
 )
+from judge.tasks import build_contest_replay, build_ended_contest_replays, refresh_contest_ranking
+from judge.utils.cache_helper import contest_ranking_cache_factory
+from judge.utils.replay_ranking import ReplayTimelines
+from judge.utils.scoreboard import LiveScoreboard
+from judge.views.contests import build_contest_replay_data, stream_contest_replay_data
 
 
 class ContestProblemMakePublicTestCase(TestCase):
@@ -145,3 +158,254 @@ class ContestProblemMakePublicTestCase(TestCase):
         self.problem_with_editorial.refresh_from_db()
         self.assertFalse(self.problem_with_editorial.is_public)
         mock_rescore.delay.assert_not_called()
+
+
+class ContestLiveRankingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contest = create_contest(key='test_live_ranking', is_visible=True)
+        create_contest_problem(contest=cls.contest, problem=create_problem(code='live_ranking'))
+        cls.participations = [
+            create_contest_participation(contest=cls.contest, user=create_user(username=username).profile,
+                                         score=score, cumtime=cumtime)
+            for username, score, cumtime in (('first', 100, 10), ('second', 50, 10), ('third', 50, 20))
+        ]
+
+    def setUp(self):
+        cache.clear()
+        LiveScoreboard.clear()
+
+    def get_data(self, **params):
+        response = self.client.get(reverse('contest_ranking', args=[self.contest.key]), {'data': '', **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def update(self, participation, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            for field, value in fields.items():
+                setattr(participation, field, value)
+            participation.save()
+
+    def ranking(self, participations):
+        return [(p['user']['username'], p['rank']) for p in participations]
+
+    def test_full_ranking(self):
+        data = self.get_data()
+        version = data['version']
+        self.assertEqual(self.ranking(data['participations']), [('first', 1), ('second', 2), ('third', 3)])
+
+        self.update(self.participations[2], cumtime=10)
+        data = self.get_data()
+        self.assertEqual(data['version'], version + 1)
+        self.assertEqual(self.ranking(data['participations']), [('first', 1), ('second', 2), ('third', 2)])
+
+        response = self.client.get(reverse('contest_ranking', args=[self.contest.key]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cache_timeout'], 0)
+
+    def test_not_modified(self):
+        url = reverse('contest_ranking', args=[self.contest.key]) + '?data'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.update(self.participations[2], score=200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_delta(self):
+        version = self.get_data()['version']
+        self.update(self.participations[2], score=200)
+        self.update(self.participations[1], cumtime=5)
+
+        delta = self.get_data(since=version)
+        self.assertTrue(delta['delta'])
+        self.assertEqual(delta['version'], version + 2)
+        self.assertEqual(self.ranking(delta['participations']), [('third', 1), ('second', 3)])
+        self.assertEqual(delta['participations'][0]['score'], 200)
+        self.assertEqual(delta['order'], [[self.participations[2].id, 1], [self.participations[0].id, 2],
+                                          [self.participations[1].id, 3]])
+
+        delta = self.get_data(since=delta['version'])
+        self.assertEqual((delta['participations'], len(delta['order'])), ([], 3))
+
+    def test_version_counter_evicted(self):
+        for cumtime in (11, 12, 13):
+            self.update(self.participations[2], cumtime=cumtime)
+        version = self.get_data()['version']
+
+        # Made again later, the counter gives out none of the versions it did before.
+        cache.delete('scoreboard_version:%d' % self.contest.id)
+        with patch('time.time', return_value=time.time() + 1):
+            for cumtime in (14, 15, 16):
+                self.update(self.participations[2], cumtime=cumtime, score=100)
+        data = self.get_data()
+        self.assertNotEqual(data['version'], version)
+        self.assertEqual(self.ranking(data['participations']), [('first', 1), ('third', 2), ('second', 3)])
+        self.assertNotIn('delta', self.get_data(since=version))
+
+    def test_new_and_removed_participations(self):
+        version = self.get_data()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            create_contest_participation(contest=self.contest, user=create_user(username='fourth').profile,
+                                         score=75)
+            self.participations[0].delete()
+
+        delta = self.get_data(since=version)
+        self.assertEqual(self.ranking(delta['participations']), [('fourth', 1)])
+        self.assertEqual([id for id, rank in delta['order']][1:], [p.id for p in self.participations[1:]])
+
+    def test_whole_ranking_changed(self):
+        version = self.get_data()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.contest.save()
+        self.assertNotIn('delta', self.get_data(since=version))
+        self.assertNotIn('delta', self.get_data(since=version + 100))
+
+    def test_virtual_participations(self):
+        version = self.get_data()['version']
+        with self.captureOnCommitCallbacks(execute=True):
+            create_contest_participation(contest=self.contest, user=create_user(username='virtual').profile,
+                                         score=300, virtual=1)
+
+        self.assertEqual(len(self.get_data()['participations']), 3)
+        self.assertEqual(self.get_data(since=version)['participations'], [])
+        data = self.get_data(show_virtual='true')
+        self.assertEqual(self.ranking(data['participations'])[0], ('virtual', 1))
+        self.assertEqual(len(data['participations']), 4)
+
+
+@override_settings(VNOJ_LIVE_SCOREBOARD=False, VNOJ_SCOREBOARD_CACHE_CELERY_REFRESH=True)
+class ContestCachedRankingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.contest = create_contest(key='test_cached_ranking', is_visible=True, scoreboard_cache_timeout=60)
+        cls.participation = create_contest_participation(contest=cls.contest,
+                                                         user=create_user(username='cached').profile, score=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_score(self):
+        response = self.client.get(reverse('contest_ranking', args=[self.contest.key]), {'data': ''})
+        return response.json()['participations'][0]['score']
+
+    @patch('judge.views.contests.refresh_contest_ranking')
+    def test_refreshed_by_task(self, task):
+        self.assertEqual(self.get_score(), 10)
+        self.participation.score = 20
+        self.participation.save()
+        self.assertEqual(self.get_score(), 10)
+
+        ranking_cache = contest_ranking_cache_factory(self.contest, False, False, 'en')
+        cache.set(ranking_cache.get_cache_key(), (0, ranking_cache.get_cache()))
+        self.assertEqual(self.get_score(), 10)
+        self.assertEqual(self.get_score(), 10)
+        task.delay.assert_called_once_with(self.contest.key, False, False, 'en')
+
+        refresh_contest_ranking(self.contest.key, False, False, 'en')
+        self.assertEqual(self.get_score(), 20)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContestReplayDataTestCase(TestCase):
+    fixtures = ['language_all.json']
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.contest = create_contest(key='test_replay', is_visible=True, start_time=now - timezone.timedelta(hours=3),
+                                     end_time=now - timezone.timedelta(hours=1))
+        problem = create_problem(code='replay')
+        cls.contest_problem = contest_problem = create_contest_problem(contest=cls.contest, problem=problem)
+        for i, (username, result) in enumerate((('first', 'AC'), ('second', 'WA'), ('first', 'CE'))):
+            participation = create_contest_participation(contest=cls.contest, user=username)
+            submission = Submission.objects.create(user=participation.user, problem=problem, contest_object=cls.contest,
+                                                   language=Language.get_python3(), result=result, status='D')
+            Submission.objects.filter(id=submission.id).update(date=cls.contest.start_time +
+                                                               timezone.timedelta(minutes=10 * i))
+            ContestSubmission.objects.create(submission=submission, problem=contest_problem,
+                                             participation=participation, points=100 if result == 'AC' else 0)
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('contest_replay_data', args=[self.contest.key, self.contest.replay_version])
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def test_stream(self):
+        filepath, _ = stream_contest_replay_data(self.contest)
+        with open(filepath) as f:
+            content = f.read()
+        self.assertEqual(content, json.dumps(build_contest_replay_data(self.contest), separators=(',', ':')))
+        with gzip.open(filepath + '.gz', 'rt') as f:
+            self.assertEqual(f.read(), content)
+
+        data = json.loads(content)
+        self.assertEqual([p['user']['username'] for p in data['participations']], ['first', 'second'])
+        self.assertEqual([sub[2:] for sub in data['subs']], [[100.0, 0.0], [0.0, 600.0]])
+
+    def test_stream_chunks(self):
+        subs = build_contest_replay_data(self.contest)['subs']
+        # Submissions at the same time are told apart by id across chunks.
+        Submission.objects.filter(contest_object=self.contest).update(date=self.contest.start_time)
+        with patch('judge.views.contests.REPLAY_CHUNK_SIZE', 1):
+            self.assertEqual([sub[:2] for sub in build_contest_replay_data(self.contest)['subs']],
+                             [sub[:2] for sub in subs])
+
+    @patch('judge.views.contests.build_contest_replay')
+    def test_built_after_end(self, task):
+        for _ in range(2):
+            build_ended_contest_replays()
+        task.delay.assert_called_once_with(self.contest.key)
+
+        build_contest_replay(self.contest.key)
+        build_ended_contest_replays()
+        task.delay.assert_called_once_with(self.contest.key)
+
+    @patch('judge.views.contests.build_contest_replay')
+    def test_built_by_task(self, task):
+        for _ in range(2):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '5')
+        task.delay.assert_called_once_with(self.contest.key)
+
+        build_contest_replay(self.contest.key)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['subs']), 2)
+
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), self.client.get(self.url).json())
+
+    def test_virtual_rank(self):
+        ReplayTimelines.clear()
+        self.addCleanup(ReplayTimelines.clear)
+        url = reverse('contest_virtual_rank', args=[self.contest.key])
+        participation = create_contest_participation(contest=self.contest, user='virtual', virtual=1,
+                                                     real_start=timezone.now() - timezone.timedelta(minutes=30))
+        self.client.force_login(participation.user.user)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        participation.user.current_contest = participation
+        participation.user.save()
+        submission = Submission.objects.create(user=participation.user, problem=self.contest_problem.problem,
+                                               contest_object=self.contest, language=Language.get_python3(),
+                                               result='AC', status='D')
+        Submission.objects.filter(id=submission.id).update(date=participation.real_start +
+                                                           timezone.timedelta(minutes=5))
+        ContestSubmission.objects.create(submission=submission, problem=self.contest_problem,
+                                         participation=participation, points=100)
+
+        data = self.client.get(url).json()
+        self.assertEqual((data['score'], data['rank'], data['total']), (100, 2, 3))
+        data = self.client.get(url, {'elapsed': 100}).json()
+        self.assertEqual((data['elapsed'], data['score'], data['rank']), (100, 0, 2))
+        # Asking for a time yet to come gets the standing as of now.
+        self.assertLessEqual(self.client.get(url, {'elapsed': 99999}).json()['elapsed'], 1860)
+
+        response = self.client.get(reverse('contest_ranking', args=[self.contest.key]), {'data': ''})
+        self.assertEqual(response.json()['own']['rank_url'], url)
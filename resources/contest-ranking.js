@@ -4,6 +4,7 @@
  *
  * Entry point: window.renderRankingTable(data)
  *   data — the JSON object returned by the ?data endpoint on the contest ranking view.
+ * window.mergeRankingDelta(data, delta) applies the changes returned by ?data&since=<data.version>.
  */
 
 (function ($) {
@@ -520,6 +521,37 @@
         return html;
     }
 
+    // ─── Live updates ─────────────────────────────────────────────────────────
+
+    /* Applies a ?data&since=<version> response to the data it was requested for.
+     * Returns null if it does not apply, in which case the whole ranking must be fetched again.
+     */
+    window.mergeRankingDelta = function (data, delta) {
+        if (!data || data.version !== delta.since || data.contest.is_frozen !== delta.is_frozen) {
+            return null;
+        }
+
+        var byId = {};
+        var i;
+        for (i = 0; i < data.participations.length; i++) {
+            byId[data.participations[i].id] = data.participations[i];
+        }
+        for (i = 0; i < delta.participations.length; i++) {
+            byId[delta.participations[i].id] = delta.participations[i];
+        }
+
+        var participations = [];
+        for (i = 0; i < delta.order.length; i++) {
+            var p = byId[delta.order[i][0]];
+            if (!p) return null;
+            if (p.rank !== delta.order[i][1]) {
+                p = $.extend({}, p, {rank: delta.order[i][1]});
+            }
+            participations.push(p);
+        }
+        return $.extend({}, data, {version: delta.version, participations: participations});
+    };
+
     // ─── Public entry point ───────────────────────────────────────────────────
 
     window.renderRankingTable = function (data, isNewDataFromBackend) {
@@ -291,18 +291,29 @@
 
     // ─── Fetch helpers ────────────────────────────────────────────────────────
 
-    function fetchReplayData(url, callback) {
+    // How many times to ask again for replay data that the server is still writing.
+    var REPLAY_MAX_RETRIES = 12;
+
+    function fetchReplayData(url, callback, retries) {
         var cacheKey = 'replay_' + url;
         var cached   = sessionStorage.getItem(cacheKey);
         if (cached) {
             try { callback(JSON.parse(cached)); return; } catch (e) { sessionStorage.removeItem(cacheKey); }
         }
+        retries = retries || 0;
         $.ajax({ url: url, dataType: 'json' })
             .done(function (data) {
                 try { sessionStorage.setItem(cacheKey, JSON.stringify(data)); } catch (e) {}
                 callback(data);
             })
-            .fail(function () { callback(null); });
+            .fail(function (xhr) {
+                if (xhr.status === 503 && retries < REPLAY_MAX_RETRIES) {
+                    var delay = parseInt(xhr.getResponseHeader('Retry-After'), 10) || 5;
+                    setTimeout(function () { fetchReplayData(url, callback, retries + 1); }, delay * 1000);
+                } else {
+                    callback(null);
+                }
+            });
     }
 
     function fmtHMS(s) {
@@ -482,10 +493,24 @@
             renderAt(manualElapsed);
         }
 
+        // Until the replay data arrives, if ever, show the standing that the server works out on its own.
+        function showVirtualStanding($standing) {
+            $.getJSON(rankingData.own.rank_url).done(function (data) {
+                if (virtualSubsData) return;
+                $standing.text('Rank ' + data.rank + ' / ' + data.total + ' at ' + fmtHMS(data.elapsed));
+            });
+        }
+
         var _endBtn;
         if (isVirtual) {
+            var $standing = $('<div>').css({ padding: '6px 0', fontSize: '13px' });
+            $('#ranking-container').before($standing);
+            showVirtualStanding($standing);
+            var standingTimer = setInterval(function () { showVirtualStanding($standing); }, 30000);
             fetchReplayData(replayUrl, function (data) {
                 if (!data) return;
+                clearInterval(standingTimer);
+                $standing.remove();
                 virtualSubsData = data;
                 _endBtn = createBar(data.duration);
                 wireFreezeInput();
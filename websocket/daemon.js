@@ -191,6 +191,26 @@ wssSender.on("connection", (socket) => {
         id: messagesPost(request.channel, request.message),
       };
     },
+    /**
+     * @param {WebSocketRawExtended} request
+     * @returns
+     */
+    post_batch(request) {
+      if (!Array.isArray(request.messages)) {
+        return {
+          status: "error",
+          code: "invalid-messages",
+        };
+      }
+      return {
+        status: "success",
+        ids: request.messages.map((message) =>
+          typeof message?.channel === "string"
+            ? messagesPost(message.channel, message.message)
+            : null,
+        ),
+      };
+    },
     last_msg() {
       return {
         status: "success",
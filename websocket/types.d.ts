@@ -29,4 +29,5 @@ export type WebSocketRawExtended = RawData & {
   start: number;
   channel: unknown;
   message: string;
+  messages: unknown;
 };